@@ -0,0 +1,228 @@
+# backend/asr_pool.py
+"""语音识别执行池：固定数量的工作线程 + 有界队列。
+
+每个识别任务在工作线程中占用一个讯飞连接（外加一个接收线程），并发上限即工作线程数。
+队列已满时立即拒绝（AsrSaturatedError），由接口返回 503，避免突发流量拖垮所有请求；
+后台任务可以用 block 在队列上等待空位。
+实时识别（/ws/asr）不经过队列，但与工作线程共用同一组连接名额（live_session），没有空闲名额时同样立即拒绝。
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Iterator, Optional
+
+from dotenv import load_dotenv
+
+from .xf_asr import AsrCancelledError, XfStreamingSession, transcribe_audio_bytes
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+
+class AsrSaturatedError(Exception):
+    pass
+
+
+class AsrTimeoutError(Exception):
+    pass
+
+
+class AsrJob:
+    def __init__(self, audio_bytes: bytes, timeout: float):
+        self.audio_bytes = audio_bytes
+        self.timeout = timeout
+        self.submitted_at = time.monotonic()
+        self.deadline = self.submitted_at + timeout
+        self.future: Future = Future()
+        self.cancel_event = threading.Event()
+        self._session: Optional[XfStreamingSession] = None
+
+    def cancel(self) -> None:
+        """排队中的任务直接取消；执行中的任务关闭讯飞连接并尽快退出。"""
+        self.cancel_event.set()
+        self.future.cancel()
+        session = self._session
+        if session is not None:
+            session.close()
+
+    def _attach_session(self, session: XfStreamingSession) -> None:
+        self._session = session
+        if self.cancel_event.is_set():
+            session.close()
+
+
+class AsrPool:
+    def __init__(self, workers: int = 4, queue_size: int = 16, default_timeout: float = 60):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.default_timeout = default_timeout
+        self._queue: "queue.Queue[Optional[AsrJob]]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        # 讯飞连接名额：工作线程执行任务与实时会话都要先占用一个
+        self._connections = threading.BoundedSemaphore(workers)
+        self._in_flight = 0
+        self._live_sessions = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "cancelled": 0,
+        }
+
+    def submit(self, audio_bytes: bytes, timeout: Optional[float] = None, block: float = 0) -> AsrJob:
+        """入队识别任务。block > 0 时队列已满会最多等待 block 秒空位（阻塞在队列上，不轮询），
+        识别时限从入队成功时开始计算；仍没有空位则抛出 AsrSaturatedError。"""
+        self._ensure_workers()
+        timeout = timeout or self.default_timeout
+        job = AsrJob(audio_bytes, timeout + block)
+        try:
+            if block > 0:
+                self._queue.put(job, timeout=block)
+            else:
+                self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise AsrSaturatedError("ASR queue is full")
+        if block > 0:
+            # 工作线程可能已按较宽的时限开始识别，wait 按收紧后的时限取消任务
+            job.timeout = timeout
+            job.deadline = min(job.deadline, time.monotonic() + timeout)
+        with self._lock:
+            self._stats["submitted"] += 1
+        return job
+
+    def wait(self, job: AsrJob) -> str:
+        """阻塞等待任务结果，超过任务时限则取消并抛出 AsrTimeoutError。"""
+        try:
+            return job.future.result(timeout=max(0.0, job.deadline - time.monotonic()))
+        except FutureTimeoutError:
+            job.cancel()
+            with self._lock:
+                self._stats["timed_out"] += 1
+            raise AsrTimeoutError(f"ASR timed out after {job.timeout:.0f}s")
+
+    def transcribe(self, audio_bytes: bytes, timeout: Optional[float] = None, block: float = 0) -> str:
+        return self.wait(self.submit(audio_bytes, timeout, block))
+
+    async def transcribe_async(self, audio_bytes: bytes, timeout: Optional[float] = None) -> str:
+        """供 async 路由使用：入队后 await 结果，等待期间不占用事件循环。"""
+        job = self.submit(audio_bytes, timeout)
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(job.future)),
+                timeout=max(0.0, job.deadline - time.monotonic()),
+            )
+        except asyncio.TimeoutError:
+            job.cancel()
+            with self._lock:
+                self._stats["timed_out"] += 1
+            raise AsrTimeoutError(f"ASR timed out after {job.timeout:.0f}s")
+        except asyncio.CancelledError:
+            # 客户端断开等导致请求被取消时，一并取消识别任务
+            job.cancel()
+            raise
+
+    @contextmanager
+    def live_session(self) -> Iterator[None]:
+        """实时识别期间占用一个连接名额；名额用尽时抛出 AsrSaturatedError，与队列已满的处理一致。"""
+        if not self._connections.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise AsrSaturatedError("ASR connections are all in use")
+        with self._lock:
+            self._live_sessions += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._live_sessions -= 1
+            self._connections.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+            stats["live_sessions"] = self._live_sessions
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_size"] = self.queue_size
+        stats["workers"] = self.workers
+        return stats
+
+    def shutdown(self) -> None:
+        with self._lock:
+            threads = list(self._threads)
+            self._threads.clear()
+        for _ in threads:
+            self._queue.put(None)
+
+    def _ensure_workers(self) -> None:
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"asr-worker-{len(self._threads)}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                with self._lock:
+                    self._stats["cancelled"] += 1
+                continue
+            # 实时会话占满名额时在这里等待，最多等到任务时限
+            if not self._connections.acquire(timeout=max(0.0, job.deadline - time.monotonic())):
+                job.future.set_exception(AsrTimeoutError("ASR job expired waiting for a connection"))
+                continue
+            remaining = job.deadline - time.monotonic()
+            if remaining <= 0:
+                # 排队期间已超时，调用方已放弃等待
+                self._connections.release()
+                job.future.set_exception(AsrTimeoutError("ASR job expired in queue"))
+                continue
+            with self._lock:
+                self._in_flight += 1
+            try:
+                text = transcribe_audio_bytes(
+                    job.audio_bytes,
+                    timeout=remaining,
+                    cancel_event=job.cancel_event,
+                    on_session=job._attach_session,
+                )
+                job.future.set_result(text)
+                outcome = "completed"
+            except AsrCancelledError as exc:
+                job.future.set_exception(exc)
+                outcome = "cancelled"
+            except Exception as exc:
+                job.future.set_exception(exc)
+                outcome = "failed"
+            finally:
+                job.audio_bytes = b""
+                self._connections.release()
+                with self._lock:
+                    self._in_flight -= 1
+            with self._lock:
+                self._stats[outcome] += 1
+
+
+asr_pool = AsrPool(
+    workers=int(os.getenv("XF_ASR_WORKERS", "4")),
+    queue_size=int(os.getenv("XF_ASR_QUEUE_SIZE", "16")),
+    default_timeout=float(os.getenv("XF_ASR_TIMEOUT", "60")),
+)
@@ -0,0 +1,106 @@
+# backend/benchmarks/expense_parser.py
+"""记账文本解析基准：在语料上对比旧的关键词线性扫描与编译后的解析器（准确率 + 单次耗时）。
+
+语料见 expense_corpus.jsonl，每行 {text, amount, currency, category}；amount 为 null 表示不应识别出金额，
+currency 为 null 表示文本未说明币种（接口默认按 CNY 记账）。
+
+运行：python -m backend.benchmarks.expense_parser
+"""
+import json
+import re
+import time
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from ..expense_parser import parse_expense_text
+
+CORPUS_PATH = Path(__file__).with_name("expense_corpus.jsonl")
+
+
+def _legacy_parse(text: str) -> dict:
+    # 旧实现（main.py 中的 _parse_amount / _detect_currency / _detect_category），仅用于对比
+    amount = None
+    match = re.search(r"(\d+(?:\.\d+)?)", text.replace(",", ""))
+    if match:
+        try:
+            amount = Decimal(match.group(1))
+        except (InvalidOperation, ValueError):
+            amount = None
+    currency_map = {
+        "美元": "USD", "美金": "USD", "usd": "USD", "日元": "JPY", "日幣": "JPY", "日币": "JPY", "日圓": "JPY",
+        "韩元": "KRW", "韓元": "KRW", "欧元": "EUR", "歐元": "EUR", "英镑": "GBP", "英鎊": "GBP",
+        "港币": "HKD", "港幣": "HKD", "人民币": "CNY", "人民幣": "CNY", "rmb": "CNY",
+        "元": "CNY", "块": "CNY", "块钱": "CNY",
+    }
+    currency = None
+    lowered = text.lower()
+    for keyword, code in currency_map.items():
+        if keyword in text or keyword in lowered:
+            currency = code
+            break
+    category_keywords = [
+        ("food", ["餐", "吃", "饭", "早餐", "午餐", "晚餐", "小吃", "美食", "咖啡", "餐厅", "酒吧"]),
+        ("transport", ["地铁", "飞机", "火车", "打车", "出租", "公交", "高铁", "车票", "交通", "公交卡", "机票"]),
+        ("hotel", ["酒店", "住宿", "民宿", "旅馆", "客栈", "入住"]),
+        ("shopping", ["购物", "买", "购买", "纪念品", "特产", "伴手礼", "礼物"]),
+        ("entertainment", ["门票", "景点", "游玩", "娱乐", "乐园", "演出", "展览", "体验"]),
+    ]
+    category = "other"
+    for name, keywords in category_keywords:
+        if any(keyword in text for keyword in keywords):
+            category = name
+            break
+    return {"amount": amount, "currency": currency, "category": category}
+
+
+def load_corpus() -> list:
+    with CORPUS_PATH.open(encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def _accuracy(parse, corpus) -> dict:
+    hits = {"amount": 0, "currency": 0, "category": 0, "all": 0}
+    for case in corpus:
+        parsed = parse(case["text"])
+        expected_amount = case["amount"]
+        amount_ok = (
+            parsed["amount"] is None if expected_amount is None
+            else parsed["amount"] is not None and abs(float(parsed["amount"]) - expected_amount) < 1e-6
+        )
+        # 与接口一致：未识别出币种时按 CNY 记账
+        currency_ok = (parsed["currency"] or "CNY") == (case["currency"] or "CNY")
+        category_ok = parsed["category"] == case["category"]
+        hits["amount"] += amount_ok
+        hits["currency"] += currency_ok
+        hits["category"] += category_ok
+        hits["all"] += amount_ok and currency_ok and category_ok
+    return {key: value / len(corpus) for key, value in hits.items()}
+
+
+def _time_per_call(parse, corpus, repeat: int) -> float:
+    texts = [case["text"] for case in corpus]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            parse(text)
+    return (time.perf_counter() - start) / (repeat * len(texts))
+
+
+def main(repeat: int = 200) -> None:
+    corpus = load_corpus()
+    print(f"Corpus: {len(corpus)} transcripts")
+    for name, parse in (("legacy", _legacy_parse), ("compiled", parse_expense_text)):
+        acc = _accuracy(parse, corpus)
+        per_call = _time_per_call(parse, corpus, repeat)
+        print(
+            f"{name:>9}: amount {acc['amount']:.0%}  currency {acc['currency']:.0%}  "
+            f"category {acc['category']:.0%}  all fields {acc['all']:.0%}  | {per_call * 1e6:.1f} µs/call"
+        )
+    # 输入变长时的单次耗时：编译后的解析器应随文本长度线性增长，而不是随关键词数增长
+    long_text = "今天在市中心逛了一天，" * 20 + "晚饭吃火锅花了三百五十块"
+    for name, parse in (("legacy", _legacy_parse), ("compiled", parse_expense_text)):
+        print(f"{name:>9}: long transcript ({len(long_text)} chars) {_time_per_call(parse, [{'text': long_text}], repeat) * 1e6:.1f} µs/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# backend/benchmarks/json_repair.py
+"""LLM JSON 容错解析基准：在手写语料与随机变异的行程上对比 json.loads 与 repair_json（恢复率 + 单次耗时）。
+
+- json_repair_corpus.jsonl：每行 {name, text, kinds, truncated, days}，kinds 为应报告的修复类型，days 为应恢复的完整天数
+- 随机变异以 plan_sample.json 为原型：末尾逗号、字符串内原始换行、未转义引号、任意位置截断，以及它们的组合；
+  截断样本要求恰好恢复截断点之前完整的天，且每一天与原文一致
+
+运行：python -m backend.benchmarks.json_repair
+"""
+import json
+import random
+import re
+import time
+from pathlib import Path
+
+from ..json_repair import JsonRepairError, repair_json
+
+CORPUS_PATH = Path(__file__).with_name("json_repair_corpus.jsonl")
+SAMPLE_PATH = Path(__file__).with_name("plan_sample.json")
+
+
+def load_corpus() -> list:
+    with CORPUS_PATH.open(encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def _dump_plan(plan: dict) -> tuple:
+    """序列化行程并返回 (文本, 每一天结束位置)，用于计算截断点之前有几天是完整的。"""
+    parts = []
+    day_ends = []
+    offset = 0
+
+    def emit(chunk: str) -> None:
+        nonlocal offset
+        parts.append(chunk)
+        offset += len(chunk)
+
+    emit("{")
+    for index, (key, value) in enumerate(plan.items()):
+        emit((", " if index else "") + json.dumps(key, ensure_ascii=False) + ": ")
+        if key != "days":
+            emit(json.dumps(value, ensure_ascii=False))
+            continue
+        emit("[")
+        for day_index, day in enumerate(value):
+            emit((", " if day_index else "") + json.dumps(day, ensure_ascii=False))
+            day_ends.append(offset)
+        emit("]")
+    emit("}")
+    return "".join(parts), day_ends
+
+
+def _trailing_commas(text: str, rng: random.Random) -> str:
+    # 样本字符串中不含括号，所有 } / ] 都是结构字符
+    return re.sub(r"(?<=[\]}\"\d])(?=[\]}])", lambda m: "," if rng.random() < 0.3 else "", text)
+
+
+def _raw_newlines(text: str, rng: random.Random) -> str:
+    return text.replace("\\n", "\n")
+
+
+def _unescaped_quotes(text: str, rng: random.Random) -> str:
+    return text.replace('\\"', '"')
+
+
+MUTATIONS = {
+    "trailing_comma": [_trailing_commas],
+    "raw_newline": [_raw_newlines],
+    "unescaped_quote": [_unescaped_quotes],
+    "combined": [_trailing_commas, _raw_newlines, _unescaped_quotes],
+}
+
+
+def _fuzz_cases(plan: dict, count: int, seed: int) -> list:
+    """返回 [(类型, 文本, 期望值, 期望完整天数)]；期望天数为 None 表示应完整恢复。"""
+    rng = random.Random(seed)
+    text, day_ends = _dump_plan(plan)
+    cases = []
+    for name, steps in MUTATIONS.items():
+        for _ in range(count):
+            mutated = text
+            for step in steps:
+                mutated = step(mutated, rng)
+            cases.append((name, mutated, plan, None))
+    for _ in range(count):
+        # 截断发生在原文上，便于按偏移计算期望的完整天数
+        cut = rng.randrange(1, len(text))
+        cases.append(("truncated", text[:cut], plan, sum(1 for end in day_ends if end <= cut)))
+    for _ in range(count):
+        cut = rng.randrange(1, len(text))
+        complete = sum(1 for end in day_ends if end <= cut)
+        cases.append(("truncated+raw_newline", _raw_newlines(text[:cut], rng), plan, complete))
+    return cases
+
+
+def _strict(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def _tolerant(text: str):
+    try:
+        return repair_json(text).value
+    except JsonRepairError:
+        return None
+
+
+def _recovered(value, expected: dict, complete_days) -> bool:
+    if not isinstance(value, dict):
+        return False
+    if complete_days is None:
+        return value == expected
+    days = value.get("days") or []
+    return len(days) == complete_days and days == expected["days"][:complete_days]
+
+
+def _check_corpus(corpus: list) -> list:
+    failures = []
+    for case in corpus:
+        try:
+            result = repair_json(case["text"])
+        except JsonRepairError as exc:
+            failures.append(f"{case['name']}: {exc}")
+            continue
+        days = len(result.value.get("days") or []) if isinstance(result.value, dict) else 0
+        if result.kinds != sorted(case["kinds"]) or result.truncated != case["truncated"] or days != case["days"]:
+            failures.append(f"{case['name']}: kinds={result.kinds} truncated={result.truncated} days={days}")
+    return failures
+
+
+def main(count: int = 200, seed: int = 7) -> None:
+    corpus = load_corpus()
+    failures = _check_corpus(corpus)
+    strict_ok = sum(_strict(case["text"]) is not None for case in corpus)
+    print(f"Corpus: {len(corpus)} broken outputs  strict json.loads {strict_ok}/{len(corpus)}  "
+          f"repair_json {len(corpus) - len(failures)}/{len(corpus)} as expected")
+    for failure in failures:
+        print(f"  ✗ {failure}")
+
+    plan = json.loads(SAMPLE_PATH.read_text(encoding="utf-8"))
+    cases = _fuzz_cases(plan, count, seed)
+    print(f"Fuzz: {len(cases)} mutated plans (seed {seed}, {len(_dump_plan(plan)[0])} chars each before mutation)")
+    for kind in [*MUTATIONS, "truncated", "truncated+raw_newline"]:
+        group = [case for case in cases if case[0] == kind]
+        strict = sum(_recovered(_strict(text), expected, days) for _, text, expected, days in group)
+        start = time.perf_counter()
+        values = [_tolerant(text) for _, text, _, _ in group]
+        per_call = (time.perf_counter() - start) / len(group)
+        tolerant = sum(_recovered(value, expected, days) for value, (_, _, expected, days) in zip(values, group))
+        print(f"{kind:>22}: json.loads {strict / len(group):.0%}  repair_json {tolerant / len(group):.0%}  | {per_call * 1e6:.0f} µs/call")
+    text = _dump_plan(plan)[0]
+    repeat = 200
+    start = time.perf_counter()
+    for _ in range(repeat):
+        json.loads(text)
+    strict_time = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        repair_json(text)
+    print(f"valid plan: json.loads {strict_time * 1e6:.0f} µs  repair_json {(time.perf_counter() - start) / repeat * 1e6:.0f} µs "
+          "(repair_json only runs after json.loads fails)")
+
+
+if __name__ == "__main__":
+    main()
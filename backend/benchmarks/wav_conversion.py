@@ -0,0 +1,76 @@
+# backend/benchmarks/wav_conversion.py
+"""WAV 转 16kHz 单声道 PCM 的微基准：对比旧的逐样本 Python 循环与向量化实现。
+
+运行：python -m backend.benchmarks.wav_conversion
+"""
+import io
+import time
+import wave
+from array import array
+
+import numpy as np
+
+from ..xf_asr import _wav_to_mono16k_pcm
+
+
+def _legacy_wav_to_mono16k_pcm(audio_bytes: bytes) -> bytes:
+    # 旧实现（逐样本下混 + 线性插值），仅用于对比
+    with wave.open(io.BytesIO(audio_bytes), 'rb') as wav:
+        nch = wav.getnchannels()
+        sr = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    samples = array('h')
+    samples.frombytes(frames)
+    if nch == 2:
+        mono = array('h', ((l + r) // 2 for l, r in zip(samples[0::2], samples[1::2])))
+    else:
+        mono = samples
+    ratio = 16000 / sr
+    new_len = int(len(mono) * ratio)
+    out = array('h')
+    for i in range(new_len):
+        src_pos = i / ratio
+        j = int(src_pos)
+        if j + 1 < len(mono):
+            frac = src_pos - j
+            val = int(mono[j] * (1 - frac) + mono[j + 1] * frac)
+        else:
+            val = int(mono[-1])
+        out.append(max(-32768, min(32767, val)))
+    return out.tobytes()
+
+
+def _make_clip(seconds: float, sample_rate: int, channels: int) -> bytes:
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.1 * np.sin(2 * np.pi * 3000 * t)
+    frames = np.repeat(tone[:, None], channels, axis=1)
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((frames * 32767).astype('<i2').tobytes())
+    return buf.getvalue()
+
+
+def _best_of(fn, audio: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(audio)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    print(f"{'clip':<24}{'legacy (s)':>12}{'vectorized (s)':>16}{'speedup':>10}")
+    for seconds, sample_rate, channels in ((10, 44100, 2), (30, 44100, 2), (60, 44100, 2), (60, 48000, 1)):
+        audio = _make_clip(seconds, sample_rate, channels)
+        legacy = _best_of(_legacy_wav_to_mono16k_pcm, audio, 1)
+        vectorized = _best_of(_wav_to_mono16k_pcm, audio, 3)
+        label = f"{seconds}s {sample_rate}Hz {channels}ch"
+        print(f"{label:<24}{legacy:>12.3f}{vectorized:>16.3f}{legacy / vectorized:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# backend/budget_aggregates.py
+"""预算汇总：按 (budget_id, category, currency) 增量维护的支出合计与笔数。
+
+- 新增/删除支出时同步更新，读取汇总无需拉取全部支出明细
+- 本地账本记录已计入的支出 ID，重复应用同一笔支出不会重复累加
+- 汇总缺失或超过 TTL 时由调用方用原始支出行重建；verify 可比对并修复偏差
+- 数据保存在本机 SQLite，同一主机的多个 uvicorn worker 共享；多主机部署依赖 TTL 收敛
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+
+def _to_decimal(value) -> Decimal:
+    try:
+        return Decimal(str(value)) if value is not None else Decimal("0")
+    except (InvalidOperation, ValueError):
+        return Decimal("0")
+
+
+class BudgetAggregates:
+    def __init__(self, db_path: Optional[str] = None, ttl_seconds: float = 600):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._memory_conn: Optional[sqlite3.Connection] = None
+        self._stats = {"hits": 0, "misses": 0, "rebuilds": 0, "inserts": 0, "deletes": 0, "repairs": 0}
+        if self.db_path:
+            try:
+                Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._init_db()
+            except (OSError, sqlite3.Error) as exc:
+                print(f"⚠️ Budget aggregate DB unavailable, using memory only: {exc}")
+                self.db_path = None
+        if not self.db_path:
+            self._memory_conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self._init_db()
+
+    @contextmanager
+    def _transaction(self):
+        """串行化本进程内的读改写；SQLite 自身的写锁负责跨 worker 的互斥。"""
+        with self._lock:
+            if self._memory_conn is not None:
+                with self._memory_conn:
+                    yield self._memory_conn
+                return
+            with closing(sqlite3.connect(self.db_path, timeout=5)) as conn, conn:
+                yield conn
+
+    def _init_db(self) -> None:
+        with self._transaction() as conn:
+            if self.db_path:
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS budget_aggregates ("
+                "budget_id TEXT NOT NULL, category TEXT NOT NULL, currency TEXT NOT NULL, "
+                "total TEXT NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (budget_id, category, currency))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS budget_aggregate_ledger ("
+                "expense_id TEXT PRIMARY KEY, budget_id TEXT NOT NULL, category TEXT NOT NULL, "
+                "currency TEXT NOT NULL, amount TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS budget_aggregate_ledger_budget ON budget_aggregate_ledger (budget_id)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS budget_aggregate_state ("
+                "budget_id TEXT PRIMARY KEY, built_at REAL NOT NULL)"
+            )
+
+    def get(self, budget_id: str) -> Optional[dict]:
+        """返回汇总；尚未建立或已超过 TTL 时返回 None，由调用方重建。"""
+        budget_id = str(budget_id)
+        with self._transaction() as conn:
+            state = conn.execute(
+                "SELECT built_at FROM budget_aggregate_state WHERE budget_id = ?", (budget_id,)
+            ).fetchone()
+            if state is None or state[0] + self.ttl_seconds <= time.time():
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            return self._summarize(conn, budget_id)
+
+    def rebuild(self, budget_id: str, expenses: Iterable[dict]) -> dict:
+        """用原始支出行替换该预算的账本与汇总。"""
+        budget_id = str(budget_id)
+        with self._transaction() as conn:
+            self._clear(conn, budget_id)
+            for expense in expenses:
+                self._add(conn, budget_id, expense)
+            conn.execute(
+                "INSERT OR REPLACE INTO budget_aggregate_state (budget_id, built_at) VALUES (?, ?)",
+                (budget_id, time.time()),
+            )
+            self._stats["rebuilds"] += 1
+            return self._summarize(conn, budget_id)
+
+    def verify(self, budget_id: str, expenses: Iterable[dict]) -> tuple[dict, bool]:
+        """与原始支出行比对，不一致时以原始数据为准重建。返回 (汇总, 是否一致)。"""
+        expenses = list(expenses)
+        current = self.get(budget_id)
+        rebuilt = self.rebuild(budget_id, expenses)
+        consistent = current is not None and current["breakdown"] == rebuilt["breakdown"]
+        if current is not None and not consistent:
+            with self._lock:
+                self._stats["repairs"] += 1
+        return rebuilt, consistent
+
+    def apply_insert(self, expense: dict) -> None:
+        self.apply_inserts([expense])
+
+    def apply_inserts(self, expenses: Iterable[dict]) -> None:
+        """在一个事务中计入多笔新增支出（批量导入使用）。"""
+        with self._transaction() as conn:
+            built: dict = {}
+            for expense in expenses:
+                budget_id = str(expense.get("budget_id"))
+                if budget_id not in built:
+                    built[budget_id] = self._is_built(conn, budget_id)
+                # 汇总尚未建立时无需维护，下次读取会整体重建
+                if built[budget_id] and self._add(conn, budget_id, expense):
+                    self._stats["inserts"] += 1
+
+    def apply_delete(self, expense: dict) -> None:
+        budget_id = str(expense.get("budget_id"))
+        expense_id = str(expense.get("id"))
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT category, currency, amount FROM budget_aggregate_ledger WHERE expense_id = ?",
+                (expense_id,),
+            ).fetchone()
+            if row is None:
+                return
+            category, currency, amount = row
+            conn.execute("DELETE FROM budget_aggregate_ledger WHERE expense_id = ?", (expense_id,))
+            self._bump(conn, budget_id, category, currency, -_to_decimal(amount), -1)
+            self._stats["deletes"] += 1
+
+    def invalidate(self, budget_id: str) -> None:
+        with self._transaction() as conn:
+            self._clear(conn, str(budget_id))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["persistent"] = bool(self.db_path)
+        return stats
+
+    @staticmethod
+    def _is_built(conn, budget_id: str) -> bool:
+        return conn.execute(
+            "SELECT 1 FROM budget_aggregate_state WHERE budget_id = ?", (budget_id,)
+        ).fetchone() is not None
+
+    @staticmethod
+    def _clear(conn, budget_id: str) -> None:
+        conn.execute("DELETE FROM budget_aggregates WHERE budget_id = ?", (budget_id,))
+        conn.execute("DELETE FROM budget_aggregate_ledger WHERE budget_id = ?", (budget_id,))
+        conn.execute("DELETE FROM budget_aggregate_state WHERE budget_id = ?", (budget_id,))
+
+    def _add(self, conn, budget_id: str, expense: dict) -> bool:
+        category = expense.get("category") or "other"
+        currency = expense.get("currency") or "CNY"
+        amount = _to_decimal(expense.get("amount"))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO budget_aggregate_ledger (expense_id, budget_id, category, currency, amount) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (str(expense.get("id")), budget_id, category, currency, str(amount)),
+        )
+        if cursor.rowcount == 0:
+            return False
+        self._bump(conn, budget_id, category, currency, amount, 1)
+        return True
+
+    @staticmethod
+    def _bump(conn, budget_id: str, category: str, currency: str, delta: Decimal, count_delta: int) -> None:
+        row = conn.execute(
+            "SELECT total, count FROM budget_aggregates WHERE budget_id = ? AND category = ? AND currency = ?",
+            (budget_id, category, currency),
+        ).fetchone()
+        total = _to_decimal(row[0]) + delta if row else delta
+        count = (row[1] if row else 0) + count_delta
+        if count <= 0:
+            conn.execute(
+                "DELETE FROM budget_aggregates WHERE budget_id = ? AND category = ? AND currency = ?",
+                (budget_id, category, currency),
+            )
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO budget_aggregates (budget_id, category, currency, total, count) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (budget_id, category, currency, str(total), count),
+        )
+
+    @staticmethod
+    def _summarize(conn, budget_id: str) -> dict:
+        rows = conn.execute(
+            "SELECT category, currency, total, count FROM budget_aggregates "
+            "WHERE budget_id = ? ORDER BY category, currency",
+            (budget_id,),
+        ).fetchall()
+        total_spent = Decimal("0")
+        count = 0
+        by_category: dict = {}
+        by_currency: dict = {}
+        breakdown = []
+        for category, currency, total, row_count in rows:
+            amount = _to_decimal(total)
+            total_spent += amount
+            count += row_count
+            by_category[category] = by_category.get(category, Decimal("0")) + amount
+            by_currency[currency] = by_currency.get(currency, Decimal("0")) + amount
+            breakdown.append({"category": category, "currency": currency, "total": float(amount), "count": row_count})
+        return {
+            "total_spent": float(total_spent),
+            "count": count,
+            "by_category": {key: float(value) for key, value in by_category.items()},
+            "by_currency": {key: float(value) for key, value in by_currency.items()},
+            "breakdown": breakdown,
+        }
+
+
+_default_db = str(Path(__file__).with_name(".cache") / "budget_aggregates.sqlite3")
+
+budget_aggregates = BudgetAggregates(
+    # 置空时仅保存在进程内存中
+    db_path=os.getenv("BUDGET_AGGREGATE_DB", _default_db) or None,
+    ttl_seconds=float(os.getenv("BUDGET_AGGREGATE_TTL_SECONDS", "600")),
+)
@@ -0,0 +1,75 @@
+# backend/budget_owner_cache.py
+"""预算归属缓存：(budget_id, user_id) → 预算行，短 TTL 的进程内 LRU。
+
+支出接口命中缓存时可省去一次对 budgets 表的查询；只缓存归属校验成功的结果，
+update_budget / delete_budget 会同步更新或失效对应条目。其他 worker 上的修改最多延迟 TTL 秒可见。
+"""
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+
+class BudgetOwnerCache:
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 30):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple[str, str], tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, budget_id: str, user_id: str) -> Optional[dict]:
+        key = (str(budget_id), str(user_id))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return copy.deepcopy(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, budget_id: str, user_id: str, budget: dict) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        key = (str(budget_id), str(user_id))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(budget))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, budget_id: str) -> None:
+        """删除该预算的所有条目（不区分用户）。"""
+        budget_id = str(budget_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == budget_id]:
+                del self._entries[key]
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["ttl_seconds"] = self.ttl_seconds
+        return stats
+
+
+budget_owner_cache = BudgetOwnerCache(
+    max_entries=int(os.getenv("BUDGET_OWNER_CACHE_MAX_ENTRIES", "2048")),
+    # 置 0 可关闭缓存，每次都查询 budgets 表
+    ttl_seconds=float(os.getenv("BUDGET_OWNER_CACHE_TTL_SECONDS", "30")),
+)
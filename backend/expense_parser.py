@@ -0,0 +1,278 @@
+# backend/expense_parser.py
+"""从记账文本（多为语音识别结果）中解析金额、币种与类别。
+
+- 关键词表在导入时编译成一个正则，按长度降序排列，单次扫描即得到最长匹配
+- 金额支持阿拉伯数字（1,200 / 1.5万 / 2k）与中文数字（三百五十块、两千五、一万二、三块五毛）
+- 每个字段附带 0~1 的置信度，调用方可据此决定是否需要用户确认
+"""
+import re
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+CURRENCY_KEYWORDS: Dict[str, str] = {
+    "美元": "USD", "美金": "USD", "usd": "USD", "$": "USD",
+    "日元": "JPY", "日币": "JPY", "日幣": "JPY", "日圓": "JPY", "円": "JPY", "jpy": "JPY",
+    "韩元": "KRW", "韓元": "KRW", "韩币": "KRW", "krw": "KRW", "₩": "KRW",
+    "欧元": "EUR", "歐元": "EUR", "eur": "EUR", "€": "EUR",
+    "英镑": "GBP", "英鎊": "GBP", "gbp": "GBP", "£": "GBP",
+    "港币": "HKD", "港幣": "HKD", "港元": "HKD", "hkd": "HKD",
+    "泰铢": "THB", "泰銖": "THB", "thb": "THB",
+    "新台币": "TWD", "台币": "TWD", "twd": "TWD",
+    "人民币": "CNY", "人民幣": "CNY", "rmb": "CNY", "cny": "CNY", "¥": "CNY", "￥": "CNY",
+    # 泛指的货币单位，只在没有更明确的币种时采用
+    "元": "CNY", "块": "CNY", "块钱": "CNY", "圆": "CNY",
+}
+_GENERIC_CURRENCY_KEYWORDS = {"元", "块", "块钱", "圆"}
+
+CATEGORY_KEYWORDS: Dict[str, List[str]] = {
+    "food": [
+        "餐", "吃", "饭", "早餐", "午餐", "晚餐", "早饭", "午饭", "晚饭", "夜宵", "宵夜", "小吃", "美食",
+        "咖啡", "餐厅", "酒吧", "奶茶", "饮料", "外卖", "火锅", "烧烤", "水果", "零食", "甜品", "啤酒",
+    ],
+    "transport": [
+        "地铁", "飞机", "火车", "打车", "打的", "出租", "公交", "高铁", "动车", "车票", "交通", "公交卡",
+        "机票", "船票", "滴滴", "网约车", "加油", "油费", "停车", "过路费", "租车", "大巴", "巴士", "轮渡",
+    ],
+    "hotel": ["酒店", "住宿", "民宿", "旅馆", "客栈", "入住", "房费", "宾馆", "青旅", "住了"],
+    "shopping": [
+        "购物", "买", "购买", "纪念品", "特产", "伴手礼", "礼物", "超市", "商场", "衣服", "化妆品", "免税",
+    ],
+    "entertainment": [
+        "门票", "景点", "游玩", "娱乐", "乐园", "演出", "展览", "体验", "电影", "温泉", "博物馆", "滑雪",
+        "索道", "表演", "ktv",
+    ],
+}
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+_CN_BIG_UNITS = {"万": 10_000, "亿": 100_000_000}
+_CN_NUM_CHARS = "".join(_CN_DIGITS) + "".join(_CN_UNITS) + "".join(_CN_BIG_UNITS)
+_CN_DIGIT_CHARS = "".join(_CN_DIGITS)
+
+_SCALE_SUFFIXES = {"万": Decimal(10_000), "w": Decimal(10_000), "千": Decimal(1000), "k": Decimal(1000), "百": Decimal(100)}
+_MONEY_UNITS = {"块钱": Decimal(1), "块": Decimal(1), "元": Decimal(1), "圆": Decimal(1), "毛钱": Decimal("0.1"), "毛": Decimal("0.1"), "角": Decimal("0.1")}
+# 金额前常见的提示词，用于在没有货币单位时判断哪个数字是金额
+_AMOUNT_CUES = ("花了", "花", "付了", "付", "共", "一共", "总共", "合计", "消费", "用了", "支付", "价格", "价钱", "费用")
+
+# 单个中文数字只在紧跟货币单位时才算（“三块”），否则“一天”“一起”之类的匹配会占掉大部分扫描时间
+_NUM = (
+    rf"\d+(?:,\d{{3}})*(?:\.\d+)?"
+    rf"|[{_CN_NUM_CHARS}]{{2,}}(?:点[{_CN_DIGIT_CHARS}]+)?"
+    rf"|[{_CN_NUM_CHARS}](?:点[{_CN_DIGIT_CHARS}]+)?(?=\s*(?:块|元|圆|毛|角))"
+)
+_AMOUNT_RE = re.compile(
+    rf"(?P<num>{_NUM})"
+    r"(?P<scale>[万千百]|[kKwW](?![a-zA-Z]))?"
+    r"\s*"
+    r"(?:(?P<unit>块钱|块|元|圆|毛钱|毛|角)"
+    # “三块五毛二分”“十二块五”：元后面跟角/分；省略“毛”的口语只接受中文数字，避免误吞“50块3个”
+    rf"(?:(?P<jiao>[{_CN_DIGIT_CHARS}\d])[毛角](?:(?P<fen>[{_CN_DIGIT_CHARS}\d])分)?"
+    rf"|(?P<jiao_spoken>[{_CN_DIGIT_CHARS}])(?![{_CN_NUM_CHARS}个次人张件天晚]))?)?"
+)
+_CURRENCY_SYMBOLS = "$¥￥€£₩"
+
+
+def _keyword_pattern(keywords) -> "re.Pattern[str]":
+    # 按长度降序排列：正则分支从左到右尝试，同一位置先命中更长的关键词。
+    # 关键词统一小写、调用方先把文本转小写，不用 IGNORECASE（会让 re 放弃首字符预筛，慢一个数量级）
+    ordered = sorted({keyword.lower() for keyword in keywords}, key=len, reverse=True)
+    return re.compile("|".join(re.escape(keyword) for keyword in ordered))
+
+
+_CURRENCY_RE = _keyword_pattern(CURRENCY_KEYWORDS)
+# 币种与类别关键词合并成一个正则，一次扫描同时得到两类命中
+_KEYWORD_LOOKUP: Dict[str, Tuple[str, str]] = {
+    **{keyword.lower(): ("category", category) for category, keywords in CATEGORY_KEYWORDS.items() for keyword in keywords},
+    **{keyword.lower(): ("currency", code) for keyword, code in CURRENCY_KEYWORDS.items()},
+}
+_KEYWORD_RE = _keyword_pattern(_KEYWORD_LOOKUP)
+
+
+def parse_chinese_number(text: str) -> Optional[Decimal]:
+    """解析中文数字：三百五十、两千五（=2500）、一万二（=12000）、一百零五、三点五。"""
+    if not text:
+        return None
+    integer_part, _, decimal_part = text.partition("点")
+    total = 0
+    section = 0
+    number = 0
+    last_unit = 0
+    zero_after_unit = False
+    prev_digit = False
+    for ch in integer_part:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+            if digit == 0:
+                zero_after_unit = True
+            # 连续数字（如“二零二四”）按位拼接
+            number = number * 10 + digit if prev_digit else digit
+            prev_digit = True
+        elif ch in _CN_UNITS:
+            section += (number or 1) * _CN_UNITS[ch]
+            number, last_unit, zero_after_unit, prev_digit = 0, _CN_UNITS[ch], False, False
+        elif ch in _CN_BIG_UNITS:
+            total += (section + number or 1) * _CN_BIG_UNITS[ch]
+            section, number, last_unit, zero_after_unit, prev_digit = 0, 0, _CN_BIG_UNITS[ch], False, False
+        else:
+            return None
+    # 口语省略：“两千五”的“五”表示五百，“一万二”的“二”表示两千
+    if number and last_unit >= 100 and not zero_after_unit and number < 10:
+        number *= last_unit // 10
+    value = Decimal(total + section + number)
+    if decimal_part:
+        digits = "".join(str(_CN_DIGITS[ch]) for ch in decimal_part if ch in _CN_DIGITS)
+        if digits:
+            value += Decimal("0." + digits)
+    return value
+
+
+def _to_decimal(raw: str) -> Optional[Decimal]:
+    if raw is None:
+        return None
+    if raw[0].isdigit():
+        try:
+            return Decimal(raw.replace(",", ""))
+        except InvalidOperation:
+            return None
+    return parse_chinese_number(raw)
+
+
+def _small_digit(raw: Optional[str]) -> Optional[int]:
+    if raw is None:
+        return None
+    return int(raw) if raw.isdigit() else _CN_DIGITS.get(raw)
+
+
+def _amount_candidates(text: str) -> List[Tuple[Decimal, float, int, int]]:
+    """返回 (金额, 置信度, 起始位置, 结束位置) 列表。"""
+    candidates = []
+    for match in _AMOUNT_RE.finditer(text):
+        raw = match.group("num")
+        is_chinese = not raw[0].isdigit()
+        unit = match.group("unit")
+        scale = (match.group("scale") or "").lower()
+        if is_chinese and not unit and not scale:
+            # 不带单位的中文数字须同时含数字与位（“三百”“两千五”），排除“一起”“千岛湖”“百货”
+            if not any(ch in _CN_DIGITS for ch in raw) or not any(ch in "十百千万亿点" for ch in raw):
+                continue
+            if text[max(0, match.start() - 1):match.start()] == "第":
+                continue
+        value = _to_decimal(raw)
+        if value is None:
+            continue
+        if scale:
+            value *= _SCALE_SUFFIXES[scale]
+        if unit:
+            value *= _MONEY_UNITS[unit]
+            if _MONEY_UNITS[unit] == 1:
+                jiao = _small_digit(match.group("jiao") or match.group("jiao_spoken"))
+                fen = _small_digit(match.group("fen"))
+                if jiao is not None:
+                    value += Decimal(jiao) / 10
+                if fen is not None:
+                    value += Decimal(fen) / 100
+        end = match.end() if unit else match.end("scale") if scale else match.end("num")
+        if unit:
+            confidence = 0.95
+        else:
+            before = text[max(0, match.start() - 4):match.start()].rstrip()
+            after = text[end:end + 4].lstrip()
+            if _CURRENCY_RE.match(after.lower()) or before[-1:] in tuple(_CURRENCY_SYMBOLS):
+                confidence = 0.9
+            elif before.endswith(_AMOUNT_CUES):
+                confidence = 0.8
+            else:
+                confidence = 0.5
+        candidates.append((value, confidence, match.start(), end))
+    return candidates
+
+
+def _best_amount(text: str) -> Tuple[Optional[Tuple[Decimal, float, int, int]], float]:
+    # 多个候选时取置信度最高者，同分取最后一个（金额通常在句末）
+    candidates = _amount_candidates(text) if text else []
+    if not candidates:
+        return None, 0.0
+    best = max(candidates, key=lambda item: (item[1], item[2]))
+    confidence = best[1]
+    if confidence <= 0.5 and len(candidates) > 1:
+        confidence = 0.4
+    return best, confidence
+
+
+def parse_amount(text: str) -> Tuple[Optional[Decimal], float]:
+    """返回 (金额, 置信度)。"""
+    best, confidence = _best_amount(text)
+    return (best[0], confidence) if best else (None, 0.0)
+
+
+def _scan_keywords(text: str) -> Tuple[List[Tuple[int, int, str]], List[Tuple[int, str]]]:
+    currencies = []
+    categories = []
+    for match in _KEYWORD_RE.finditer(text.lower()):
+        keyword = match.group(0)
+        kind, value = _KEYWORD_LOOKUP[keyword]
+        if kind == "currency":
+            currencies.append((match.start(), match.end(), keyword))
+        else:
+            categories.append((match.start(), keyword))
+    return currencies, categories
+
+
+def _pick_currency(matches, amount_span: Optional[Tuple[int, int]]) -> Tuple[Optional[str], float]:
+    if not matches:
+        return None, 0.0
+    if amount_span is not None:
+        amount_start, amount_end = amount_span
+        for start, end, keyword in matches:
+            if 0 <= start - amount_end <= 1 or 0 <= amount_start - end <= 1:
+                return CURRENCY_KEYWORDS[keyword], 0.6 if keyword in _GENERIC_CURRENCY_KEYWORDS else 0.95
+    specific = [keyword for _, _, keyword in matches if keyword not in _GENERIC_CURRENCY_KEYWORDS]
+    if specific:
+        return CURRENCY_KEYWORDS[specific[0]], 0.85
+    return "CNY", 0.6
+
+
+def _pick_category(matches) -> Tuple[str, float]:
+    if not matches:
+        return "other", 0.0
+    scores: Dict[str, int] = {}
+    first_seen: Dict[str, int] = {}
+    for start, keyword in matches:
+        category = _KEYWORD_LOOKUP[keyword][1]
+        scores[category] = scores.get(category, 0) + len(keyword)
+        first_seen.setdefault(category, start)
+    best = max(scores, key=lambda category: (scores[category], -first_seen[category]))
+    return best, round(scores[best] / sum(scores.values()), 2)
+
+
+def detect_currency(text: str, amount_span: Optional[Tuple[int, int]] = None) -> Tuple[Optional[str], float]:
+    """返回 (币种代码, 置信度)。紧挨金额的币种优先，其次明确币种，最后才是“元/块”。"""
+    if not text:
+        return None, 0.0
+    return _pick_currency(_scan_keywords(text)[0], amount_span)
+
+
+def detect_category(text: str) -> Tuple[str, float]:
+    """返回 (类别, 置信度)。命中关键词按长度计分，得分最高的类别胜出，同分取先出现者。"""
+    if not text:
+        return "other", 0.0
+    return _pick_category(_scan_keywords(text)[1])
+
+
+def parse_expense_text(text: str) -> dict:
+    """解析一条记账文本，返回 amount / currency / category 及各自的置信度。"""
+    text = text or ""
+    best, amount_confidence = _best_amount(text)
+    currencies, categories = _scan_keywords(text)
+    currency, currency_confidence = _pick_currency(currencies, (best[2], best[3]) if best else None)
+    category, category_confidence = _pick_category(categories)
+    return {
+        "amount": best[0] if best else None,
+        "currency": currency,
+        "category": category,
+        "confidence": {
+            "amount": amount_confidence,
+            "currency": currency_confidence,
+            "category": category_confidence,
+        },
+    }
@@ -0,0 +1,225 @@
+# backend/fx.py
+"""汇率表：本地文件缓存的兑换比率，用于把多币种支出折算为预算币种。
+
+- 文件格式 {"base": "CNY", "date": "...", "rates": {"USD": 0.1405, ...}}，表示 1 单位 base 可兑换的各币种数量
+  （与 open.er-api / frankfurter 等公开接口一致，base_code 亦可）
+- 优先读取 FX_RATES_FILE（默认 backend/.cache/fx_rates.json），不存在时使用随代码发布的 data/fx_rates.json 快照
+- 加载时预先计算所有币种两两之间的换算系数，汇总时每行只需一次字典查找和一次乘法
+- 配置 FX_RATES_URL 后可通过 refresh() 拉取最新汇率写入 FX_RATES_FILE；不配置时完全离线工作
+- 文件被替换后（mtime 变化）自动重新加载，多个 worker 共享同一份文件
+"""
+import json
+import os
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Iterable, Optional
+
+import requests
+from dotenv import load_dotenv
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+BUNDLED_RATES_PATH = Path(__file__).parent / "data" / "fx_rates.json"
+
+_CENT = Decimal("0.01")
+
+
+class FxRatesError(ValueError):
+    pass
+
+
+def _parse_rates(payload: dict) -> tuple[str, Optional[str], dict]:
+    base = str(payload.get("base") or payload.get("base_code") or "").upper()
+    raw_rates = payload.get("rates")
+    if not base or not isinstance(raw_rates, dict):
+        raise FxRatesError("FX rate table must contain 'base' and 'rates'")
+    rates = {}
+    for code, value in raw_rates.items():
+        try:
+            rate = Decimal(str(value))
+        except (InvalidOperation, ValueError):
+            continue
+        if rate > 0:
+            rates[str(code).upper()] = rate
+    rates[base] = Decimal("1")
+    date = payload.get("date") or payload.get("time_last_update_utc")
+    return base, date, rates
+
+
+def _build_factors(rates: dict) -> dict:
+    """factors[目标币种][原币种] = 1 单位原币种折合的目标币种数量。"""
+    return {target: {source: rates[target] / rates[source] for source in rates} for target in rates}
+
+
+class FxRates:
+    def __init__(
+        self,
+        path: str,
+        fallback_path: Optional[str] = None,
+        url: Optional[str] = None,
+        max_age_seconds: float = 86400,
+        reload_check_seconds: float = 30,
+    ):
+        self.path = Path(path)
+        self.fallback_path = Path(fallback_path) if fallback_path else None
+        self.url = url
+        self.max_age_seconds = max_age_seconds
+        self.reload_check_seconds = reload_check_seconds
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded_from: Optional[Path] = None
+        self._loaded_mtime: Optional[float] = None
+        self._next_check = 0.0
+        self.base: Optional[str] = None
+        self.date: Optional[str] = None
+        self._factors: dict = {}
+        self._stats = {"loads": 0, "load_errors": 0, "refreshes": 0, "refresh_errors": 0, "unknown_currency": 0}
+        self._maybe_reload(force=True)
+
+    def _source(self) -> Optional[Path]:
+        if self.path.exists():
+            return self.path
+        if self.fallback_path and self.fallback_path.exists():
+            return self.fallback_path
+        return None
+
+    def _maybe_reload(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return
+        self._next_check = now + self.reload_check_seconds
+        if not force and self.url and self.is_stale():
+            self.refresh_in_background()
+        source = self._source()
+        if source is None:
+            return
+        try:
+            mtime = source.stat().st_mtime
+            if not force and source == self._loaded_from and mtime == self._loaded_mtime:
+                return
+            with source.open(encoding="utf-8") as fh:
+                base, date, rates = _parse_rates(json.load(fh))
+        except (OSError, ValueError) as exc:
+            print(f"⚠️ FX rate table {source} unreadable, keeping previous rates: {exc}")
+            with self._lock:
+                self._stats["load_errors"] += 1
+            return
+        factors = _build_factors(rates)
+        with self._lock:
+            self.base, self.date, self._factors = base, date, factors
+            self._loaded_from, self._loaded_mtime = source, mtime
+            self._stats["loads"] += 1
+
+    def factors_to(self, currency: str) -> dict:
+        """返回 {原币种: 系数}；目标币种不在汇率表中时返回空字典。"""
+        self._maybe_reload()
+        with self._lock:
+            return self._factors.get((currency or "").upper(), {})
+
+    def convert(self, amount, source: str, target: str) -> Optional[Decimal]:
+        """把金额从 source 折算为 target（保留两位小数）；任一币种未知时返回 None。"""
+        source = (source or "").upper()
+        target = (target or "").upper()
+        if source == target:
+            return Decimal(str(amount)).quantize(_CENT)
+        factor = self.factors_to(target).get(source)
+        if factor is None:
+            with self._lock:
+                self._stats["unknown_currency"] += 1
+            return None
+        return (Decimal(str(amount)) * factor).quantize(_CENT)
+
+    def convert_breakdown(self, breakdown: Iterable[dict], target: str) -> dict:
+        """把按 (category, currency) 分组的合计折算为 target，单次遍历完成汇总。
+
+        无法折算的币种不计入 total，原额记在 unconverted 中。
+        """
+        target = (target or "CNY").upper()
+        factors = self.factors_to(target)
+        total = Decimal("0")
+        by_category: dict = {}
+        by_category_currency: dict = {}
+        unconverted: dict = {}
+        for row in breakdown:
+            category = row["category"]
+            currency = (row["currency"] or target).upper()
+            amount = Decimal(str(row["total"]))
+            per_currency = by_category_currency.setdefault(category, {})
+            per_currency[currency] = per_currency.get(currency, Decimal("0")) + amount
+            factor = Decimal("1") if currency == target else factors.get(currency)
+            if factor is None:
+                unconverted[currency] = unconverted.get(currency, Decimal("0")) + amount
+                continue
+            converted = amount * factor
+            total += converted
+            by_category[category] = by_category.get(category, Decimal("0")) + converted
+        if unconverted:
+            with self._lock:
+                self._stats["unknown_currency"] += len(unconverted)
+        return {
+            "total": float(total.quantize(_CENT)),
+            "by_category": {key: float(value.quantize(_CENT)) for key, value in by_category.items()},
+            "by_category_currency": {
+                category: {currency: float(value) for currency, value in per_currency.items()}
+                for category, per_currency in by_category_currency.items()
+            },
+            "unconverted": {currency: float(value) for currency, value in unconverted.items()},
+        }
+
+    def is_stale(self) -> bool:
+        if self._loaded_from is None or self._loaded_from != self.path:
+            return True
+        return self._loaded_mtime + self.max_age_seconds <= time.time()
+
+    def refresh(self, timeout: float = 10) -> bool:
+        """从 FX_RATES_URL 拉取汇率并原子替换本地文件；未配置 URL 或失败时返回 False。"""
+        if not self.url:
+            return False
+        with self._refresh_lock:
+            try:
+                response = requests.get(self.url, timeout=timeout)
+                response.raise_for_status()
+                payload = response.json()
+                _parse_rates(payload)
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix(".tmp")
+                tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+                os.replace(tmp_path, self.path)
+            except (requests.RequestException, OSError, ValueError) as exc:
+                print(f"⚠️ FX rate refresh failed: {exc}")
+                with self._lock:
+                    self._stats["refresh_errors"] += 1
+                return False
+            with self._lock:
+                self._stats["refreshes"] += 1
+            self._maybe_reload(force=True)
+            return True
+
+    def refresh_in_background(self) -> None:
+        """在后台线程刷新；已有刷新在进行时直接返回，不阻塞调用方。"""
+        if not self.url or self._refresh_lock.locked():
+            return
+        threading.Thread(target=self.refresh, name="fx-refresh", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["base"] = self.base
+            stats["date"] = self.date
+            stats["currencies"] = len(self._factors)
+            stats["source"] = str(self._loaded_from) if self._loaded_from else None
+        return stats
+
+
+_default_rates_file = str(Path(__file__).with_name(".cache") / "fx_rates.json")
+
+fx_rates = FxRates(
+    path=os.getenv("FX_RATES_FILE", _default_rates_file),
+    fallback_path=str(BUNDLED_RATES_PATH),
+    # 不配置时只使用本地文件，不访问网络
+    url=os.getenv("FX_RATES_URL") or None,
+    max_age_seconds=float(os.getenv("FX_RATES_MAX_AGE_SECONDS", "86400")),
+)
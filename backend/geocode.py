@@ -0,0 +1,245 @@
+# backend/geocode.py
+"""高德地理编码：为结构化行程中的地点补充经纬度。"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from .geocode_cache import MISS, geocode_cache, make_geocode_key
+from .singleflight import Flight, SingleFlight
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+amap_web_key = os.getenv("AMAP_WEB_KEY") or os.getenv("AMAP_REST_KEY")
+
+AMAP_GEOCODE_URL = "https://restapi.amap.com/v3/geocode/geo"
+# 高德 v3 geocode 批量模式单次最多 10 个地址
+AMAP_BATCH_SIZE = 10
+GEOCODE_MAX_WORKERS = int(os.getenv("GEOCODE_MAX_WORKERS", "8"))
+# 单个行程补坐标的总时限，超时后剩余地点保持无坐标
+GEOCODE_DEADLINE_SECONDS = float(os.getenv("GEOCODE_DEADLINE_SECONDS", "8"))
+GEOCODE_REQUEST_TIMEOUT = float(os.getenv("GEOCODE_REQUEST_TIMEOUT", "5"))
+
+# 共享 Session 复用到高德的 keep-alive 连接，连接池大小与并发数一致
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=GEOCODE_MAX_WORKERS))
+_executor = ThreadPoolExecutor(max_workers=GEOCODE_MAX_WORKERS, thread_name_prefix="geocode")
+# 并发行程中相同的 (address, city) 只向高德查询一次
+geocode_flight = SingleFlight("geocode")
+
+def _parse_location(location) -> Optional[tuple[float, float]]:
+    # 批量接口对未解析的地址返回空列表或空字符串
+    if not location or not isinstance(location, str):
+        return None
+    try:
+        lng_str, lat_str = location.split(",")
+        return float(lng_str), float(lat_str)
+    except (ValueError, AttributeError):
+        return None
+
+
+def geocode_with_amap(address: Optional[str], city: Optional[str] = None) -> Optional[tuple[float, float]]:
+    if not amap_web_key or not address:
+        return None
+    query = address.strip()
+    if not query:
+        return None
+    cache_key = make_geocode_key(query, city)
+    cached = geocode_cache.get(cache_key)
+    if cached is not MISS:
+        return cached
+    params = {
+        "key": amap_web_key,
+        "address": query,
+    }
+    if city:
+        params["city"] = city
+    try:
+        resp = _session.get(AMAP_GEOCODE_URL, params=params, timeout=GEOCODE_REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        data = resp.json()
+        if data.get("status") == "1":
+            coords = None
+            if data.get("geocodes"):
+                coords = _parse_location(data["geocodes"][0].get("location"))
+            # 仅缓存高德明确返回的结果；查无结果按短 TTL 作为负缓存
+            geocode_cache.set(cache_key, coords)
+            return coords
+        # status != "1"（配额超限、key 异常等）属于暂时性错误，不写缓存
+        print(f"⚠️ Geocode rejected for {query} ({city}): {data.get('info')}")
+    except Exception as exc:
+        # 超时/网络错误同样不缓存，下次请求会重试
+        print(f"⚠️ Geocode failed for {query} ({city}): {exc}")
+    return None
+
+
+def geocode_batch_with_amap(addresses: List[str], city: Optional[str] = None) -> List[Optional[tuple[float, float]]]:
+    """批量地理编码（batch=true，单次最多 10 个地址），结果与输入按位置一一对应。
+
+    未能解析的位置返回 None 且不写入缓存，由调用方决定是否回退到单条查询。
+    """
+    results: List[Optional[tuple[float, float]]] = [None] * len(addresses)
+    if not amap_web_key or not addresses:
+        return results
+    if len(addresses) > AMAP_BATCH_SIZE:
+        raise ValueError(f"Amap batch geocoding accepts at most {AMAP_BATCH_SIZE} addresses")
+    # "|" 是批量分隔符，地址本身出现时替换掉，避免错位
+    queries = [address.strip().replace("|", " ") for address in addresses]
+    params = {
+        "key": amap_web_key,
+        "address": "|".join(queries),
+        "batch": "true",
+    }
+    if city:
+        params["city"] = city
+    try:
+        resp = _session.get(AMAP_GEOCODE_URL, params=params, timeout=GEOCODE_REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        data = resp.json()
+        geocodes = data.get("geocodes") or []
+        if data.get("status") != "1" or len(geocodes) != len(queries):
+            # 数量对不上时无法按位置映射，整批交给单条查询兜底
+            return results
+        for idx, (address, geocode) in enumerate(zip(addresses, geocodes)):
+            coords = _parse_location(geocode.get("location")) if isinstance(geocode, dict) else None
+            if coords:
+                geocode_cache.set(make_geocode_key(address, city), coords)
+                results[idx] = coords
+    except Exception as exc:
+        print(f"⚠️ Batch geocode failed for {len(addresses)} addresses ({city}): {exc}")
+    return results
+
+
+def _collect_geocode_targets(plan: dict) -> Dict[Tuple[str, str], List[dict]]:
+    """收集缺少坐标的地点，按 (address, city) 去重，值为共享该地址的所有 item。"""
+    destination = plan.get("overview", {}).get("destination")
+    targets: Dict[Tuple[str, str], List[dict]] = {}
+    days = plan.get("days") or []
+    for day in days:
+        day_city = day.get("city") if isinstance(day, dict) else None
+        items = day.get("items") if isinstance(day, dict) else None
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            if item.get("longitude") and item.get("latitude"):
+                continue
+            address = (item.get("address") or item.get("name") or "").strip()
+            if not address:
+                continue
+            city = item.get("city") or day_city or destination or ""
+            targets.setdefault((address, city), []).append(item)
+    return targets
+
+
+def _apply_coordinates(items: List[dict], coords: tuple[float, float]) -> None:
+    lng, lat = coords
+    for item in items:
+        item["longitude"] = lng
+        item["latitude"] = lat
+        item["coordinate_source"] = "amap_geocode"
+
+
+def enrich_plan_with_coordinates(plan: Optional[dict], deadline_seconds: Optional[float] = None) -> Optional[dict]:
+    if not isinstance(plan, dict):
+        return plan
+    targets = _collect_geocode_targets(plan)
+    if not targets or not amap_web_key:
+        return plan
+    timeout = GEOCODE_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+    started = time.monotonic()
+
+    # 1. 先用缓存，只把未命中的地址交给高德；其他请求正在查询的地址直接等待其结果
+    misses_by_city: Dict[str, List[str]] = {}
+    leading: Dict[Tuple[str, str], Flight] = {}
+    following: Dict[Tuple[str, str], Flight] = {}
+    resolved: Dict[Tuple[str, str], tuple[float, float]] = {}
+    for (address, city), items in targets.items():
+        key = make_geocode_key(address, city)
+        cached = geocode_cache.get(key)
+        if cached is not MISS:
+            if cached:
+                _apply_coordinates(items, cached)
+            continue
+        flight, leader = geocode_flight.begin(key)
+        if not leader:
+            following[(address, city)] = flight
+            continue
+        leading[(address, city)] = flight
+        misses_by_city.setdefault(city, []).append(address)
+
+    def resolve(target: Tuple[str, str], coords: tuple[float, float]) -> None:
+        _apply_coordinates(targets[target], coords)
+        resolved[target] = coords
+
+    try:
+        timed_out = _geocode_misses(misses_by_city, resolve, timeout, started)
+    finally:
+        # 未解析（含超时）的地址以 None 结束，等待者不会无限期阻塞
+        for target, flight in leading.items():
+            geocode_flight.finish(flight, resolved.get(target))
+
+    # 4. 等待其他请求负责的地址，共用剩余时限
+    shared_unresolved = 0
+    for target, flight in following.items():
+        coords = flight.wait(max(0.0, timeout - (time.monotonic() - started)))
+        if coords:
+            _apply_coordinates(targets[target], coords)
+        else:
+            shared_unresolved += 1
+    if timed_out or shared_unresolved:
+        print(
+            f"⚠️ Geocode deadline reached after {time.monotonic() - started:.1f}s, "
+            f"{timed_out} lookups timed out, {shared_unresolved} shared addresses unresolved"
+        )
+    return plan
+
+
+def _geocode_misses(misses_by_city: Dict[str, List[str]], resolve, timeout: float, started: float) -> int:
+    """批量查询未命中的地址，解析成功的通过 resolve 回写；返回时限内未完成的高德请求数（批量与单条之和）。"""
+    # 2. 同城市的未命中地址按 10 个一组批量查询，批次之间并发
+    batch_futures = {}
+    for city, addresses in misses_by_city.items():
+        for start in range(0, len(addresses), AMAP_BATCH_SIZE):
+            chunk = addresses[start:start + AMAP_BATCH_SIZE]
+            batch_futures[_executor.submit(geocode_batch_with_amap, chunk, city or None)] = (city, chunk)
+    done, pending = wait(batch_futures, timeout=timeout)
+    timed_out = len(pending)
+    unresolved: List[Tuple[str, str]] = []
+    for future in pending:
+        future.cancel()
+    for future in done:
+        city, chunk = batch_futures[future]
+        for address, coords in zip(chunk, future.result()):
+            if coords:
+                resolve((address, city), coords)
+            else:
+                unresolved.append((address, city))
+
+    # 3. 仅对批量未解析的地址回退到单条查询，共用剩余时限
+    remaining = timeout - (time.monotonic() - started)
+    single_futures = {}
+    if unresolved and remaining > 0:
+        single_futures = {
+            _executor.submit(geocode_with_amap, address, city or None): (address, city)
+            for address, city in unresolved
+        }
+        single_done, single_pending = wait(single_futures, timeout=remaining)
+        for future in single_pending:
+            # 未开始的任务直接取消；已在执行的请求结束后仍会写入缓存，供下次使用
+            future.cancel()
+        for future in single_done:
+            coords = future.result()
+            if coords:
+                resolve(single_futures[future], coords)
+        timed_out += len(single_pending)
+    elif unresolved:
+        print(f"⚠️ Geocode deadline reached, {len(unresolved)} addresses skipped single lookup")
+    return timed_out
@@ -0,0 +1,247 @@
+# backend/geocode_cache.py
+"""地理编码缓存：有界内存 LRU + 本机 SQLite 持久层。
+
+- 成功与失败（查无结果）分别使用不同的 TTL，失败结果较快过期后重新查询
+- SQLite 文件由同一主机上的多个 uvicorn worker 共享，重启/重新部署后依然有效
+- 支持从 JSON / JSONL / CSV 文件导入预热，并提供监控用的统计信息
+"""
+import csv
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from typing import Iterable, Optional
+
+from dotenv import load_dotenv
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+# 缓存未命中的哨兵值；None 本身表示“已缓存的失败结果”
+MISS = object()
+
+
+def make_geocode_key(address: str, city: Optional[str]) -> str:
+    return f"{address.strip()}|{city or ''}"
+
+
+class GeocodeCache:
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl_seconds: float = 30 * 24 * 3600,
+        negative_ttl_seconds: float = 600,
+        db_path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, tuple[float, Optional[tuple[float, float]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "negative_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "negative_stores": 0,
+            "evictions": 0,
+            "expired": 0,
+            "imported": 0,
+        }
+        if self.db_path:
+            try:
+                self._init_db()
+            except sqlite3.Error as exc:
+                print(f"⚠️ Geocode cache DB unavailable, using memory only: {exc}")
+                self.db_path = None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _init_db(self) -> None:
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode_cache ("
+                "key TEXT PRIMARY KEY, lng REAL, lat REAL, "
+                "expires_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str):
+        """返回坐标元组、None（缓存的失败结果）或 MISS。"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, coords = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._count_hit(coords)
+                    return coords
+                del self._entries[key]
+                self._stats["expired"] += 1
+        found = self._get_from_db(key, now)
+        if found is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return MISS
+        expires_at, coords = found
+        with self._lock:
+            self._stats["disk_hits"] += 1
+            self._count_hit(coords)
+        self._remember(key, coords, expires_at)
+        return coords
+
+    def set(self, key: str, coords: Optional[tuple[float, float]]) -> None:
+        now = time.time()
+        ttl = self.ttl_seconds if coords else self.negative_ttl_seconds
+        expires_at = now + ttl
+        self._remember(key, coords, expires_at)
+        with self._lock:
+            self._stats["stores" if coords else "negative_stores"] += 1
+        self._write_db([(key, coords, expires_at)], now)
+
+    def warm_up(self, limit: Optional[int] = None) -> int:
+        """把 SQLite 中最近更新且未过期的成功结果载入内存。"""
+        if not self.db_path:
+            return 0
+        limit = self.max_entries if limit is None else min(limit, self.max_entries)
+        try:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    "SELECT key, lng, lat, expires_at FROM geocode_cache "
+                    "WHERE expires_at > ? AND lng IS NOT NULL ORDER BY updated_at DESC LIMIT ?",
+                    (time.time(), limit),
+                ).fetchall()
+        except sqlite3.Error as exc:
+            print(f"⚠️ Geocode cache warm-up failed: {exc}")
+            return 0
+        # 倒序插入，使最近更新的条目处于 LRU 尾部
+        for key, lng, lat, expires_at in reversed(rows):
+            self._remember(key, (lng, lat), expires_at)
+        return len(rows)
+
+    def import_entries(self, entries: Iterable[dict]) -> int:
+        """导入 {address, city, longitude, latitude} 记录，视为新鲜的成功结果。"""
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        rows = []
+        for entry in entries:
+            address = (entry.get("address") or "").strip()
+            try:
+                coords = (float(entry["longitude"]), float(entry["latitude"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if not address:
+                continue
+            key = make_geocode_key(address, entry.get("city"))
+            self._remember(key, coords, expires_at)
+            rows.append((key, coords, expires_at))
+        self._write_db(rows, now)
+        with self._lock:
+            self._stats["imported"] += len(rows)
+        return len(rows)
+
+    def import_file(self, path: str) -> int:
+        """支持 .json（数组）、.jsonl 与 .csv（表头 address,city,longitude,latitude）。"""
+        file_path = Path(path)
+        with file_path.open(encoding="utf-8") as fh:
+            if file_path.suffix == ".csv":
+                return self.import_entries(csv.DictReader(fh))
+            if file_path.suffix == ".jsonl":
+                return self.import_entries(json.loads(line) for line in fh if line.strip())
+            return self.import_entries(json.load(fh))
+
+    def purge_expired(self) -> int:
+        if not self.db_path:
+            return 0
+        try:
+            with closing(self._connect()) as conn, conn:
+                cursor = conn.execute("DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),))
+                return cursor.rowcount
+        except sqlite3.Error as exc:
+            print(f"⚠️ Geocode cache purge failed: {exc}")
+            return 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["negative_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["negative_hits"]) / lookups, 4) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["persistent"] = bool(self.db_path)
+        return stats
+
+    def _count_hit(self, coords) -> None:
+        self._stats["hits" if coords else "negative_hits"] += 1
+
+    def _remember(self, key: str, coords, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, coords)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _get_from_db(self, key: str, now: float):
+        if not self.db_path:
+            return None
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT lng, lat, expires_at FROM geocode_cache WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+        except sqlite3.Error as exc:
+            print(f"⚠️ Geocode cache read failed: {exc}")
+            return None
+        if row is None:
+            return None
+        lng, lat, expires_at = row
+        coords = (lng, lat) if lng is not None and lat is not None else None
+        return expires_at, coords
+
+    def _write_db(self, rows, now: float) -> None:
+        if not self.db_path or not rows:
+            return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO geocode_cache (key, lng, lat, expires_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (key, coords[0] if coords else None, coords[1] if coords else None, expires_at, now)
+                        for key, coords, expires_at in rows
+                    ],
+                )
+        except sqlite3.Error as exc:
+            print(f"⚠️ Geocode cache write failed: {exc}")
+
+
+_default_db = str(Path(__file__).with_name(".cache") / "geocode.sqlite3")
+
+geocode_cache = GeocodeCache(
+    max_entries=int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("GEOCODE_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+    negative_ttl_seconds=float(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL_SECONDS", "600")),
+    # 置空可关闭持久层，仅使用内存缓存
+    db_path=os.getenv("GEOCODE_CACHE_DB", _default_db) or None,
+)
+
+
+if __name__ == "__main__":
+    # 用法：python -m backend.geocode_cache import <file.json|file.jsonl|file.csv>
+    if len(sys.argv) != 3 or sys.argv[1] != "import":
+        print("Usage: python -m backend.geocode_cache import <file>")
+        sys.exit(1)
+    count = geocode_cache.import_file(sys.argv[2])
+    print(f"Imported {count} geocode entries into {geocode_cache.db_path or 'memory'}")
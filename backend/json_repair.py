@@ -0,0 +1,357 @@
+# backend/json_repair.py
+"""容错 JSON 解析：修复 LLM 输出中的常见格式问题，并从被截断的文本中恢复最长的有效前缀。
+
+- 可修复：末尾多余逗号、重复/缺失逗号、字符串内未转义的换行与控制字符、字符串内未转义的引号、
+  非法转义、单引号、Python 字面量（True/False/None）、// 与 /* */ 注释、缺失的 ] 或 }、
+  前后的 ```json 标记与说明文字
+- 截断或遇到无法修复的语法错误时在该处停止：数组保留已完整的元素，未闭合的对象与标量整体丢弃
+  （根对象除外），因此被截断的行程只保留完整的天
+- 返回 RepairResult，其中 repairs 列出每处修复的类型、偏移与 JSON 路径，dropped 列出被丢弃的不完整部分
+- 任意前缀都可解析，流式输出的中途快照同样适用；正常 JSON 请先用 json.loads，失败后再交给本模块
+"""
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_UNQUOTED_KEY = re.compile(r"[A-Za-z_$][\w$-]*(?=\s*:)")
+# 字符串中连续的普通字符，一次匹配整段，避免逐字符循环
+_STRING_RUN = {
+    '"': re.compile(r'[^"\\\x00-\x1f]+'),
+    "'": re.compile(r"[^'\\\x00-\x1f]+"),
+}
+_ESCAPES = {'"': '"', "'": "'", "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_LITERALS = (("true", True), ("false", False), ("null", None), ("True", True), ("False", False), ("None", None))
+# 引号后紧跟这些字符（或换行、文本结束）时视为字符串结束，否则按字符串内未转义的引号处理
+_STRING_END_FOLLOWERS = frozenset(",:}]")
+# 引号后（可隔空白）紧跟 "键": 时同样视为字符串结束：{"a": "s" "b": 2} 缺的是逗号，而不是 s" "b 这一个值
+_NEXT_KEY = re.compile(r'"(?:[^"\\\r\n]|\\.)*"\s*:')
+
+
+class JsonRepairError(ValueError):
+    pass
+
+
+@dataclass
+class RepairResult:
+    value: Any
+    # 每项 {"kind": 修复类型, "offset": 原文偏移, "path": JSON 路径，例如 days[2].items[0]}
+    repairs: List[dict] = field(default_factory=list)
+    # 根值未完整闭合（文本被截断或遇到无法修复的语法错误）
+    truncated: bool = False
+    # 因不完整而被丢弃的部分
+    dropped: List[str] = field(default_factory=list)
+
+    @property
+    def repaired(self) -> bool:
+        return bool(self.repairs)
+
+    @property
+    def kinds(self) -> List[str]:
+        return sorted({repair["kind"] for repair in self.repairs})
+
+
+class _Stop(Exception):
+    """解析无法继续，逐层回退；每层容器把已解析的部分放在 partial 中交给上一层。"""
+
+    def __init__(self):
+        super().__init__()
+        self.partial: Any = None
+
+
+def _format_path(path: list) -> str:
+    out = ""
+    for part in path:
+        if isinstance(part, int):
+            out += f"[{part}]"
+        else:
+            out += f".{part}" if out else str(part)
+    return out or "$"
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+        self.repairs: List[dict] = []
+        self.dropped: List[str] = []
+
+    def _repair(self, kind: str, path: list, offset: Optional[int] = None) -> None:
+        self.repairs.append({"kind": kind, "offset": self.pos if offset is None else offset, "path": _format_path(path)})
+
+    def _stop(self, kind: str, path: list) -> _Stop:
+        # truncated：文本在值中途结束；syntax_error：无法修复，按截断处理
+        self._repair(kind, path)
+        return _Stop()
+
+    def _peek(self, path: list) -> str:
+        """跳过空白与注释并返回下一个字符；文本结束时停止。"""
+        text = self.text
+        while True:
+            self.pos = _WHITESPACE.match(text, self.pos).end()
+            if text.startswith("//", self.pos):
+                self._repair("comment", path)
+                end = text.find("\n", self.pos)
+                self.pos = len(text) if end < 0 else end + 1
+            elif text.startswith("/*", self.pos):
+                self._repair("comment", path)
+                end = text.find("*/", self.pos + 2)
+                if end < 0:
+                    self.pos = len(text)
+                    raise self._stop("truncated", path)
+                self.pos = end + 2
+            elif self.pos >= len(text):
+                raise self._stop("truncated", path)
+            else:
+                return text[self.pos]
+
+    def value(self, path: list) -> Any:
+        char = self._peek(path)
+        if char == "{":
+            return self._object(path)
+        if char == "[":
+            return self._array(path)
+        if char in "\"'":
+            return self._string(path)
+        if char == "-" or char.isdigit():
+            return self._number(path)
+        return self._literal(path)
+
+    def _object(self, path: list) -> dict:
+        self.pos += 1
+        result: dict = {}
+        expect_key = True
+        try:
+            while True:
+                char = self._peek(path)
+                if char == "}":
+                    if expect_key and result:
+                        self._repair("trailing_comma", path)
+                    self.pos += 1
+                    return result
+                if char == "]":
+                    # 模型漏写了 }，交给外层数组闭合
+                    self._repair("unclosed_object", path)
+                    return result
+                if char == ",":
+                    if expect_key:
+                        self._repair("extra_comma", path)
+                    self.pos += 1
+                    expect_key = True
+                    continue
+                if not expect_key:
+                    self._repair("missing_comma", path)
+                if char in "\"'":
+                    key = self._string(path)
+                else:
+                    match = _UNQUOTED_KEY.match(self.text, self.pos)
+                    if match is None:
+                        raise self._stop("syntax_error", path)
+                    self._repair("unquoted_key", path)
+                    key = match.group()
+                    self.pos = match.end()
+                if self._peek(path) != ":":
+                    raise self._stop("syntax_error", path)
+                self.pos += 1
+                child = path + [key]
+                try:
+                    result[key] = self.value(child)
+                except _Stop as stop:
+                    self._salvage(stop, child, lambda partial: result.__setitem__(key, partial))
+                    raise
+                expect_key = False
+        except _Stop as stop:
+            stop.partial = result
+            raise
+
+    def _array(self, path: list) -> list:
+        self.pos += 1
+        result: list = []
+        expect_value = True
+        try:
+            while True:
+                char = self._peek(path)
+                if char == "]":
+                    if expect_value and result:
+                        self._repair("trailing_comma", path)
+                    self.pos += 1
+                    return result
+                if char == "}":
+                    # 模型漏写了 ]，交给外层对象闭合
+                    self._repair("unclosed_array", path)
+                    return result
+                if char == ",":
+                    if expect_value:
+                        self._repair("extra_comma", path)
+                    self.pos += 1
+                    expect_value = True
+                    continue
+                if not expect_value:
+                    self._repair("missing_comma", path)
+                child = path + [len(result)]
+                try:
+                    result.append(self.value(child))
+                except _Stop as stop:
+                    self._salvage(stop, child, result.append)
+                    raise
+                expect_value = False
+        except _Stop as stop:
+            stop.partial = result
+            raise
+
+    def _salvage(self, stop: _Stop, path: list, keep) -> None:
+        """子值不完整：数组只含完整元素，保留；对象与标量丢弃并记录路径。"""
+        if isinstance(stop.partial, list):
+            keep(stop.partial)
+        else:
+            self.dropped.append(_format_path(path))
+
+    def _string(self, path: list) -> str:
+        text = self.text
+        quote = text[self.pos]
+        if quote == "'":
+            self._repair("single_quotes", path)
+        run = _STRING_RUN[quote]
+        parts: List[str] = []
+        control_repaired = False
+        surrogates = False
+        self.pos += 1
+        while True:
+            match = run.match(text, self.pos)
+            if match:
+                parts.append(match.group())
+                self.pos = match.end()
+            if self.pos >= len(text):
+                raise self._stop("truncated", path)
+            char = text[self.pos]
+            if char == quote:
+                if self._closes_string(self.pos + 1):
+                    self.pos += 1
+                    break
+                self._repair("unescaped_quote", path)
+                parts.append(char)
+                self.pos += 1
+            elif char == "\\":
+                escape = text[self.pos + 1:self.pos + 2]
+                if not escape:
+                    raise self._stop("truncated", path)
+                if escape == "u":
+                    digits = text[self.pos + 2:self.pos + 6]
+                    if len(digits) < 4 and self.pos + 6 > len(text):
+                        raise self._stop("truncated", path)
+                    try:
+                        code = int(digits, 16)
+                    except ValueError:
+                        self._repair("invalid_escape", path)
+                        parts.append("\\")
+                        self.pos += 1
+                        continue
+                    surrogates = surrogates or 0xD800 <= code <= 0xDFFF
+                    parts.append(chr(code))
+                    self.pos += 6
+                elif escape in _ESCAPES:
+                    parts.append(_ESCAPES[escape])
+                    self.pos += 2
+                else:
+                    # 例如 Windows 路径中的 \d，按字面保留反斜杠
+                    self._repair("invalid_escape", path)
+                    parts.append("\\" + escape)
+                    self.pos += 2
+            else:
+                # 字符串中的原始换行 / 制表符等控制字符
+                if not control_repaired:
+                    self._repair("control_character", path)
+                    control_repaired = True
+                parts.append(char)
+                self.pos += 1
+        value = "".join(parts)
+        if surrogates:
+            # 😀 这样的代理对需要合并为一个字符；孤立的代理项替换掉
+            value = value.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+        return value
+
+    def _closes_string(self, index: int) -> bool:
+        text = self.text
+        while index < len(text) and text[index] in " \t":
+            index += 1
+        if index >= len(text) or text[index] in "\r\n" or text[index] in _STRING_END_FOLLOWERS:
+            return True
+        return text[index] == '"' and _NEXT_KEY.match(text, index) is not None
+
+    def _number(self, path: list):
+        match = _NUMBER.match(self.text, self.pos)
+        if match is None or match.end() >= len(self.text):
+            # 数字位于文本末尾时可能被截断（120 只收到了 12），不可信
+            if self.text[self.pos:] in ("", "-") or match is not None:
+                raise self._stop("truncated", path)
+            raise self._stop("syntax_error", path)
+        self.pos = match.end()
+        token = match.group()
+        if "." in token or "e" in token or "E" in token:
+            return float(token)
+        return int(token)
+
+    def _literal(self, path: list):
+        text = self.text
+        rest = text[self.pos:self.pos + 5]
+        for word, value in _LITERALS:
+            if text.startswith(word, self.pos):
+                if word[0].isupper():
+                    self._repair("python_literal", path)
+                self.pos += len(word)
+                return value
+            if self.pos + len(rest) >= len(text) and word.startswith(rest):
+                raise self._stop("truncated", path)
+        raise self._stop("syntax_error", path)
+
+
+def _find_root(text: str, parser: _Parser) -> int:
+    stripped = text.lstrip()
+    start = len(text) - len(stripped)
+    if stripped.startswith("```"):
+        # ```json 标记属于正常输出，不记为修复
+        newline = text.find("\n", start)
+        start = len(text) if newline < 0 else newline + 1
+    brace = [index for index in (text.find("{", start), text.find("[", start)) if index >= 0]
+    if not brace:
+        raise JsonRepairError("No JSON object or array found in text")
+    root = min(brace)
+    if text[start:root].strip():
+        parser._repair("leading_text", [], start)
+    return root
+
+
+def repair_json(text: str) -> RepairResult:
+    """容错解析 text，返回修复后的值与修复报告；找不到 JSON 根或根值为空时抛出 JsonRepairError。"""
+    parser = _Parser(text)
+    parser.pos = _find_root(text, parser)
+    truncated = False
+    try:
+        value = parser.value([])
+    except _Stop as stop:
+        truncated = True
+        value = stop.partial
+        if value is None:
+            raise JsonRepairError("JSON root value is incomplete")
+    else:
+        tail = text[parser.pos:].strip()
+        if tail.startswith("```"):
+            tail = tail[3:].strip()
+        if tail:
+            parser._repair("trailing_text", [], parser.pos)
+    # 被丢弃对象的内部路径已包含在外层路径中，只保留最外层
+    dropped = [
+        path for path in parser.dropped
+        if not any(path != outer and path.startswith(outer) and path[len(outer)] in ".[" for outer in parser.dropped)
+    ]
+    return RepairResult(value=value, repairs=parser.repairs, truncated=truncated, dropped=dropped)
+
+
+def loads_tolerant(text: str) -> Any:
+    """先按标准 JSON 解析，失败时再容错解析；只需要值、不关心修复报告时使用。"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return repair_json(text).value
@@ -1,57 +1,68 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import os
 from dotenv import load_dotenv
+import asyncio
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from .expense_parser import parse_chinese_number
+from .json_repair import JsonRepairError, RepairResult, repair_json
+from .llm_router import llm_router
 
 load_dotenv()
 
-def get_llm_client():
-    provider = os.getenv("LLM_PROVIDER", "deepseek")
-    if provider == "deepseek":
-        return OpenAI(
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            base_url="https://api.deepseek.com"
-        )
-    # 可扩展其他模型...
-    else:
-        raise ValueError("Unsupported LLM provider")
+# 首选提供方的模型名，参与行程缓存键
+DEEPSEEK_MODEL = llm_router.primary.config.model
 
-def generate_structured_travel_plan(user_input: str) -> dict:
-    client = get_llm_client()
-    
-    prompt = f"""
-你是一名中文旅行规划师。请阅读以下用户需求，并返回一个 **合法 JSON 字符串**，严格符合下面的 JSON Schema。
 
-用户需求：{user_input}
+def get_llm_client() -> OpenAI:
+    """首选提供方的同步客户端（连接池在进程内共享）；生成行程请使用 llm_router 以获得故障转移。"""
+    return llm_router.primary.sync_client()
+
+
+def get_async_llm_client() -> AsyncOpenAI:
+    """首选提供方的异步客户端，供 async 路由直接 await。"""
+    return llm_router.primary.async_client()
+
 
-JSON Schema（示例，仅用于说明结构）：
-{{
-  "overview": {{
+async def aclose_llm_clients() -> None:
+    await llm_router.aclose()
+
+
+# ========== 行程 prompt 模板（按版本登记） ==========
+# system 消息只含静态说明与 JSON 结构，逐字不变，放在最前面以命中 DeepSeek 的前缀（上下文）缓存；
+# 用户需求放在最后一条 user 消息中。修改任一模板内容时新增版本号，旧的行程缓存随之失效。
+
+_PLAN_JSON_SCHEMA = """{
+  "overview": {
     "destination": "字符串，目的地名称",
     "days": "整数天数",
     "travelers": "字符串描述同行人数",
-    "budget": {{
+    "budget": {
       "currency": "字符串，例如 CNY",
       "total": "数字，估算总预算"
-    }},
+    },
     "highlights": ["数组，列出行程特色主题"]
-  }},
+  },
   "budget_breakdown": [
-    {{
+    {
       "category": "transport|accommodation|dining|sightseeing|shopping|other",
       "amount": "数字",
       "description": "字符串说明"
-    }}
+    }
   ],
   "days": [
-    {{
+    {
       "title": "字符串，例如 Day 1 - 抵达东京",
       "date": "如已知可填 YYYY-MM-DD，否则 null",
       "summary": "字符串，概述当日亮点",
       "total_budget": "数字，估算当日花费",
       "items": [
-        {{
+        {
           "time": "时间段或 null，例如 09:00-11:00",
           "name": "POI 名称",
           "type": "scenic|restaurant|hotel|activity|other",
@@ -62,59 +73,782 @@ JSON Schema（示例，仅用于说明结构）：
           "notes": "额外提示，可为 null",
           "longitude": "数字，经度，如不确定填 null",
           "latitude": "数字，纬度，如不确定填 null"
-        }}
+        }
       ],
-      "accommodation": {{
+      "accommodation": {
         "name": "推荐住宿名称",
         "address": "地址",
         "budget": "数字或 null"
-      }},
-      "meals": {{
+      },
+      "meals": {
         "breakfast": "早餐建议，可为 null",
         "lunch": "午餐建议",
         "dinner": "晚餐建议"
-      }}
-    }}
+      }
+    }
   ],
-  "advice": {{
+  "advice": {
     "preparation": ["行前准备建议"],
     "local_tips": ["当地贴士"],
     "money_saving": ["省钱技巧"],
     "safety": ["安全提示"]
-  }},
-  "emergency": {{
+  },
+  "emergency": {
     "police": "报警电话或链接",
     "medical": "急救电话或医院",
     "embassy": "如适用可提供大使馆联系方式，否则写 null"
-  }},
+  },
   "itinerary_text": "请提供完整的中文行程文本描述（可多段落），便于纯文本展示"
-}}
+}"""
 
-严格要求：
+_PLAN_RULES = """严格要求：
 1. **仅输出 JSON**，不允许出现额外说明或 Markdown。
 2. 所有字符串使用双引号；不要包含未转义的换行。
 3. 若无具体数字或信息，可使用 null，但保留字段。
-4. budget 中金额统一使用人民币 (CNY)，如需要可标注汇率说明。
-"""
-    
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7
-    )
-    content = response.choices[0].message.content.strip()
+4. budget 中金额统一使用人民币 (CNY)，如需要可标注汇率说明。"""
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    system: Optional[str]
+    user: str
+
+    def messages(self, **values) -> List[dict]:
+        messages = []
+        if self.system:
+            messages.append({"role": "system", "content": self.system})
+        messages.append({"role": "user", "content": self.user.format(**values)})
+        return messages
+
+
+PLAN_PROMPTS = {
+    # 旧版：用户需求位于 prompt 开头、Schema 之前，每次请求的前缀都不同
+    "plan-v1": PromptTemplate(
+        system=None,
+        user=(
+            "你是一名中文旅行规划师。请阅读以下用户需求，并返回一个 **合法 JSON 字符串**，严格符合下面的 JSON Schema。\n\n"
+            "用户需求：{user_input}\n\n"
+            "JSON Schema（示例，仅用于说明结构）：\n" + _PLAN_JSON_SCHEMA.replace("{", "{{").replace("}", "}}")
+            + "\n\n" + _PLAN_RULES
+        ),
+    ),
+    "plan-v2": PromptTemplate(
+        system=(
+            "你是一名中文旅行规划师。阅读用户需求后，返回一个 **合法 JSON 对象**，严格符合下面的 JSON Schema。\n\n"
+            "JSON Schema（示例，仅用于说明结构）：\n" + _PLAN_JSON_SCHEMA + "\n\n" + _PLAN_RULES
+        ),
+        user="用户需求：{user_input}",
+    ),
+}
+
+# 修改 prompt 或 JSON 结构时新增模板并递增，使旧的行程缓存自然失效
+PLAN_PROMPT_VERSION = os.getenv("PLAN_PROMPT_VERSION", "plan-v2")
+if PLAN_PROMPT_VERSION not in PLAN_PROMPTS:
+    raise ValueError(f"Unknown PLAN_PROMPT_VERSION: {PLAN_PROMPT_VERSION}")
+
+
+def _build_plan_messages(user_input: str) -> List[dict]:
+    return PLAN_PROMPTS[PLAN_PROMPT_VERSION].messages(user_input=user_input)
+
+
+def _json_mode() -> bool:
+    """JSON 输出模式：提供方支持时要求模型直接返回 JSON 对象（prompt 中需出现“JSON”字样）。"""
+    return os.getenv("LLM_JSON_MODE", "true").strip().lower() not in {"0", "false", "no", "off"}
+
+
+class LlmUsageStats:
+    """累计 response.usage 中的 token 与前缀缓存命中数，供 /metrics 观察缓存效果。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": 0,
+            "fanout_plans": 0,
+            "fanout_day_retries": 0,
+            "fanout_days_failed": 0,
+            "json_repaired": 0,
+            "json_truncated": 0,
+        }
+        self._repair_kinds: dict = {}
+
+    def record(self, usage) -> None:
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        # DeepSeek 直接返回命中/未命中数；OpenAI 兼容接口放在 prompt_tokens_details.cached_tokens
+        hit = getattr(usage, "prompt_cache_hit_tokens", None)
+        miss = getattr(usage, "prompt_cache_miss_tokens", None)
+        if hit is None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            hit = getattr(details, "cached_tokens", None) or 0
+        if miss is None:
+            miss = max(prompt_tokens - hit, 0)
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["prompt_tokens"] += prompt_tokens
+            self._stats["completion_tokens"] += getattr(usage, "completion_tokens", None) or 0
+            self._stats["prompt_cache_hit_tokens"] += hit
+            self._stats["prompt_cache_miss_tokens"] += miss
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def record_repair(self, result: RepairResult) -> None:
+        with self._lock:
+            self._stats["json_repaired"] += 1
+            if result.truncated:
+                self._stats["json_truncated"] += 1
+            for kind in result.kinds:
+                self._repair_kinds[kind] = self._repair_kinds.get(kind, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["json_repair_kinds"] = dict(self._repair_kinds)
+        cached = stats["prompt_cache_hit_tokens"] + stats["prompt_cache_miss_tokens"]
+        stats["prompt_cache_hit_rate"] = round(stats["prompt_cache_hit_tokens"] / cached, 4) if cached else 0.0
+        stats["prompt_version"] = PLAN_PROMPT_VERSION
+        return stats
+
+
+llm_usage = LlmUsageStats()
+
+
+def _extract_json_text(content: str) -> str:
+    content = content.strip()
     # DeepSeek 有时会返回 ```json fenced code block，需提取其中的 JSON 字符串
     if content.startswith("```"):
         # 去掉开头的 ```json 或 ``` 标记
         content = re.sub(r"^```[\w-]*\s*", "", content)
         # 去掉结尾 ``` 标记
         content = re.sub(r"\s*```$", "", content)
-    else:
-        # 回退：提取第一个 JSON 对象
-        match = re.search(r"\{.*\}", content, re.DOTALL)
-        if match:
-            content = match.group(0)
+    elif not content.startswith("{"):
+        # 回退：从第一个 { 开始解码一个完整的 JSON 对象，忽略其后的多余文本
+        start = content.find("{")
+        if start >= 0:
+            try:
+                _, end = json.JSONDecoder().raw_decode(content, start)
+                content = content[start:end]
+            except json.JSONDecodeError:
+                content = content[start:]
+    return content
+
+
+def _parse_plan_content(content: str) -> dict:
+    try:
+        return json.loads(_extract_json_text(content))
+    except json.JSONDecodeError:
+        pass
+    # 格式有小问题或被截断时先尝试修复，避免整份行程重新生成
+    try:
+        result = repair_json(content)
+    except JsonRepairError as exc:
+        raise ValueError(f"LLM returned non-JSON content: {content}") from exc
+    if not isinstance(result.value, dict):
+        raise ValueError(f"LLM returned non-JSON content: {content}")
+    llm_usage.record_repair(result)
+    print(
+        f"⚠️ Repaired LLM JSON output: {', '.join(result.kinds)}"
+        + (f"; dropped incomplete {', '.join(result.dropped)}" if result.dropped else "")
+    )
+    plan = result.value
+    if result.truncated:
+        # 截断后只保留了完整的部分，标记出来，调用方不缓存这样的结果
+        plan["truncated"] = True
+    return plan
+
+
+def _served_model(response) -> str:
+    return getattr(response, "served_model", None) or DEEPSEEK_MODEL
+
+
+def _complete_json(messages: List[dict], served: Optional[list] = None) -> dict:
+    """调用模型并解析 JSON；传入 served 时把实际服务的模型追加进去（故障转移时与主模型不同）。"""
+    response = llm_router.complete(messages=messages, temperature=0.7, json_mode=_json_mode())
+    llm_usage.record(getattr(response, "usage", None))
+    if served is not None:
+        served.append(_served_model(response))
+    return _parse_plan_content(response.choices[0].message.content)
+
+
+async def _acomplete_json(messages: List[dict], served: Optional[list] = None) -> dict:
+    response = await llm_router.acomplete(messages=messages, temperature=0.7, json_mode=_json_mode())
+    llm_usage.record(getattr(response, "usage", None))
+    if served is not None:
+        served.append(_served_model(response))
+    return _parse_plan_content(response.choices[0].message.content)
+
+
+def _check_plan(plan: dict) -> dict:
+    if plan.get("truncated") and not plan.get("days"):
+        raise ValueError("LLM output was truncated before the first complete day")
+    return plan
+
+
+def _with_model(plan: dict, served: list) -> dict:
+    # 记录生成该行程的模型；分日生成中各天可能由不同提供方完成，此时列出全部模型
+    plan["model"] = ", ".join(sorted(set(served))) or DEEPSEEK_MODEL
+    return plan
+
+
+def generate_structured_travel_plan(user_input: str) -> dict:
+    days = fanout_trip_days(user_input)
+    if days:
+        return generate_fanout_plan(user_input, days)
+    served: list = []
+    return _with_model(_check_plan(_complete_json(_build_plan_messages(user_input), served)), served)
+
+
+async def agenerate_structured_travel_plan(user_input: str) -> dict:
+    days = fanout_trip_days(user_input)
+    if days:
+        return await agenerate_fanout_plan(user_input, days)
+    served: list = []
+    return _with_model(_check_plan(await _acomplete_json(_build_plan_messages(user_input), served)), served)
+
+
+# ========== 长行程分日并发生成 ==========
+# 先用一次短调用生成概览与逐日骨架，再为每天并发生成 items / meals / accommodation，最后合并回原有结构。
+# 总耗时取决于最慢的一天而不是所有天数之和；单日失败只重试该日，不会丢掉整份行程。
+
+# 预计天数达到该值时启用分日生成；0 表示关闭
+PLAN_FANOUT_MIN_DAYS = int(os.getenv("PLAN_FANOUT_MIN_DAYS", "8"))
+PLAN_FANOUT_MAX_DAYS = int(os.getenv("PLAN_FANOUT_MAX_DAYS", "30"))
+PLAN_FANOUT_CONCURRENCY = int(os.getenv("PLAN_FANOUT_CONCURRENCY", "4"))
+PLAN_FANOUT_DAY_RETRIES = int(os.getenv("PLAN_FANOUT_DAY_RETRIES", "2"))
+
+_CN_COUNT = r"\d{1,2}|[一二两三四五六七八九十]{1,3}"
+# 数字不能从另一个数字的中间开始（“12日”里的“2日”），也不能是序数（“第3天”）
+_COUNT_START = r"(?<![\d一二两三四五六七八九十第])"
+_TRIP_DAYS_RE = re.compile(rf"{_COUNT_START}({_CN_COUNT})\s*(?:天|日游)")
+# 单独的“N日”多半是日期（“3月12日”“12日至18日”“玩到18日”），只有明确是计数时才算时长：
+# 跟在“玩 / 住 / 待 / 共 / 为期”等之后（“玩三日”“为期5日”），或与晚数连用（“三日两晚”）
+_TRIP_BARE_DAYS_RE = re.compile(
+    rf"(?:(?:玩|游|逛|住|待|呆|停留|旅行|旅游|共|一共|总共|为期)\s*({_CN_COUNT})\s*日(?!\s*(?:出发|返回|返程|前|之前|起))"
+    rf"|{_COUNT_START}({_CN_COUNT})\s*日\s*(?:{_CN_COUNT})\s*晚)"
+)
+_TRIP_NIGHTS_RE = re.compile(rf"{_COUNT_START}({_CN_COUNT})\s*晚")
+_TRIP_WEEKS_RE = re.compile(rf"{_COUNT_START}(\d|[一两二三四])\s*(?:周|个?星期|个?礼拜)")
+
+_PLAN_SKELETON_SCHEMA = """{
+  "overview": {
+    "destination": "字符串，目的地名称",
+    "days": "整数天数",
+    "travelers": "字符串描述同行人数",
+    "budget": {
+      "currency": "字符串，例如 CNY",
+      "total": "数字，估算总预算"
+    },
+    "highlights": ["数组，列出行程特色主题"]
+  },
+  "budget_breakdown": [
+    {
+      "category": "transport|accommodation|dining|sightseeing|shopping|other",
+      "amount": "数字",
+      "description": "字符串说明"
+    }
+  ],
+  "days": [
+    {
+      "title": "字符串，例如 Day 1 - 抵达东京",
+      "date": "如已知可填 YYYY-MM-DD，否则 null",
+      "summary": "字符串，一两句概述当日安排与所在城市/区域",
+      "total_budget": "数字，估算当日花费"
+    }
+  ],
+  "advice": {
+    "preparation": ["行前准备建议"],
+    "local_tips": ["当地贴士"],
+    "money_saving": ["省钱技巧"],
+    "safety": ["安全提示"]
+  },
+  "emergency": {
+    "police": "报警电话或链接",
+    "medical": "急救电话或医院",
+    "embassy": "如适用可提供大使馆联系方式，否则写 null"
+  }
+}"""
+
+_PLAN_DAY_SCHEMA = """{
+  "items": [
+    {
+      "time": "时间段或 null，例如 09:00-11:00",
+      "name": "POI 名称",
+      "type": "scenic|restaurant|hotel|activity|other",
+      "address": "详细地址",
+      "city": "所在城市/区",
+      "description": "活动说明",
+      "budget": "数字，单项预算（如无法估算填 null）",
+      "notes": "额外提示，可为 null",
+      "longitude": "数字，经度，如不确定填 null",
+      "latitude": "数字，纬度，如不确定填 null"
+    }
+  ],
+  "accommodation": {
+    "name": "推荐住宿名称",
+    "address": "地址",
+    "budget": "数字或 null"
+  },
+  "meals": {
+    "breakfast": "早餐建议，可为 null",
+    "lunch": "午餐建议",
+    "dinner": "晚餐建议"
+  }
+}"""
+
+PLAN_FANOUT_PROMPTS = {
+    "skeleton-v1": PromptTemplate(
+        system=(
+            "你是一名中文旅行规划师。阅读用户需求后，先给出行程骨架：概览、预算拆分、逐日标题与概要、行前建议与紧急联系。"
+            "不要展开每日的具体景点、餐饮与住宿，后续会逐日补充。返回一个 **合法 JSON 对象**，严格符合下面的 JSON Schema。\n\n"
+            "JSON Schema（示例，仅用于说明结构）：\n" + _PLAN_SKELETON_SCHEMA + "\n\n" + _PLAN_RULES
+            + "\n5. days 数组的长度必须等于行程天数，按先后顺序排列。"
+        ),
+        user="用户需求：{user_input}\n行程天数：{days}",
+    ),
+    "day-v1": PromptTemplate(
+        system=(
+            "你是一名中文旅行规划师。根据用户需求、行程概览与逐日安排，为指定的一天生成详细的景点、餐饮与住宿安排，"
+            "与其他日期不要重复。返回一个 **合法 JSON 对象**，严格符合下面的 JSON Schema。\n\n"
+            "JSON Schema（示例，仅用于说明结构）：\n" + _PLAN_DAY_SCHEMA + "\n\n" + _PLAN_RULES
+        ),
+        # 同一份行程的各天共享用户需求、概览与逐日安排这段前缀，只有最后一行不同
+        user="用户需求：{user_input}\n\n行程概览：{overview}\n\n逐日安排：\n{outline}\n\n请生成第 {day_number} 天的详细安排：{day}",
+    ),
+}
+
+
+def _count(text: str) -> Optional[int]:
+    if text.isdigit():
+        return int(text)
+    value = parse_chinese_number(text)
+    return int(value) if value is not None else None
+
+
+def _valid_days(candidates: List[Optional[int]]) -> List[int]:
+    return [days for days in candidates if days and 0 < days <= PLAN_FANOUT_MAX_DAYS]
+
+
+def estimate_trip_days(user_input: str) -> Optional[int]:
+    """从需求文本中估计行程天数（“12天”“五日游”“十天九晚”“两周”），无法判断时返回 None。
+
+    明确的“N天 / N日游”优先；没有时才参考“N晚”“N周”与明确是计数的“N日”（“玩三日”“三日两晚”），
+    其余单独的“N日”都视为日期。
+    """
+    text = user_input or ""
+    explicit = _valid_days([_count(match.group(1)) for match in _TRIP_DAYS_RE.finditer(text)])
+    if explicit:
+        return max(explicit)
+    candidates = [_count(match.group(1) or match.group(2)) for match in _TRIP_BARE_DAYS_RE.finditer(text)]
+    for match in _TRIP_NIGHTS_RE.finditer(text):
+        nights = _count(match.group(1))
+        candidates.append(nights + 1 if nights is not None else None)
+    for match in _TRIP_WEEKS_RE.finditer(text):
+        weeks = _count(match.group(1))
+        candidates.append(weeks * 7 if weeks is not None else None)
+    candidates = _valid_days(candidates)
+    return max(candidates) if candidates else None
+
+
+def fanout_trip_days(user_input: str) -> Optional[int]:
+    """需要分日生成时返回预计天数，否则返回 None。"""
+    if PLAN_FANOUT_MIN_DAYS <= 0:
+        return None
+    days = estimate_trip_days(user_input)
+    return days if days is not None and days >= PLAN_FANOUT_MIN_DAYS else None
+
+
+def _skeleton_messages(user_input: str, days: int) -> List[dict]:
+    return PLAN_FANOUT_PROMPTS["skeleton-v1"].messages(user_input=user_input, days=days)
+
+
+def _check_skeleton(skeleton) -> dict:
+    if not isinstance(skeleton, dict) or not isinstance(skeleton.get("days"), list) or not skeleton["days"]:
+        raise ValueError("LLM returned a plan skeleton without days")
+    skeleton["days"] = [day if isinstance(day, dict) else {} for day in skeleton["days"]]
+    return skeleton
+
+
+def _day_messages(user_input: str, skeleton: dict, index: int) -> List[dict]:
+    days = skeleton["days"]
+    outline = "\n".join(
+        f"第 {number} 天：{day.get('title') or ''}｜{day.get('summary') or ''}" for number, day in enumerate(days, 1)
+    )
+    return PLAN_FANOUT_PROMPTS["day-v1"].messages(
+        user_input=user_input,
+        overview=json.dumps(skeleton.get("overview") or {}, ensure_ascii=False),
+        outline=outline,
+        day_number=index + 1,
+        day=json.dumps(days[index], ensure_ascii=False),
+    )
+
+
+def _check_day_detail(detail) -> dict:
+    if not isinstance(detail, dict) or not isinstance(detail.get("items"), list):
+        raise ValueError("LLM returned a day without items")
+    return detail
+
+
+def _merge_day(day: dict, detail: Optional[dict]) -> dict:
+    detail = detail or {}
+    return {
+        **day,
+        "items": detail.get("items") or [],
+        "accommodation": detail.get("accommodation"),
+        "meals": detail.get("meals"),
+    }
+
+
+def _merge_fanout_plan(skeleton: dict, details: dict) -> dict:
+    """把逐日结果合并回完整行程；重试后仍失败的日期保留骨架，并列在 incomplete_days 中。"""
+    failed = [index for index in range(len(skeleton["days"])) if details.get(index) is None]
+    if len(failed) == len(skeleton["days"]):
+        raise ValueError("LLM failed to generate every day of the plan")
+    plan = {
+        **skeleton,
+        "days": [_merge_day(day, details.get(index)) for index, day in enumerate(skeleton["days"])],
+        # 长行程不让模型重复输出整段文本，由调用方根据结构化内容生成
+        "itinerary_text": skeleton.get("itinerary_text"),
+    }
+    if failed:
+        plan["incomplete_days"] = failed
+    return plan
+
+
+def _generate_day(user_input: str, skeleton: dict, index: int, served: list) -> dict:
+    last_error: Optional[Exception] = None
+    for attempt in range(PLAN_FANOUT_DAY_RETRIES + 1):
+        if attempt:
+            llm_usage.count("fanout_day_retries")
+        try:
+            return _check_day_detail(_complete_json(_day_messages(user_input, skeleton, index), served))
+        except Exception as exc:
+            last_error = exc
+    raise last_error
+
+
+async def _agenerate_day(
+    user_input: str, skeleton: dict, index: int, slots: asyncio.Semaphore, served: list
+) -> Optional[dict]:
+    last_error: Optional[Exception] = None
+    for attempt in range(PLAN_FANOUT_DAY_RETRIES + 1):
+        if attempt:
+            llm_usage.count("fanout_day_retries")
+        try:
+            async with slots:
+                return _check_day_detail(await _acomplete_json(_day_messages(user_input, skeleton, index), served))
+        except Exception as exc:
+            last_error = exc
+    print(f"⚠️ Plan day {index + 1} failed after retries: {last_error}")
+    llm_usage.count("fanout_days_failed")
+    return None
+
+
+def _iter_fanout_days(user_input: str, skeleton: dict, served: list) -> Iterator[Tuple[int, Optional[dict]]]:
+    """并发生成各天，按完成顺序产出 (day_index, detail)；重试后仍失败的为 None。"""
+    total = len(skeleton["days"])
+    pool = ThreadPoolExecutor(max_workers=max(1, min(PLAN_FANOUT_CONCURRENCY, total)), thread_name_prefix="plan-day")
+    try:
+        futures = {pool.submit(_generate_day, user_input, skeleton, index, served): index for index in range(total)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield index, future.result()
+            except Exception as exc:
+                print(f"⚠️ Plan day {index + 1} failed after retries: {exc}")
+                llm_usage.count("fanout_days_failed")
+                yield index, None
+    finally:
+        # 调用方提前停止（例如 SSE 客户端断开）时不再发起剩余日期的请求
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def generate_fanout_plan(user_input: str, days: int) -> dict:
+    served: list = []
+    skeleton = _check_skeleton(_complete_json(_skeleton_messages(user_input, days), served))
+    llm_usage.count("fanout_plans")
+    plan = _merge_fanout_plan(skeleton, dict(_iter_fanout_days(user_input, skeleton, served)))
+    return _with_model(plan, served)
+
+
+async def agenerate_fanout_plan(user_input: str, days: int) -> dict:
+    served: list = []
+    skeleton = _check_skeleton(await _acomplete_json(_skeleton_messages(user_input, days), served))
+    llm_usage.count("fanout_plans")
+    slots = asyncio.Semaphore(max(1, PLAN_FANOUT_CONCURRENCY))
+    details = await asyncio.gather(
+        *(_agenerate_day(user_input, skeleton, index, slots, served) for index in range(len(skeleton["days"])))
+    )
+    return _with_model(_merge_fanout_plan(skeleton, dict(enumerate(details))), served)
+
+
+def _stream_fanout_plan(user_input: str, days: int) -> Iterator[Tuple[str, dict]]:
+    """分日生成的流式版本：骨架完成后推送 overview，之后每完成一天推送该日的 item 与 day 事件。"""
+    served: list = []
+    skeleton = _check_skeleton(_complete_json(_skeleton_messages(user_input, days), served))
+    llm_usage.count("fanout_plans")
+    if isinstance(skeleton.get("overview"), dict):
+        yield "overview", skeleton["overview"]
+    details = {}
+    for index, detail in _iter_fanout_days(user_input, skeleton, served):
+        details[index] = detail
+        if detail is None:
+            continue
+        day = _merge_day(skeleton["days"][index], detail)
+        for item_index, item in enumerate(day["items"]):
+            if isinstance(item, dict):
+                yield "item", {"day_index": index, "item_index": item_index, "item": item}
+        yield "day", {"day_index": index, "day": day}
+    yield "plan", _with_model(_merge_fanout_plan(skeleton, details), served)
+
+
+# ========== 局部重新生成：只把目标日期或单个地点及最少上下文发给模型 ==========
+
+_PLAN_ITEM_SCHEMA = """{
+  "time": "时间段或 null，例如 09:00-11:00",
+  "name": "POI 名称",
+  "type": "scenic|restaurant|hotel|activity|other",
+  "address": "详细地址",
+  "city": "所在城市/区",
+  "description": "活动说明",
+  "budget": "数字，单项预算（如无法估算填 null）",
+  "notes": "额外提示，可为 null",
+  "longitude": "数字，经度，如不确定填 null",
+  "latitude": "数字，纬度，如不确定填 null"
+}"""
+
+PLAN_EDIT_PROMPTS = {
+    "edit-day-v1": PromptTemplate(
+        system=(
+            "你是一名中文旅行规划师。用户会给出行程概览、逐日标题、需要修改的某一天的当前安排以及修改要求。"
+            "请按要求重新安排这一天：未被要求修改的部分尽量保持不变，不要与其他日期重复。"
+            "返回该日的 **合法 JSON 对象**，包含 title、summary、total_budget 以及下面 JSON Schema 中的字段。\n\n"
+            "JSON Schema（示例，仅用于说明结构）：\n" + _PLAN_DAY_SCHEMA + "\n\n" + _PLAN_RULES
+        ),
+        user="行程概览：{overview}\n\n逐日安排：\n{outline}\n\n第 {day_number} 天当前安排：{day}\n\n修改要求：{instruction}",
+    ),
+    "edit-item-v1": PromptTemplate(
+        system=(
+            "你是一名中文旅行规划师。用户会给出某一天的概要、当天其他安排以及需要替换的一个地点/活动和修改要求。"
+            "请给出一个替换后的地点/活动，时间段与当天其他安排衔接。返回一个 **合法 JSON 对象**，严格符合下面的 JSON Schema。\n\n"
+            "JSON Schema（示例，仅用于说明结构）：\n" + _PLAN_ITEM_SCHEMA + "\n\n" + _PLAN_RULES
+        ),
+        user="目的地：{destination}\n当天：{day_title}｜{day_summary}\n当天其他安排：\n{neighbours}\n\n当前安排：{item}\n\n修改要求：{instruction}",
+    ),
+}
+
+# 发给模型时省略的字段：坐标由地理编码补全，不需要模型参考
+_EDIT_OMIT_KEYS = {"longitude", "latitude", "coordinate_source"}
+
+
+def _compact(value):
+    if isinstance(value, dict):
+        return {key: _compact(item) for key, item in value.items() if key not in _EDIT_OMIT_KEYS and item is not None}
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    return value
+
+
+def _plan_day(plan: dict, day_index: int) -> dict:
+    days = plan.get("days") if isinstance(plan, dict) else None
+    if not isinstance(days, list) or not 0 <= day_index < len(days) or not isinstance(days[day_index], dict):
+        raise IndexError(f"Plan has no day {day_index}")
+    return days[day_index]
+
+
+def regenerate_plan_day(plan: dict, day_index: int, instruction: str) -> dict:
+    """按修改要求重新生成某一天，返回新的 day 对象（未提供的标题/概要沿用原值）。"""
+    day = _plan_day(plan, day_index)
+    overview = plan.get("overview") or {}
+    outline = "\n".join(
+        f"第 {number} 天：{(other or {}).get('title') or ''}"
+        for number, other in enumerate(plan["days"], 1)
+        if isinstance(other, dict)
+    )
+    detail = _check_day_detail(_complete_json(PLAN_EDIT_PROMPTS["edit-day-v1"].messages(
+        overview=json.dumps(_compact({key: overview.get(key) for key in ("destination", "days", "travelers", "budget")}), ensure_ascii=False),
+        outline=outline,
+        day_number=day_index + 1,
+        day=json.dumps(_compact(day), ensure_ascii=False),
+        instruction=instruction,
+    )))
+    merged = _merge_day(day, detail)
+    for key in ("title", "summary", "total_budget"):
+        if detail.get(key) is not None:
+            merged[key] = detail[key]
+    return merged
+
+
+def regenerate_plan_item(plan: dict, day_index: int, item_index: int, instruction: str) -> dict:
+    """按修改要求替换某一天中的单个地点/活动，返回新的 item。"""
+    day = _plan_day(plan, day_index)
+    items = day.get("items") if isinstance(day.get("items"), list) else []
+    if not 0 <= item_index < len(items) or not isinstance(items[item_index], dict):
+        raise IndexError(f"Day {day_index} has no item {item_index}")
+    neighbours = "\n".join(
+        f"- {other.get('time') or ''} {other.get('name') or ''}".rstrip()
+        for index, other in enumerate(items)
+        if index != item_index and isinstance(other, dict)
+    ) or "（无）"
+    item = _complete_json(PLAN_EDIT_PROMPTS["edit-item-v1"].messages(
+        destination=(plan.get("overview") or {}).get("destination") or "",
+        day_title=day.get("title") or "",
+        day_summary=day.get("summary") or "",
+        neighbours=neighbours,
+        item=json.dumps(_compact(items[item_index]), ensure_ascii=False),
+        instruction=instruction,
+    ))
+    if not isinstance(item, dict) or not item.get("name"):
+        raise ValueError("LLM returned an item without a name")
+    return item
+
+
+def _repair_fragment(fragment: str) -> Optional[dict]:
+    # 片段已闭合，修复后仍不完整时不推送，最终结果由 _parse_plan_content 处理
     try:
-        return json.loads(content)
-    except json.JSONDecodeError as exc:
-        raise ValueError(f"LLM returned non-JSON content: {content}") from exc
\ No newline at end of file
+        result = repair_json(fragment)
+    except JsonRepairError:
+        return None
+    return None if result.truncated else result.value
+
+
+class PlanStreamParser:
+    """增量扫描流式返回的 JSON 文本，在 overview / day / item 对象闭合时立即回调。
+
+    只跟踪括号层级、字符串与键名，不做完整解析；闭合对象的片段交给 json.loads。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        # 每层：{"type": "{" | "[", "key": 父容器中的键/下标, "start": 起始偏移, "index": 数组下标, "pending_key": 对象中待赋值的键}
+        self._stack: List[dict] = []
+        self._root_closed = False
+
+    def feed(self, chunk: str) -> List[Tuple[list, dict]]:
+        """追加文本片段，返回本次闭合的 (path, value) 列表。"""
+        self.buffer += chunk
+        closed: List[Tuple[list, dict]] = []
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._root_closed:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = buf[self._string_start:i + 1]
+                continue
+            if not self._stack and ch != "{":
+                # 根对象之前的内容（例如 ```json 标记）直接跳过
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ":":
+                top = self._stack[-1]
+                if top["type"] == "{" and self._last_string is not None:
+                    try:
+                        top["pending_key"] = json.loads(self._last_string)
+                    except json.JSONDecodeError:
+                        top["pending_key"] = None
+            elif ch == ",":
+                top = self._stack[-1]
+                if top["type"] == "[":
+                    top["index"] += 1
+                else:
+                    top["pending_key"] = None
+            elif ch in "{[":
+                key = None
+                if self._stack:
+                    parent = self._stack[-1]
+                    key = parent["index"] if parent["type"] == "[" else parent.get("pending_key")
+                self._stack.append({"type": ch, "key": key, "start": i, "index": 0, "pending_key": None})
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                frame = self._stack.pop()
+                if ch == "}":
+                    path = [f["key"] for f in self._stack[1:]] + ([frame["key"]] if self._stack else [])
+                    try:
+                        value = json.loads(buf[frame["start"]:i + 1])
+                    except json.JSONDecodeError:
+                        value = _repair_fragment(buf[frame["start"]:i + 1])
+                    if isinstance(value, dict):
+                        closed.append((path, value))
+                if not self._stack:
+                    self._root_closed = True
+        self._pos = len(buf)
+        return closed
+
+
+def _classify_stream_path(path: list) -> Optional[Tuple[str, dict]]:
+    if path == ["overview"]:
+        return "overview", {}
+    if len(path) == 2 and path[0] == "days" and isinstance(path[1], int):
+        return "day", {"day_index": path[1]}
+    if (
+        len(path) == 4
+        and path[0] == "days"
+        and isinstance(path[1], int)
+        and path[2] == "items"
+        and isinstance(path[3], int)
+    ):
+        return "item", {"day_index": path[1], "item_index": path[3]}
+    return None
+
+
+def stream_structured_travel_plan(user_input: str) -> Iterator[Tuple[str, dict]]:
+    """流式生成结构化行程。
+
+    依次产出 ("overview", {...}) / ("item", {...}) / ("day", {...}) 事件，
+    最后产出 ("plan", 完整计划)。解析失败时抛出 ValueError。长行程按天生成，day 事件按完成顺序到达。
+    """
+    days = fanout_trip_days(user_input)
+    if days:
+        yield from _stream_fanout_plan(user_input, days)
+        return
+    stream = llm_router.stream(
+        messages=_build_plan_messages(user_input),
+        temperature=0.7,
+        # 最后一个 chunk 携带 usage（choices 为空）
+        stream_options={"include_usage": True},
+        json_mode=_json_mode(),
+    )
+    parser = PlanStreamParser()
+    served: list = []
+    for chunk in stream:
+        if not served:
+            served.append(_served_model(chunk))
+        if getattr(chunk, "usage", None) is not None:
+            llm_usage.record(chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        for path, value in parser.feed(delta):
+            classified = _classify_stream_path(path)
+            if classified is None:
+                continue
+            event, meta = classified
+            if event == "overview":
+                yield event, value
+            elif event == "day":
+                yield event, {**meta, "day": value}
+            else:
+                yield event, {**meta, "item": value}
+    yield "plan", _with_model(_check_plan(_parse_plan_content(parser.buffer)), served)
@@ -0,0 +1,587 @@
+# backend/llm_router.py
+"""LLM 提供方路由：多个 OpenAI 兼容端点之间的故障转移、对冲请求与按延迟选择。
+
+- LLM_PROVIDERS 按优先级列出提供方名称（默认只有 deepseek），每个提供方通过
+  LLM_<NAME>_BASE_URL / _API_KEY / _MODEL / _TIMEOUT / _MAX_CONCURRENCY / _JSON_MODE 配置
+- 每个提供方维护滚动延迟窗口（p95）与 EWMA 延迟 / 错误率，健康且更快的提供方优先
+- 连续失败达到阈值后熔断一段时间，期间只在其他提供方都失败时才尝试；冷却结束后半开，
+  只放行一个探测请求，成功才恢复，失败则重新熔断
+- 延迟窗口只记录非流式调用；流式调用的总时长取决于生成长度，混入会抬高 p95 与对冲延迟
+- 开启对冲（LLM_HEDGE）后，首选提供方超过其 p95 仍未返回时向次选提供方再发一次，取先成功者
+- 同步与异步调用共享同一套统计与并发上限；base_url 可指向本地桩服务进行测试
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+
+class LlmUnavailableError(RuntimeError):
+    """所有提供方均调用失败。"""
+
+
+class ProviderBusyError(RuntimeError):
+    pass
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() not in {"0", "false", "no", "off"}
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    name: str
+    base_url: str
+    api_key: Optional[str]
+    model: str
+    timeout: float = 120
+    connect_timeout: float = 10
+    max_concurrency: int = 8
+    max_retries: int = 0
+    # 是否支持 response_format={"type": "json_object"}
+    json_mode: bool = False
+
+    @classmethod
+    def from_env(cls, name: str, single: bool) -> "ProviderConfig":
+        prefix = f"LLM_{name.upper().replace('-', '_')}_"
+        defaults = {}
+        if name == "deepseek":
+            defaults = {
+                "api_key": os.getenv("DEEPSEEK_API_KEY"),
+                "base_url": os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+                "model": os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
+                "json_mode": "true",
+            }
+        base_url = os.getenv(prefix + "BASE_URL") or defaults.get("base_url")
+        model = os.getenv(prefix + "MODEL") or defaults.get("model")
+        if not base_url or not model:
+            raise ValueError(f"Unsupported LLM provider: {name} (set {prefix}BASE_URL and {prefix}MODEL)")
+        # 多个提供方时由路由负责换提供方重试，SDK 内部重试只会推迟故障转移
+        default_retries = os.getenv("LLM_MAX_RETRIES", "2") if single else "0"
+        return cls(
+            name=name,
+            base_url=base_url,
+            api_key=os.getenv(prefix + "API_KEY") or defaults.get("api_key"),
+            model=model,
+            timeout=float(os.getenv(prefix + "TIMEOUT") or os.getenv("LLM_TIMEOUT", "120")),
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "10")),
+            max_concurrency=int(os.getenv(prefix + "MAX_CONCURRENCY", "8")),
+            max_retries=int(os.getenv(prefix + "MAX_RETRIES", default_retries)),
+            json_mode=_env_flag(prefix + "JSON_MODE", defaults.get("json_mode") == "true"),
+        )
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10")),
+        keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120")),
+    )
+
+
+class LatencyEstimator:
+    """滚动窗口 p95 + EWMA 延迟 / 错误率 + 连续失败熔断。"""
+
+    def __init__(self, window: int = 100, alpha: float = 0.2, failure_threshold: int = 3, cooldown_seconds: float = 30):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._samples: deque = deque(maxlen=window)
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        # 半开状态下探测请求的放行期限，期间其他请求不再放行
+        self.probe_until = 0.0
+
+    def record_success(self, latency: Optional[float]) -> None:
+        """latency 为 None 时只更新健康状态，不计入延迟样本（流式调用）。"""
+        if latency is not None:
+            self._samples.append(latency)
+            self.ewma_latency = latency if self.ewma_latency is None else (
+                self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+            )
+        self.error_rate *= 1 - self.alpha
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probe_until = 0.0
+
+    def record_failure(self) -> None:
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.cooldown_seconds
+            self.probe_until = 0.0
+
+    def healthy(self) -> bool:
+        now = time.monotonic()
+        return self.open_until <= now and self.probe_until <= now
+
+    def admit(self) -> bool:
+        """是否可以作为正常候选放行一个请求。熔断到期后（半开）只放行一个探测请求，直到它成功或失败；
+        探测超过冷却时间仍无结果（例如领取后并未真正调用）时再放行下一个。"""
+        if not self.healthy():
+            return False
+        if self.consecutive_failures >= self.failure_threshold:
+            self.probe_until = time.monotonic() + self.cooldown_seconds
+        return True
+
+    def samples(self) -> int:
+        return len(self._samples)
+
+    def p95(self) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def score(self) -> float:
+        """越小越好：EWMA 延迟按错误率加罚。"""
+        return (self.ewma_latency or 0.0) * (1 + 4 * self.error_rate)
+
+
+def _settle(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Provider:
+    def __init__(self, config: ProviderConfig, estimator: LatencyEstimator):
+        self.config = config
+        self.estimator = estimator
+        self.in_flight = 0
+        self._slots = threading.Condition()
+        # 等待名额的协程（事件循环, future），release 时唤醒最早的一个
+        self._async_waiters: deque = deque()
+        self._client_lock = threading.Lock()
+        self._sync_client: Optional[OpenAI] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+        self.stats = {"calls": 0, "failures": 0, "hedges": 0, "hedge_wins": 0, "busy": 0}
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def _client_kwargs(self) -> dict:
+        return {"api_key": self.config.api_key, "base_url": self.config.base_url, "max_retries": self.config.max_retries}
+
+    def _timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.config.timeout, connect=self.config.connect_timeout)
+
+    def sync_client(self) -> OpenAI:
+        with self._client_lock:
+            if self._sync_client is None:
+                self._sync_client = OpenAI(
+                    **self._client_kwargs(),
+                    http_client=httpx.Client(limits=_http_limits(), timeout=self._timeout()),
+                )
+            return self._sync_client
+
+    def async_client(self) -> AsyncOpenAI:
+        with self._client_lock:
+            if self._async_client is None:
+                self._async_client = AsyncOpenAI(
+                    **self._client_kwargs(),
+                    http_client=httpx.AsyncClient(limits=_http_limits(), timeout=self._timeout()),
+                )
+            return self._async_client
+
+    def tag(self, response):
+        """在响应上记录实际服务的模型，调用方据此区分主模型与故障转移的结果。"""
+        try:
+            response.served_model = self.config.model
+        except (AttributeError, TypeError, ValueError):
+            pass
+        return response
+
+    def request_kwargs(self, kwargs: dict, json_mode: bool) -> dict:
+        kwargs = {**kwargs, "model": self.config.model}
+        if json_mode and self.config.json_mode:
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    def full(self) -> bool:
+        return self.in_flight >= self.config.max_concurrency
+
+    def try_acquire(self) -> bool:
+        with self._slots:
+            if self.full():
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self, timeout: float) -> None:
+        with self._slots:
+            if not self._slots.wait_for(lambda: not self.full(), timeout):
+                self.stats["busy"] += 1
+                raise ProviderBusyError(f"LLM provider {self.name} is at its concurrency limit")
+            self.in_flight += 1
+
+    async def acquire_async(self, timeout: float) -> None:
+        """协程版 acquire：满载时挂起等待 release 唤醒，不轮询；与同步调用共享同一组名额。"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._slots:
+                if not self.full():
+                    self.in_flight += 1
+                    return
+                entry = (loop, loop.create_future())
+                self._async_waiters.append(entry)
+            try:
+                await asyncio.wait_for(entry[1], max(0.0, deadline - loop.time()))
+            except BaseException as exc:
+                with self._slots:
+                    if entry in self._async_waiters:
+                        self._async_waiters.remove(entry)
+                    else:
+                        # 已被唤醒却不再需要名额，把唤醒转交给下一个等待者
+                        self._wake_async_waiter()
+                    if isinstance(exc, asyncio.TimeoutError):
+                        self.stats["busy"] += 1
+                if isinstance(exc, asyncio.TimeoutError):
+                    raise ProviderBusyError(f"LLM provider {self.name} is at its concurrency limit") from None
+                raise
+
+    def release(self) -> None:
+        with self._slots:
+            self.in_flight -= 1
+            self._slots.notify()
+            self._wake_async_waiter()
+
+    def _wake_async_waiter(self) -> None:
+        # 调用方持有 self._slots；被唤醒的协程重新检查名额，可能被同步调用方抢先
+        while self._async_waiters:
+            loop, waiter = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_settle, waiter)
+                return
+            except RuntimeError:
+                # 事件循环已关闭
+                continue
+
+    async def aclose(self) -> None:
+        with self._client_lock:
+            sync_client, async_client = self._sync_client, self._async_client
+            self._sync_client = self._async_client = None
+        if sync_client is not None:
+            sync_client.close()
+        if async_client is not None:
+            await async_client.close()
+
+
+class LlmRouter:
+    def __init__(
+        self,
+        configs: List[ProviderConfig],
+        hedge: bool = False,
+        hedge_min_delay: float = 1.0,
+        hedge_min_samples: int = 20,
+        explore_ratio: float = 0.0,
+        acquire_timeout: float = 30,
+        window: int = 100,
+        alpha: float = 0.2,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30,
+    ):
+        if not configs:
+            raise ValueError("At least one LLM provider is required")
+        self.providers = [
+            Provider(config, LatencyEstimator(window, alpha, failure_threshold, cooldown_seconds))
+            for config in configs
+        ]
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.explore_ratio = explore_ratio
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def primary(self) -> Provider:
+        return self.providers[0]
+
+    # ---------- 选择 ----------
+
+    def candidates(self) -> List[Provider]:
+        """按尝试顺序返回提供方：健康且未满载的在前，其中有延迟样本的按得分排序，
+        尚无样本的按配置顺序排在其后；熔断中（含半开且探测已被其他请求领取）的提供方放在最后作为兜底。"""
+        with self._lock:
+            order = {provider.name: index for index, provider in enumerate(self.providers)}
+            admitted = {provider.name: provider.estimator.admit() for provider in self.providers}
+
+            def rank(provider: Provider):
+                estimator = provider.estimator
+                sampled = estimator.samples() > 0
+                return (
+                    not admitted[provider.name],
+                    provider.full(),
+                    not sampled,
+                    estimator.score() if sampled else 0.0,
+                    order[provider.name],
+                )
+
+            ranked = sorted(self.providers, key=rank)
+            # 少量流量探索其他健康提供方，使其延迟估计保持新鲜
+            if self.explore_ratio and len(ranked) > 1 and random.random() < self.explore_ratio:
+                healthy = [p for p in ranked[1:] if admitted[p.name]]
+                if healthy:
+                    chosen = random.choice(healthy)
+                    ranked.remove(chosen)
+                    ranked.insert(0, chosen)
+            return ranked
+
+    def _hedge_delay(self, provider: Provider) -> Optional[float]:
+        if not self.hedge:
+            return None
+        with self._lock:
+            if provider.estimator.samples() < self.hedge_min_samples:
+                return None
+            return max(self.hedge_min_delay, provider.estimator.p95())
+
+    def _record(self, provider: Provider, latency: Optional[float], failed: bool = False) -> None:
+        """记录一次调用结果；成功但 latency 为 None（流式）时不计入延迟样本。"""
+        with self._lock:
+            provider.stats["calls"] += 1
+            if failed:
+                provider.stats["failures"] += 1
+                provider.estimator.record_failure()
+            else:
+                provider.estimator.record_success(latency)
+
+    # ---------- 同步 ----------
+
+    def _call(self, provider: Provider, kwargs: dict, json_mode: bool):
+        provider.acquire(self.acquire_timeout)
+        start = time.monotonic()
+        try:
+            response = provider.sync_client().chat.completions.create(**provider.request_kwargs(kwargs, json_mode))
+        except Exception:
+            self._record(provider, None, failed=True)
+            raise
+        finally:
+            provider.release()
+        self._record(provider, time.monotonic() - start)
+        return provider.tag(response)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                workers = sum(provider.config.max_concurrency for provider in self.providers)
+                self._executor = ThreadPoolExecutor(max_workers=max(2, workers), thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def _hedged_call(self, primary: Provider, backup: Provider, delay: float, kwargs: dict, json_mode: bool):
+        pool = self._pool()
+        first = pool.submit(self._call, primary, kwargs, json_mode)
+        futures = {first: primary}
+        wait_futures([first], timeout=delay)
+        # 首选超过 p95 仍未返回，或已经失败时，立即向次选提供方发出请求
+        if not first.done() or first.exception() is not None:
+            with self._lock:
+                backup.stats["hedges"] += 1
+            futures[pool.submit(self._call, backup, kwargs, json_mode)] = backup
+        last_error: Optional[BaseException] = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # 落后的请求无法中断同步 HTTP 调用，让它在后台结束并释放名额
+                    if futures[future] is backup and len(futures) > 1:
+                        with self._lock:
+                            backup.stats["hedge_wins"] += 1
+                    return future.result()
+                last_error = future.exception()
+        raise last_error
+
+    def complete(self, json_mode: bool = False, **kwargs):
+        """chat.completions.create 的路由版本；model 与 response_format 由提供方配置决定。"""
+        candidates = self.candidates()
+        last_error: Optional[BaseException] = None
+        index = 0
+        while index < len(candidates):
+            provider = candidates[index]
+            delay = self._hedge_delay(provider) if index + 1 < len(candidates) else None
+            try:
+                if delay is not None:
+                    index += 2
+                    return self._hedged_call(provider, candidates[index - 1], delay, kwargs, json_mode)
+                index += 1
+                return self._call(provider, kwargs, json_mode)
+            except Exception as exc:
+                last_error = exc
+                print(f"⚠️ LLM provider {provider.name} failed, trying next: {exc}")
+        raise LlmUnavailableError(f"All LLM providers failed: {last_error}") from last_error
+
+    def stream(self, json_mode: bool = False, **kwargs) -> Iterator:
+        """流式调用：收到首个 chunk 之前失败会切换提供方，之后的错误直接抛出。"""
+        last_error: Optional[BaseException] = None
+        for provider in self.candidates():
+            started = False
+            try:
+                provider.acquire(self.acquire_timeout)
+            except ProviderBusyError as exc:
+                last_error = exc
+                continue
+            stream = None
+            try:
+                stream = provider.sync_client().chat.completions.create(
+                    **provider.request_kwargs({**kwargs, "stream": True}, json_mode)
+                )
+                for chunk in stream:
+                    started = True
+                    yield provider.tag(chunk)
+            except Exception as exc:
+                self._record(provider, None, failed=True)
+                if started:
+                    raise
+                last_error = exc
+                print(f"⚠️ LLM provider {provider.name} failed, trying next: {exc}")
+                continue
+            finally:
+                # 调用方提前停止迭代（客户端断开）时生成器在 yield 处收到 GeneratorExit，
+                # 需要显式关闭 SDK 流以释放 HTTP 连接，否则上游会继续生成直到结束
+                if stream is not None:
+                    close = getattr(stream, "close", None)
+                    if close is not None:
+                        try:
+                            close()
+                        except Exception as exc:
+                            print(f"⚠️ LLM stream close failed: {exc}")
+                provider.release()
+            # 流式调用只更新健康状态，总时长不进入非流式调用的延迟窗口
+            self._record(provider, None)
+            return
+        raise LlmUnavailableError(f"All LLM providers failed: {last_error}") from last_error
+
+    # ---------- 异步 ----------
+
+    async def _acall(self, provider: Provider, kwargs: dict, json_mode: bool):
+        await provider.acquire_async(self.acquire_timeout)
+        start = time.monotonic()
+        try:
+            response = await provider.async_client().chat.completions.create(
+                **provider.request_kwargs(kwargs, json_mode)
+            )
+        except asyncio.CancelledError:
+            # 对冲中落败被取消，不计入统计
+            raise
+        except Exception:
+            self._record(provider, None, failed=True)
+            raise
+        finally:
+            provider.release()
+        self._record(provider, time.monotonic() - start)
+        return provider.tag(response)
+
+    async def _ahedged_call(self, primary: Provider, backup: Provider, delay: float, kwargs: dict, json_mode: bool):
+        first = asyncio.ensure_future(self._acall(primary, kwargs, json_mode))
+        tasks = {first: primary}
+        await asyncio.wait([first], timeout=delay)
+        if not first.done() or first.exception() is not None:
+            with self._lock:
+                backup.stats["hedges"] += 1
+            tasks[asyncio.ensure_future(self._acall(backup, kwargs, json_mode))] = backup
+        pending = set(tasks)
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] is backup and len(tasks) > 1:
+                            with self._lock:
+                                backup.stats["hedge_wins"] += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acomplete(self, json_mode: bool = False, **kwargs):
+        candidates = self.candidates()
+        last_error: Optional[BaseException] = None
+        index = 0
+        while index < len(candidates):
+            provider = candidates[index]
+            delay = self._hedge_delay(provider) if index + 1 < len(candidates) else None
+            try:
+                if delay is not None:
+                    index += 2
+                    return await self._ahedged_call(provider, candidates[index - 1], delay, kwargs, json_mode)
+                index += 1
+                return await self._acall(provider, kwargs, json_mode)
+            except Exception as exc:
+                last_error = exc
+                print(f"⚠️ LLM provider {provider.name} failed, trying next: {exc}")
+        raise LlmUnavailableError(f"All LLM providers failed: {last_error}") from last_error
+
+    # ---------- 运维 ----------
+
+    async def aclose(self) -> None:
+        for provider in self.providers:
+            await provider.aclose()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            providers = {}
+            for provider in self.providers:
+                estimator = provider.estimator
+                p95 = estimator.p95()
+                providers[provider.name] = {
+                    **provider.stats,
+                    "model": provider.config.model,
+                    "in_flight": provider.in_flight,
+                    "healthy": estimator.healthy(),
+                    "ewma_latency_ms": round(estimator.ewma_latency * 1000, 1) if estimator.ewma_latency else None,
+                    "p95_latency_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                    "error_rate": round(estimator.error_rate, 4),
+                }
+        return {"hedge": self.hedge, "providers": providers}
+
+
+def create_llm_router() -> LlmRouter:
+    names = [
+        name.strip()
+        for name in os.getenv("LLM_PROVIDERS", os.getenv("LLM_PROVIDER", "deepseek")).split(",")
+        if name.strip()
+    ]
+    return LlmRouter(
+        [ProviderConfig.from_env(name, single=len(names) == 1) for name in names],
+        hedge=_env_flag("LLM_HEDGE", False),
+        hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "1")),
+        hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+        explore_ratio=float(os.getenv("LLM_EXPLORE_RATIO", "0")),
+        acquire_timeout=float(os.getenv("LLM_ACQUIRE_TIMEOUT", "30")),
+        window=int(os.getenv("LLM_LATENCY_WINDOW", "100")),
+        alpha=float(os.getenv("LLM_EWMA_ALPHA", "0.2")),
+        failure_threshold=int(os.getenv("LLM_FAILURE_THRESHOLD", "3")),
+        cooldown_seconds=float(os.getenv("LLM_COOLDOWN_SECONDS", "30")),
+    )
+
+
+llm_router = create_llm_router()
@@ -1,23 +1,83 @@
 # backend/main.py
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Request, WebSocket
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from supabase import create_client
 from dotenv import load_dotenv
 import os
-from .xf_asr import transcribe_audio_bytes
-from .llm import generate_structured_travel_plan
-from typing import Optional, List, Dict
-from decimal import Decimal, InvalidOperation
+from .xf_asr import XfStreamingSession
+from .asr_pool import AsrSaturatedError, AsrTimeoutError, asr_pool
+from .llm import (
+    DEEPSEEK_MODEL,
+    PLAN_PROMPT_VERSION,
+    aclose_llm_clients,
+    agenerate_structured_travel_plan,
+    generate_structured_travel_plan,
+    llm_usage,
+    regenerate_plan_day,
+    regenerate_plan_item,
+    stream_structured_travel_plan,
+)
+from .llm_router import LlmUnavailableError, ProviderBusyError, llm_router
+from .singleflight import SingleFlight, singleflight_stats
+from .geocode import enrich_plan_with_coordinates
+from .geocode_cache import geocode_cache
+from .plan_cache import make_plan_cache_key, plan_cache
+from .budget_aggregates import budget_aggregates
+from .budget_owner_cache import budget_owner_cache
+from .expense_parser import detect_category, parse_expense_text
+from .fx import fx_rates
+from .plan_jobs import (
+    PLAN_JOB_LEASE_SECONDS,
+    PLAN_JOB_MAX_PENDING,
+    PLAN_JOB_RETENTION_SECONDS,
+    PLAN_JOB_WORKERS,
+    JobQueueFullError,
+    PlanJobManager,
+    create_job_store,
+)
+from .persistence import (
+    PERSIST_BATCH_SIZE,
+    PERSIST_FLUSH_INTERVAL_SECONDS,
+    PERSIST_MAX_ATTEMPTS,
+    PERSIST_RETRY_BASE_SECONDS,
+    PERSIST_RETRY_MAX_SECONDS,
+    WriteBehindQueue,
+    create_spool_store,
+)
+from typing import AsyncIterator, Callable, Optional, List, Dict, Iterator, Tuple
+from datetime import datetime, timezone
+from decimal import Decimal
+import asyncio
+import base64
+import codecs
+import csv
+import hashlib
 import re
 import json
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 
 # 加载环境变量，明确从 backend/.env 读取
 from pathlib import Path
 load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动与关闭钩子定义在各自依赖的组件之后，这里只负责按顺序调用
+    warm_up_geocode_cache()
+    refresh_fx_rates()
+    resume_plan_jobs()
+    start_persist_queue()
+    yield
+    await close_shared_clients()
+
+
 # 初始化 FastAPI
-app = FastAPI(title="AI Travel Planner Backend")
+app = FastAPI(title="AI Travel Planner Backend", lifespan=lifespan)
 
 
 from fastapi.middleware.cors import CORSMiddleware
@@ -37,7 +97,23 @@ if not supabase_url or not supabase_key:
     raise ValueError("Supabase URL or Anon Key is missing. Check your environment variables.")
 
 supabase = create_client(supabase_url, supabase_key)
-amap_web_key = os.getenv("AMAP_WEB_KEY") or os.getenv("AMAP_REST_KEY")
+
+# async 路由中的同步阻塞调用（Supabase、地理编码、SQLite 缓存）统一交给这个有界线程池，
+# 保证事件循环不被阻塞，同时限制同一 worker 上并发的阻塞 IO 数量
+_blocking_io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BLOCKING_IO_WORKERS", "16")),
+    thread_name_prefix="blocking-io",
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_io_executor, partial(func, *args, **kwargs))
+
+
+# 进行中的相同请求合并为一次上游调用：行程按缓存键，语音识别按音频内容哈希
+plan_flight = SingleFlight("plan_generation")
+asr_flight = SingleFlight("asr")
 
 # 数据模型
 class UserLogin(BaseModel):
@@ -48,6 +124,60 @@ class UserLogin(BaseModel):
 def root():
     return {"message": "AI Travel Planner Backend is running!"}
 
+
+def warm_up_geocode_cache():
+    geocode_cache.purge_expired()
+    warmup_file = os.getenv("GEOCODE_CACHE_WARMUP_FILE")
+    if warmup_file and Path(warmup_file).exists():
+        try:
+            print(f"Imported {geocode_cache.import_file(warmup_file)} geocode entries from {warmup_file}")
+        except Exception as exc:
+            print(f"⚠️ Geocode cache import failed: {exc}")
+    geocode_cache.warm_up()
+
+
+def refresh_fx_rates():
+    # 未配置 FX_RATES_URL 时只使用本地汇率文件；刷新在后台进行，不阻塞启动
+    if fx_rates.is_stale():
+        fx_rates.refresh_in_background()
+
+
+def resume_plan_jobs():
+    # 文本任务可以从头重跑；语音任务只有在识别完成（已记录 transcript）后才能恢复
+    resumed = plan_jobs.resume_unfinished(lambda job_input: bool(job_input.get("user_input")))
+    if resumed:
+        print(f"Resumed {resumed} unfinished plan jobs")
+
+
+def start_persist_queue():
+    # 上次运行未写入 Supabase 的行会在启动后继续写入
+    persist_queue.start()
+
+
+async def close_shared_clients():
+    await aclose_llm_clients()
+    asr_pool.shutdown()
+    plan_jobs.shutdown()
+    await run_blocking(persist_queue.shutdown)
+    _blocking_io_executor.shutdown(wait=False)
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "plan_cache": plan_cache.stats(),
+        "geocode_cache": geocode_cache.stats(),
+        "asr_pool": asr_pool.stats(),
+        "plan_jobs": plan_jobs.stats(),
+        "budget_aggregates": budget_aggregates.stats(),
+        "budget_owner_cache": budget_owner_cache.stats(),
+        "fx_rates": fx_rates.stats(),
+        "llm": llm_usage.stats(),
+        "llm_router": llm_router.stats(),
+        "singleflight": singleflight_stats(),
+        "persist_queue": persist_queue.stats(),
+    }
+
 @app.post("/signup")
 def signup(user: UserLogin):# 自动验证 user 数据
     try:
@@ -78,6 +208,51 @@ def signin(user: UserLogin):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Signin failed: {str(e)}")
 
+def _insert_voice_text(user_id: str, text: str) -> None:
+    # 写入本地队列后立即返回，由后台线程批量写入 voice_texts
+    persist_queue.enqueue("voice_texts", {
+        "user_id": user_id,
+        "text": text,
+    })
+
+
+def _asr_busy_error() -> HTTPException:
+    return HTTPException(status_code=503, detail="语音识别繁忙，请稍后重试", headers={"Retry-After": "5"})
+
+
+def _audio_key(audio_bytes: bytes) -> str:
+    return hashlib.sha256(audio_bytes).hexdigest()
+
+
+def _transcribe_shared(audio_bytes: bytes) -> str:
+    """相同音频同时识别时只占用一个 ASR 名额，其余请求共享结果或异常。"""
+    return asr_flight.do(_audio_key(audio_bytes), asr_pool.transcribe, audio_bytes)
+
+
+async def _atranscribe_shared(audio_bytes: bytes) -> str:
+    return await asr_flight.ado(_audio_key(audio_bytes), asr_pool.transcribe_async, audio_bytes)
+
+
+def transcribe_with_pool(audio_bytes: bytes) -> str:
+    """通过有界 ASR 池识别；池已满时快速返回 503，超时返回 504。"""
+    try:
+        return _transcribe_shared(audio_bytes)
+    except AsrSaturatedError:
+        raise _asr_busy_error()
+    except AsrTimeoutError as e:
+        raise HTTPException(status_code=504, detail=f"ASR timeout: {str(e)}")
+
+
+async def transcribe_with_pool_async(audio_bytes: bytes) -> str:
+    """transcribe_with_pool 的异步版本：等待 ASR 结果时不占用事件循环。"""
+    try:
+        return await _atranscribe_shared(audio_bytes)
+    except AsrSaturatedError:
+        raise _asr_busy_error()
+    except AsrTimeoutError as e:
+        raise HTTPException(status_code=504, detail=f"ASR timeout: {str(e)}")
+
+
 @app.post("/asr")
 async def asr(audio: UploadFile = File(...), user_id: str | None = Form(default=None)):
     try:
@@ -88,80 +263,373 @@ async def asr(audio: UploadFile = File(...), user_id: str | None = Form(default=
         print("Size (bytes):", audio.size)
 
         audio_bytes = await audio.read()
-        text = transcribe_audio_bytes(audio_bytes)
+        text = await transcribe_with_pool_async(audio_bytes)
         if not text:
             raise HTTPException(status_code=500, detail="ASR returned empty result")
 
         # 可选：写入 Supabase，如果携带了 user_id
         if user_id:
             try:
-                supabase.table("voice_texts").insert({
-                    "user_id": user_id,
-                    "text": text,
-                }).execute()
+                await run_blocking(_insert_voice_text, user_id, text)
             except Exception:
                 # 不阻断返回
                 pass
 
         return {"text": text}
+    except HTTPException:
+        raise
     except Exception as e:
         print("❌ ASR Error:", str(e))
         raise HTTPException(status_code=500, detail=f"ASR error: {str(e)}")
 
 
-@app.get("/history")
-def history(user_id: str):
+@app.websocket("/ws/asr")
+async def asr_live(websocket: WebSocket, user_id: str | None = None):
+    """边录边识别：客户端发送 16kHz 单声道 16-bit PCM 二进制帧，发送 {"type": "end"} 结束。
+
+    服务端推送 {"type": "partial", "text"}（wpgs 动态修正后的全文）与最终的 {"type": "final", "text"}。
+    实时会话与其他识别共用 ASR 连接名额，繁忙时推送 {"type": "error", "status": 503, "retry_after"} 后以 1013 关闭。
+    """
+    await websocket.accept()
     try:
-        # 查询 travel_plans 表（包含 transcript 和 plan_text）
+        with asr_pool.live_session():
+            await _asr_live_session(websocket, user_id)
+    except AsrSaturatedError:
+        busy = _asr_busy_error()
+        await websocket.send_json({
+            "type": "error",
+            "detail": busy.detail,
+            "status": busy.status_code,
+            "retry_after": int(busy.headers["Retry-After"]),
+        })
+        await websocket.close(code=1013)
+
+
+async def _asr_live_session(websocket: WebSocket, user_id: Optional[str]) -> None:
+    loop = asyncio.get_running_loop()
+    outbox: asyncio.Queue = asyncio.Queue()
+
+    def on_partial(text: str):
+        loop.call_soon_threadsafe(outbox.put_nowait, {"type": "partial", "text": text})
+
+    async def forward():
+        while True:
+            message = await outbox.get()
+            if message is None:
+                return
+            await websocket.send_json(message)
+
+    session = XfStreamingSession(on_partial=on_partial)
+    try:
+        await run_blocking(session.start)
+    except Exception as e:
+        print("❌ ASR live connect error:", str(e))
+        await websocket.send_json({"type": "error", "detail": f"ASR connect failed: {str(e)}"})
+        await websocket.close()
+        return
+
+    forward_task = asyncio.create_task(forward())
+    client_gone = False
+    try:
+        # 讯飞可能先于客户端结束会话（返回最终结果、出错或断开），此后不再读取音频，直接进入收尾
+        while not session.finished:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                client_gone = True
+                break
+            if message.get("bytes"):
+                if session.finished:
+                    break
+                try:
+                    await run_blocking(session.send_audio, message["bytes"])
+                except Exception as e:
+                    # 会话已结束或连接已断开；结果或错误由下面的 finish 给出
+                    print("⚠️ ASR live send failed:", str(e))
+                    break
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except json.JSONDecodeError:
+                    control = {}
+                if control.get("type") == "end":
+                    break
+        if client_gone:
+            return
         try:
-            data = supabase.table("travel_plans").select("id, transcript, plan_text, plan_structured, created_at").eq("user_id", user_id).order("created_at", desc=True).execute()
-            if getattr(data, "error", None):
-                # 兼容旧 schema（缺少 plan_structured 字段）
-                print("⚠️ Supabase history select error, retrying without plan_structured:", data.error)
-                data = supabase.table("travel_plans").select("id, transcript, plan_text, created_at").eq("user_id", user_id).order("created_at", desc=True).execute()
-            rows = data.data or []
-            # 将字段名转换为前端期望的格式
-            items = []
-            for row in rows:
-                structured = None
-                raw_structured = row.get("plan_structured")
-                if isinstance(raw_structured, dict):
-                    structured = raw_structured
-                elif isinstance(raw_structured, str):
-                    try:
-                        structured = json.loads(raw_structured)
-                    except json.JSONDecodeError:
-                        structured = None
-                items.append({
-                    "id": row.get("id"),
-                    "text": row.get("transcript", ""),  # 显示ASR结果
-                    "plan": row.get("plan_text", ""),  # 行程内容
-                    "plan_structured": structured,
-                    "created_at": row.get("created_at")
-                })
-            return {"items": items}
-        except Exception:
-            # 如果 travel_plans 表不存在，回退到 voice_texts 表
-            data = supabase.table("voice_texts").select("id, text, created_at").eq("user_id", user_id).order("created_at", desc=True).execute()
-            rows = data.data or []
-            # 为兼容性，添加空的 plan 字段
-            items = []
-            for row in rows:
-                items.append({
+            text = await run_blocking(session.finish)
+        except Exception as e:
+            print("❌ ASR live error:", str(e))
+            outbox.put_nowait({"type": "error", "detail": f"ASR error: {str(e)}"})
+            return
+        outbox.put_nowait({"type": "final", "text": text})
+        if user_id and text:
+            try:
+                await run_blocking(_insert_voice_text, user_id, text)
+            except Exception:
+                # 不阻断返回
+                pass
+    except Exception as e:
+        # 兜底：客户端在连接关闭前总能收到 final 或 error
+        print("❌ ASR live error:", str(e))
+        outbox.put_nowait({"type": "error", "detail": f"ASR error: {str(e)}"})
+    finally:
+        session.close()
+        outbox.put_nowait(None)
+        if client_gone:
+            forward_task.cancel()
+        else:
+            try:
+                await forward_task
+                await websocket.close()
+            except Exception:
+                pass
+
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+HISTORY_SNIPPET_CHARS = 80
+
+# travel_plans 表结构只探测一次并记住结果：
+# - "json"：plan_structured 为 json/jsonb 列，列表可直接投影 overview，写入时直接存对象
+# - "text"：plan_structured 为文本列，存 JSON 字符串，列表需取整列后解析
+# - "plain"：旧 schema，没有 plan_structured 列
+# - "voice_texts"：没有 travel_plans 表，历史回退到 voice_texts
+_plan_schema_mode: Optional[str] = None
+_plan_schema_lock = threading.Lock()
+
+# 表/列不存在、运算符不适用（对 text 列使用 ->）等 PostgREST/Postgres 错误码
+_SCHEMA_ERROR_CODES = {"42703", "42P01", "42883", "PGRST200", "PGRST204", "PGRST205"}
+
+
+def _is_schema_error(exc: Exception) -> bool:
+    return getattr(exc, "code", None) in _SCHEMA_ERROR_CODES
+
+
+def _probe(table: str, columns: str) -> bool:
+    try:
+        response = supabase.table(table).select(columns).limit(1).execute()
+    except Exception as exc:
+        if _is_schema_error(exc):
+            return False
+        # 网络等暂时性错误不能作为 schema 结论，交给调用方处理
+        raise
+    return not getattr(response, "error", None)
+
+
+def _get_plan_schema_mode() -> str:
+    global _plan_schema_mode
+    if _plan_schema_mode is not None:
+        return _plan_schema_mode
+    with _plan_schema_lock:
+        if _plan_schema_mode is None:
+            if _probe("travel_plans", "id, overview:plan_structured->overview"):
+                mode = "json"
+            elif _probe("travel_plans", "id, plan_structured"):
+                mode = "text"
+            elif _probe("travel_plans", "id"):
+                mode = "plain"
+            else:
+                mode = "voice_texts"
+            print(f"Detected travel_plans schema mode: {mode}")
+            _plan_schema_mode = mode
+        return _plan_schema_mode
+
+
+def _reset_plan_schema_mode() -> None:
+    global _plan_schema_mode
+    with _plan_schema_lock:
+        _plan_schema_mode = None
+
+
+def _load_structured(raw) -> Optional[dict]:
+    if isinstance(raw, dict):
+        return raw
+    if isinstance(raw, str):
+        try:
+            loaded = json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+        return loaded if isinstance(loaded, dict) else None
+    return None
+
+
+def _encode_history_cursor(row: dict) -> str:
+    raw = json.dumps([row.get("created_at"), row.get("id")], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_history_cursor(cursor: str) -> Tuple[str, object]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(created_at, str) or row_id is None:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, row_id
+
+
+def _postgrest_value(value) -> str:
+    # 时间戳含 ":"、"+" 等保留字符，需加双引号
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _keyset_page(query, limit: int, cursor: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+    """按 (created_at, id) 倒序的键集分页，多取一条用于判断是否还有下一页。"""
+    if cursor:
+        created_at, row_id = _decode_history_cursor(cursor)
+        ts, rid = _postgrest_value(created_at), _postgrest_value(row_id)
+        query = query.or_(f"created_at.lt.{ts},and(created_at.eq.{ts},id.lt.{rid})")
+    response = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+    rows = response.data or []
+    next_cursor = _encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def _history_page(table: str, columns: str, user_id: str, limit: int, cursor: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+    return _keyset_page(supabase.table(table).select(columns).eq("user_id", user_id), limit, cursor)
+
+
+def _snippet(text: Optional[str]) -> str:
+    text = re.sub(r"\s+", " ", text or "").strip()
+    return text if len(text) <= HISTORY_SNIPPET_CHARS else text[:HISTORY_SNIPPET_CHARS] + "…"
+
+
+def _history_time(value) -> datetime:
+    # 队列里的 created_at 与 Supabase 返回的时间戳格式不完全一致，比较前统一解析
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _merge_pending(items: List[dict], pending: List[dict]) -> List[dict]:
+    """把尚在写入队列中的行合并进第一页；已写入上游的同一行（需求与时间相同）只保留上游的版本。"""
+    written = {(item["text"], _history_time(item["created_at"])) for item in items}
+    pending = [item for item in pending if (item["text"], _history_time(item["created_at"])) not in written]
+    if not pending:
+        return items
+    return sorted(pending + items, key=lambda item: _history_time(item["created_at"]), reverse=True)
+
+
+def _structured_overview(plan_structured) -> Optional[dict]:
+    return plan_structured.get("overview") if isinstance(plan_structured, dict) else None
+
+
+def _pending_history_item(entry, text: Optional[str], overview: Optional[dict]) -> dict:
+    overview = overview if isinstance(overview, dict) else {}
+    return {
+        "id": f"pending-{entry.id}",
+        "text": _snippet(text),
+        "destination": overview.get("destination"),
+        "days": overview.get("days"),
+        "has_plan": False,  # 写入上游后才有 id，才能通过 /travel_plans/{id} 查看
+        "pending": True,
+        "created_at": entry.row.get("created_at"),
+    }
+
+
+@app.get("/history")
+def history(user_id: str, limit: int = HISTORY_PAGE_SIZE, cursor: Optional[str] = None):
+    """行程历史摘要（目的地、天数、时间、需求摘要），完整行程通过 GET /travel_plans/{id} 获取。
+
+    第一页合并写入队列中尚未写入上游的行（pending: true），刚生成的行程无需等待后台写入即可出现。
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    try:
+        mode = _get_plan_schema_mode()
+        kind = "voice_texts" if mode == "voice_texts" else "travel_plans"
+        # 先查队列再查上游：两次查询之间写入完成的行至少出现在其中一处，重复的由 _merge_pending 去掉
+        pending = persist_queue.pending_rows(kind, user_id, limit) if not cursor else []
+        if mode == "voice_texts":
+            rows, next_cursor = _history_page("voice_texts", "id, text, created_at", user_id, limit, cursor)
+            items = [
+                {
                     "id": row.get("id"),
-                    "text": row.get("text", ""),
-                    "plan": "",  # 没有行程数据
-                    "plan_structured": None,
-                    "created_at": row.get("created_at")
-                })
-            return {"items": items}
+                    "text": _snippet(row.get("text")),
+                    "destination": None,
+                    "days": None,
+                    "has_plan": False,  # 没有行程数据
+                    "created_at": row.get("created_at"),
+                }
+                for row in rows
+            ]
+            pending_items = [_pending_history_item(entry, entry.row.get("text"), None) for entry in pending]
+            return {"items": _merge_pending(items, pending_items), "next_cursor": next_cursor}
+
+        columns = {
+            "json": "id, transcript, created_at, overview:plan_structured->overview",
+            "text": "id, transcript, created_at, plan_structured",
+            "plain": "id, transcript, created_at",
+        }[mode]
+        rows, next_cursor = _history_page("travel_plans", columns, user_id, limit, cursor)
+        items = []
+        for row in rows:
+            if mode == "text":
+                overview = (_load_structured(row.get("plan_structured")) or {}).get("overview")
+            else:
+                overview = row.get("overview")
+            # 早期记录把 JSON 字符串写进了 json 列，投影结果为空，此时只返回需求摘要
+            overview = overview if isinstance(overview, dict) else {}
+            items.append({
+                "id": row.get("id"),
+                "text": _snippet(row.get("transcript")),
+                "destination": overview.get("destination"),
+                "days": overview.get("days"),
+                "has_plan": True,
+                "created_at": row.get("created_at"),
+            })
+        pending_items = [
+            _pending_history_item(
+                entry, entry.row.get("transcript"), _structured_overview(entry.row.get("plan_structured"))
+            )
+            for entry in pending
+        ]
+        return {"items": _merge_pending(items, pending_items), "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Fetch history failed: {str(e)}")
 
 
+@app.get("/travel_plans/{plan_id}")
+def get_travel_plan(plan_id: int, user_id: str):
+    try:
+        mode = _get_plan_schema_mode()
+        if mode == "voice_texts":
+            raise HTTPException(status_code=404, detail="Travel plan not found")
+        columns = "id, transcript, plan_text, created_at"
+        if mode != "plain":
+            columns += ", plan_structured"
+        response = (
+            supabase.table("travel_plans")
+            .select(columns)
+            .eq("id", plan_id)
+            .eq("user_id", user_id)
+            .limit(1)
+            .execute()
+        )
+        rows = response.data or []
+        if not rows:
+            raise HTTPException(status_code=404, detail="Travel plan not found")
+        row = rows[0]
+        return {
+            "id": row.get("id"),
+            "text": row.get("transcript", ""),
+            "plan": row.get("plan_text", ""),
+            "plan_structured": _load_structured(row.get("plan_structured")),
+            "created_at": row.get("created_at"),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Fetch travel plan failed: {str(e)}")
+
 
 class TravelRequest(BaseModel):
     user_input: str  # e.g., "我想去日本东京玩5天，预算1万元，带孩子，喜欢美食和动漫"
+    no_cache: bool = False  # 跳过行程缓存，强制重新生成
 
 
 class BudgetCreate(BaseModel):
@@ -191,7 +659,7 @@ class ExpenseCreate(BaseModel):
 @app.post("/plan")
 def create_travel_plan(request: TravelRequest):
     try:
-        plan_text = generate_travel_plan(request.user_input)
+        plan_text = generate_travel_plan(request.user_input, use_cache=not request.no_cache)
         return {"plan": plan_text}
     except Exception as e:
         raise HTTPException(400, detail=f"LLM failed: {str(e)}")
@@ -207,6 +675,7 @@ def create_budget(payload: BudgetCreate):
         created = (response.data or [None])[0]
         if not created:
             raise HTTPException(status_code=500, detail="Failed to create budget")
+        budget_owner_cache.set(created["id"], payload.user_id, created)
         return created
     except HTTPException:
         raise
@@ -245,8 +714,10 @@ def update_budget(budget_id: str, payload: BudgetUpdate, user_id: str):
             .execute()
         )
         updated = (response.data or [None])[0]
+        budget_owner_cache.invalidate(budget_id)
         if not updated:
             raise HTTPException(status_code=404, detail="Budget not found")
+        budget_owner_cache.set(budget_id, user_id, updated)
         return updated
     except HTTPException:
         raise
@@ -264,8 +735,11 @@ def delete_budget(budget_id: str, user_id: str):
             .eq("user_id", user_id)
             .execute()
         )
+        budget_owner_cache.invalidate(budget_id)
         if not response.data:
             raise HTTPException(status_code=404, detail="Budget not found")
+        # 删除已经提交，本机汇总清理失败只记录警告
+        _invalidate_aggregates([{"budget_id": budget_id}])
         return {"message": "Budget deleted"}
     except HTTPException:
         raise
@@ -273,6 +747,36 @@ def delete_budget(budget_id: str, user_id: str):
         raise HTTPException(status_code=500, detail=f"Delete budget failed: {str(e)}")
 
 
+def _apply_expense_inserts(rows: List[dict]) -> None:
+    """把已写入 Supabase 的支出计入本机汇总。
+
+    汇总只是缓存：维护失败时作废相关预算的汇总（下次读取从原始行重建），
+    不能因此让已经成功的写入返回 500，否则客户端重试会重复记账。
+    """
+    try:
+        budget_aggregates.apply_inserts(rows)
+    except Exception as exc:
+        print(f"⚠️ Budget aggregate update failed, invalidating: {exc}")
+        _invalidate_aggregates(rows)
+
+
+def _apply_expense_deletes(rows: List[dict]) -> None:
+    try:
+        for row in rows:
+            budget_aggregates.apply_delete(row)
+    except Exception as exc:
+        print(f"⚠️ Budget aggregate update failed, invalidating: {exc}")
+        _invalidate_aggregates(rows)
+
+
+def _invalidate_aggregates(rows: List[dict]) -> None:
+    for budget_id in {str(row.get("budget_id")) for row in rows}:
+        try:
+            budget_aggregates.invalidate(budget_id)
+        except Exception as exc:
+            print(f"⚠️ Budget aggregate invalidation failed for {budget_id}: {exc}")
+
+
 @app.post("/expenses")
 def create_expense(payload: ExpenseCreate):
     try:
@@ -285,6 +789,7 @@ def create_expense(payload: ExpenseCreate):
         created = (response.data or [None])[0]
         if not created:
             raise HTTPException(status_code=500, detail="Failed to create expense")
+        _apply_expense_inserts([created])
         return created
     except HTTPException:
         raise
@@ -292,36 +797,102 @@ def create_expense(payload: ExpenseCreate):
         raise HTTPException(status_code=500, detail=f"Create expense failed: {str(e)}")
 
 
+EXPENSE_PAGE_SIZE = 50
+EXPENSE_MAX_PAGE_SIZE = 200
+# PostgREST 单次返回行数上限（默认 max-rows=1000），重建汇总时按此分页读取
+_EXPENSE_FETCH_CHUNK = 1000
+
+
+def _fetch_expense_rows(budget_id: str, user_id: str) -> List[dict]:
+    rows: List[dict] = []
+    start = 0
+    while True:
+        response = (
+            supabase.table("expenses")
+            .select("id, budget_id, category, currency, amount")
+            .eq("budget_id", budget_id)
+            .eq("user_id", user_id)
+            .order("id")
+            .range(start, start + _EXPENSE_FETCH_CHUNK - 1)
+            .execute()
+        )
+        chunk = response.data or []
+        rows.extend(chunk)
+        if len(chunk) < _EXPENSE_FETCH_CHUNK:
+            return rows
+        start += _EXPENSE_FETCH_CHUNK
+
+
+def _budget_summary(budget: dict, user_id: str, verify: bool = False) -> dict:
+    """读取增量维护的预算汇总，缺失或过期时从原始支出行重建。"""
+    budget_id = budget.get("id")
+    summary = None if verify else budget_aggregates.get(budget_id)
+    consistent = None
+    if summary is None:
+        rows = _fetch_expense_rows(budget_id, user_id)
+        if verify:
+            summary, consistent = budget_aggregates.verify(budget_id, rows)
+        else:
+            summary = budget_aggregates.rebuild(budget_id, rows)
+    # 汇总按 (category, currency) 保存原币金额，这里统一折算为预算币种
+    currency = budget.get("currency") or "CNY"
+    converted = fx_rates.convert_breakdown(summary["breakdown"], currency)
+    total_spent = converted["total"]
+    remaining = None
+    budget_amount = _decimal_to_float(budget.get("total_budget"))
+    if budget_amount is not None:
+        remaining = round(budget_amount - total_spent, 2)
+    result = {
+        "budget": budget,
+        "total_spent": total_spent,
+        "remaining": remaining,
+        "currency": currency,
+        "count": summary["count"],
+        "by_category": converted["by_category"],
+        "by_category_currency": converted["by_category_currency"],
+        "by_currency": summary["by_currency"],
+        "unconverted": converted["unconverted"],
+        "fx_date": fx_rates.date,
+    }
+    if verify:
+        result["consistent"] = consistent
+    return result
+
+
+@app.get("/budgets/{budget_id}/summary")
+def budget_summary(budget_id: str, user_id: str, verify: bool = False):
+    """预算汇总（不含支出明细）；verify=true 时与原始支出比对并修复汇总。"""
+    try:
+        budget = _ensure_budget_owner(budget_id, user_id)
+        return _budget_summary(budget, user_id, verify=verify)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Fetch budget summary failed: {str(e)}")
+
+
 @app.get("/expenses")
-def list_expenses(user_id: str, budget_id: str):
+def list_expenses(user_id: str, budget_id: str, limit: int = EXPENSE_PAGE_SIZE, cursor: Optional[str] = None):
+    limit = max(1, min(limit, EXPENSE_MAX_PAGE_SIZE))
     try:
         budget = _ensure_budget_owner(budget_id, user_id)
-        response = (
+        query = (
             supabase.table("expenses")
             .select("*")
             .eq("budget_id", budget_id)
             .eq("user_id", user_id)
-            .order("created_at", desc=True)
-            .execute()
         )
-        items = response.data or []
-        total_spent = sum(_decimal_to_float(item.get("amount")) or 0 for item in items)
-        category_totals: Dict[str, float] = {}
+        items, next_cursor = _keyset_page(query, limit, cursor)
+        currency = budget.get("currency") or "CNY"
         for item in items:
-            category = item.get("category") or "other"
-            amount = _decimal_to_float(item.get("amount")) or 0
-            category_totals[category] = category_totals.get(category, 0) + amount
-        remaining = None
-        budget_amount = _decimal_to_float(budget.get("total_budget"))
-        if budget_amount is not None:
-            remaining = budget_amount - total_spent
+            converted = None
+            if item.get("amount") is not None:
+                converted = fx_rates.convert(item["amount"], item.get("currency") or currency, currency)
+            item["amount_in_budget_currency"] = float(converted) if converted is not None else None
         return {
-            "budget": budget,
+            **_budget_summary(budget, user_id),
             "items": items,
-            "total_spent": total_spent,
-            "remaining": remaining,
-            "currency": budget.get("currency", "CNY"),
-            "by_category": category_totals,
+            "next_cursor": next_cursor,
         }
     except HTTPException:
         raise
@@ -329,6 +900,259 @@ def list_expenses(user_id: str, budget_id: str):
         raise HTTPException(status_code=500, detail=f"Fetch expenses failed: {str(e)}")
 
 
+@app.delete("/expenses/{expense_id}")
+def delete_expense(expense_id: str, user_id: str):
+    try:
+        response = (
+            supabase.table("expenses")
+            .delete()
+            .eq("id", expense_id)
+            .eq("user_id", user_id)
+            .execute()
+        )
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        _apply_expense_deletes(response.data)
+        return {"message": "Expense deleted"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Delete expense failed: {str(e)}")
+
+
+# ========== 批量导入开销：JSON 数组、CSV 或 NDJSON（后两者边接收边处理） ==========
+
+EXPENSE_BATCH_CHUNK_SIZE = int(os.getenv("EXPENSE_BATCH_CHUNK_SIZE", "500"))
+EXPENSE_BATCH_CONCURRENCY = int(os.getenv("EXPENSE_BATCH_CONCURRENCY", "4"))
+EXPENSE_BATCH_MAX_ROWS = int(os.getenv("EXPENSE_BATCH_MAX_ROWS", "20000"))
+
+
+def _insert_expense_chunk(rows: List[dict]) -> List[Tuple[Optional[dict], Optional[str]]]:
+    """一次多行插入；整批失败时逐行重试，只让出错的行失败。返回与 rows 对应的 (created, error)。"""
+    try:
+        response = supabase.table("expenses").insert(rows).execute()
+    except Exception as exc:
+        if len(rows) == 1:
+            return [(None, str(exc))]
+        results = []
+        for row in rows:
+            results.extend(_insert_expense_chunk([row]))
+        return results
+    created = response.data or []
+    return [(created[idx] if idx < len(created) else None, None) for idx in range(len(rows))]
+
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err.get('loc', ()))}: {err.get('msg')}" for err in exc.errors()
+    )
+
+
+class _ExpenseBatch:
+    """按块校验、校验归属并插入；最多 EXPENSE_BATCH_CONCURRENCY 个插入请求并行。"""
+
+    def __init__(self, default_user_id: Optional[str]):
+        self.default_user_id = default_user_id
+        self.results: Dict[int, dict] = {}
+        self.rows_seen = 0
+        self._chunk: List[Tuple[int, dict]] = []
+        self._owners: Dict[Tuple[str, str], Optional[str]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._slots = asyncio.Semaphore(EXPENSE_BATCH_CONCURRENCY)
+
+    @property
+    def full(self) -> bool:
+        return self.rows_seen >= EXPENSE_BATCH_MAX_ROWS
+
+    async def add(self, raw, error: Optional[str] = None) -> None:
+        index = self.rows_seen
+        self.rows_seen += 1
+        if error is None and not isinstance(raw, dict):
+            error = "row must be an object"
+        if error is None:
+            row = {key: value for key, value in raw.items() if value not in ("", None)}
+            row.setdefault("user_id", self.default_user_id)
+            if not row.get("category"):
+                row["category"] = detect_category(row.get("description") or "")[0]
+            try:
+                expense = ExpenseCreate.model_validate(row)
+            except ValidationError as exc:
+                error = _validation_message(exc)
+        if error is not None:
+            self.results[index] = {"row": index, "status": "error", "error": error}
+            return
+        data = expense.model_dump()
+        data["amount"] = float(data["amount"])
+        self._chunk.append((index, data))
+        if len(self._chunk) >= EXPENSE_BATCH_CHUNK_SIZE:
+            await self._flush()
+
+    async def finish(self) -> List[dict]:
+        await self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        return [self.results[index] for index in sorted(self.results)]
+
+    async def _flush(self) -> None:
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return
+        # 每个 (budget_id, user_id) 只校验一次归属
+        for _, data in chunk:
+            key = (data["budget_id"], data["user_id"])
+            if key not in self._owners:
+                try:
+                    await run_blocking(_ensure_budget_owner, *key)
+                    self._owners[key] = None
+                except HTTPException as exc:
+                    self._owners[key] = str(exc.detail)
+        insertable = []
+        for index, data in chunk:
+            owner_error = self._owners[(data["budget_id"], data["user_id"])]
+            if owner_error:
+                self.results[index] = {"row": index, "status": "error", "error": owner_error}
+            else:
+                insertable.append((index, data))
+        if insertable:
+            await self._slots.acquire()
+            self._tasks.append(asyncio.create_task(self._insert(insertable)))
+
+    async def _insert(self, chunk: List[Tuple[int, dict]]) -> None:
+        try:
+            outcomes = await run_blocking(_insert_expense_chunk, [data for _, data in chunk])
+            created_rows = []
+            for (index, _), (created, error) in zip(chunk, outcomes):
+                if error is not None:
+                    self.results[index] = {"row": index, "status": "error", "error": error}
+                else:
+                    self.results[index] = {"row": index, "status": "created", "id": (created or {}).get("id")}
+                    if created:
+                        created_rows.append(created)
+            if created_rows:
+                await run_blocking(_apply_expense_inserts, created_rows)
+        finally:
+            self._slots.release()
+
+
+async def _iter_request_lines(request: Request) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        if "\n" not in buffer:
+            continue
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer.strip():
+        yield buffer.rstrip("\r")
+
+
+async def _iter_csv_rows(request: Request) -> AsyncIterator[dict]:
+    header: Optional[List[str]] = None
+    pending: List[str] = []
+    async for line in _iter_request_lines(request):
+        pending.append(line)
+        record = "\n".join(pending)
+        # 引号未闭合说明字段内含换行，继续拼接下一行
+        if record.count('"') % 2:
+            continue
+        pending = []
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        yield dict(zip(header, values))
+
+
+@app.post("/expenses/batch")
+async def create_expenses_batch(request: Request, user_id: str | None = None):
+    """批量新增开销，返回逐行结果。
+
+    - application/json：对象数组（或 {"items": [...]}）
+    - text/csv：首行为表头，列名同 ExpenseCreate 字段
+    - application/x-ndjson：每行一个 JSON 对象
+    行内缺少 user_id 时使用查询参数 user_id；缺少 category 时根据 description 推断。
+    """
+    content_type = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+    batch = _ExpenseBatch(user_id)
+    truncated = False
+    try:
+        if content_type in ("text/csv", "application/csv"):
+            async for row in _iter_csv_rows(request):
+                if batch.full:
+                    truncated = True
+                    break
+                await batch.add(row)
+        elif content_type in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+            async for line in _iter_request_lines(request):
+                if not line.strip():
+                    continue
+                if batch.full:
+                    truncated = True
+                    break
+                try:
+                    await batch.add(json.loads(line))
+                except json.JSONDecodeError as exc:
+                    await batch.add(None, error=f"invalid JSON: {exc}")
+        else:
+            try:
+                payload = json.loads(await request.body() or b"null")
+            except json.JSONDecodeError as exc:
+                raise HTTPException(status_code=400, detail=f"Invalid JSON body: {exc}")
+            if isinstance(payload, dict):
+                payload = payload.get("items")
+            if not isinstance(payload, list):
+                raise HTTPException(status_code=400, detail="Expected a JSON array of expenses")
+            if len(payload) > EXPENSE_BATCH_MAX_ROWS:
+                raise HTTPException(status_code=413, detail=f"At most {EXPENSE_BATCH_MAX_ROWS} rows per request")
+            for row in payload:
+                await batch.add(row)
+        results = await batch.finish()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch create expenses failed: {str(e)}")
+    created = sum(1 for result in results if result["status"] == "created")
+    return {
+        "created": created,
+        "failed": len(results) - created,
+        "truncated": truncated,  # 流式请求超过 EXPENSE_BATCH_MAX_ROWS 时，之后的行未处理
+        "results": results,
+    }
+
+
+VOICE_AMOUNT_NOT_RECOGNIZED = "无法从语音中识别金额，请手动输入"
+
+
+def _voice_expense_data(
+    budget_id: str,
+    user_id: str,
+    transcript: str,
+    currency_hint: Optional[str],
+    fallback_category: Optional[str],
+    parsed: Optional[dict] = None,
+) -> Optional[dict]:
+    """把语音识别文本解析成待插入的开销行，识别不到金额时返回 None。"""
+    parsed = parsed or _parse_expense_from_text(transcript)
+    amount = parsed.get("amount")
+    if amount is None:
+        return None
+    return {
+        "budget_id": budget_id,
+        "user_id": user_id,
+        "category": fallback_category or parsed.get("category") or "other",
+        "amount": float(amount),
+        "currency": currency_hint or parsed.get("currency") or "CNY",
+        "description": transcript,
+        "transcript": transcript,
+        "source": "voice",
+    }
+
+
 @app.post("/expenses/voice")
 async def create_expense_from_voice(
     budget_id: str = Form(...),
@@ -338,33 +1162,21 @@ async def create_expense_from_voice(
     fallback_category: Optional[str] = Form(default=None),
 ):
     try:
-        _ensure_budget_owner(budget_id, user_id)
+        await run_blocking(_ensure_budget_owner, budget_id, user_id)
         audio_bytes = await audio.read()
         if not audio_bytes:
             raise HTTPException(status_code=400, detail="Empty audio file")
-        transcript = transcribe_audio_bytes(audio_bytes)
+        transcript = await transcribe_with_pool_async(audio_bytes)
         if not transcript:
             raise HTTPException(status_code=500, detail="ASR returned empty result")
-        parsed = _parse_expense_from_text(transcript)
-        amount = parsed.get("amount")
-        if amount is None:
-            raise HTTPException(status_code=400, detail="无法从语音中识别金额，请手动输入")
-        currency = currency_hint or parsed.get("currency") or "CNY"
-        category = fallback_category or parsed.get("category") or "other"
-        data = {
-            "budget_id": budget_id,
-            "user_id": user_id,
-            "category": category,
-            "amount": float(amount),
-            "currency": currency,
-            "description": transcript,
-            "transcript": transcript,
-            "source": "voice",
-        }
-        response = supabase.table("expenses").insert(data).execute()
+        data = _voice_expense_data(budget_id, user_id, transcript, currency_hint, fallback_category)
+        if data is None:
+            raise HTTPException(status_code=400, detail=VOICE_AMOUNT_NOT_RECOGNIZED)
+        response = await run_blocking(supabase.table("expenses").insert(data).execute)
         created = (response.data or [None])[0]
         if not created:
             raise HTTPException(status_code=500, detail="Failed to create expense")
+        await run_blocking(_apply_expense_inserts, [created])
         created["transcript"] = transcript
         return created
     except HTTPException:
@@ -373,6 +1185,94 @@ async def create_expense_from_voice(
         raise HTTPException(status_code=500, detail=f"Create voice expense failed: {str(e)}")
 
 
+EXPENSE_VOICE_BATCH_MAX_FILES = int(os.getenv("EXPENSE_VOICE_BATCH_MAX_FILES", "20"))
+# 单个请求同时占用的 ASR 槽位，避免一次上传把共享的 ASR 队列塞满
+EXPENSE_VOICE_BATCH_CONCURRENCY = int(os.getenv("EXPENSE_VOICE_BATCH_CONCURRENCY", "4"))
+_VOICE_BATCH_BUSY_RETRIES = 3
+
+
+async def _transcribe_clip(audio_bytes: bytes, slots: asyncio.Semaphore) -> str:
+    async with slots:
+        for attempt in range(_VOICE_BATCH_BUSY_RETRIES + 1):
+            try:
+                return await _atranscribe_shared(audio_bytes)
+            except AsrSaturatedError:
+                if attempt == _VOICE_BATCH_BUSY_RETRIES:
+                    raise
+                await asyncio.sleep(1 + attempt)
+
+
+@app.post("/expenses/voice/batch")
+async def create_expenses_from_voice_batch(
+    budget_id: str = Form(...),
+    user_id: str = Form(...),
+    audios: List[UploadFile] = File(...),
+    currency_hint: Optional[str] = Form(default=None),
+    fallback_category: Optional[str] = Form(default=None),
+):
+    """多段语音记账：并发识别、逐段解析，可记账的片段一次批量插入，返回每段的状态。"""
+    if len(audios) > EXPENSE_VOICE_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {EXPENSE_VOICE_BATCH_MAX_FILES} audio files per request")
+    try:
+        await run_blocking(_ensure_budget_owner, budget_id, user_id)
+        clips = [await audio.read() for audio in audios]
+        slots = asyncio.Semaphore(EXPENSE_VOICE_BATCH_CONCURRENCY)
+        transcripts = await asyncio.gather(
+            *(_transcribe_clip(clip, slots) for clip in clips if clip),
+            return_exceptions=True,
+        )
+        transcript_iter = iter(transcripts)
+
+        results: List[dict] = []
+        pending: List[Tuple[dict, dict]] = []
+        for index, (audio, clip) in enumerate(zip(audios, clips)):
+            result = {"index": index, "filename": audio.filename, "status": "error"}
+            results.append(result)
+            if not clip:
+                result["error"] = "Empty audio file"
+                continue
+            transcript = next(transcript_iter)
+            if isinstance(transcript, AsrSaturatedError):
+                result["error"] = "语音识别繁忙，请稍后重试"
+                continue
+            if isinstance(transcript, Exception):
+                result["error"] = f"ASR error: {transcript}"
+                continue
+            result["transcript"] = transcript
+            if not transcript:
+                result["error"] = "ASR returned empty result"
+                continue
+            parsed = _parse_expense_from_text(transcript)
+            result["confidence"] = parsed["confidence"]
+            data = _voice_expense_data(budget_id, user_id, transcript, currency_hint, fallback_category, parsed)
+            if data is None:
+                result["status"] = "amount_not_recognized"
+                result["error"] = VOICE_AMOUNT_NOT_RECOGNIZED
+                continue
+            pending.append((result, data))
+
+        if pending:
+            outcomes = await run_blocking(_insert_expense_chunk, [data for _, data in pending])
+            created_rows = []
+            for (result, _), (created, error) in zip(pending, outcomes):
+                if error is not None:
+                    result["error"] = error
+                    continue
+                result["status"] = "created"
+                result["expense"] = created
+                if created:
+                    created_rows.append(created)
+            if created_rows:
+                await run_blocking(_apply_expense_inserts, created_rows)
+
+        created_count = sum(1 for result in results if result["status"] == "created")
+        return {"created": created_count, "failed": len(results) - created_count, "results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Create voice expenses failed: {str(e)}")
+
+
 @app.delete("/travel_plans/{plan_id}")
 def delete_travel_plan(plan_id: int, user_id: str):
     try:
@@ -392,6 +1292,142 @@ def delete_travel_plan(plan_id: int, user_id: str):
         raise HTTPException(status_code=500, detail=f"Delete travel plan failed: {str(e)}")
 
 
+class PlanRegenerateRequest(BaseModel):
+    user_id: str
+    instruction: str = Field(..., min_length=1)  # 例如 "第三天下午换成室内活动"
+    day_index: int = Field(..., ge=0)  # 从 0 开始
+    item_index: Optional[int] = Field(default=None, ge=0)  # 不传时重新生成整天
+    # 客户端看到的 plan_structured.revision；传入且与已保存的不一致时返回 409，避免覆盖别处的修改
+    revision: Optional[int] = Field(default=None, ge=0)
+
+
+def _carry_over_coordinates(old_items, new_items) -> None:
+    """模型原样保留的地点沿用旧坐标，只有新出现的地点需要地理编码。"""
+    known = {}
+    for item in old_items or []:
+        if isinstance(item, dict) and item.get("longitude") and item.get("latitude"):
+            known[(item.get("name"), item.get("address"))] = item
+    for item in new_items or []:
+        if not isinstance(item, dict):
+            continue
+        previous = known.get((item.get("name"), item.get("address")))
+        if previous is not None:
+            for key in ("longitude", "latitude", "coordinate_source"):
+                if key in previous:
+                    item[key] = previous[key]
+
+
+def _plan_revision(plan: dict) -> int:
+    revision = plan.get("revision")
+    return revision if isinstance(revision, int) and revision >= 0 else 0
+
+
+def _plan_conflict_error() -> HTTPException:
+    return HTTPException(status_code=409, detail="Travel plan was modified concurrently; reload it and retry")
+
+
+def _travel_plan_exists(plan_id: int, user_id: str) -> bool:
+    response = (
+        supabase.table("travel_plans")
+        .select("id")
+        .eq("id", plan_id)
+        .eq("user_id", user_id)
+        .limit(1)
+        .execute()
+    )
+    return bool(response.data)
+
+
+@app.post("/travel_plans/{plan_id}/regenerate")
+def regenerate_travel_plan(plan_id: int, payload: PlanRegenerateRequest):
+    """按修改要求重新生成已保存行程中的某一天或某个地点，只对新地点做地理编码，并原地更新该行程。"""
+    try:
+        mode = _get_plan_schema_mode()
+        if mode in ("voice_texts", "plain"):
+            raise HTTPException(status_code=409, detail="Structured plans are not stored; partial regeneration is unavailable")
+        response = (
+            supabase.table("travel_plans")
+            .select("id, plan_structured")
+            .eq("id", plan_id)
+            .eq("user_id", payload.user_id)
+            .limit(1)
+            .execute()
+        )
+        rows = response.data or []
+        if not rows:
+            raise HTTPException(status_code=404, detail="Travel plan not found")
+        stored = rows[0].get("plan_structured")
+        plan = _load_structured(stored)
+        if not isinstance(plan, dict):
+            raise HTTPException(status_code=409, detail="Travel plan has no structured data")
+        revision = _plan_revision(plan)
+        if payload.revision is not None and payload.revision != revision:
+            raise _plan_conflict_error()
+
+        try:
+            if payload.item_index is None:
+                new_day = regenerate_plan_day(plan, payload.day_index, payload.instruction)
+                _carry_over_coordinates(plan["days"][payload.day_index].get("items"), new_day.get("items"))
+            else:
+                new_item = regenerate_plan_item(plan, payload.day_index, payload.item_index, payload.instruction)
+                new_day = dict(plan["days"][payload.day_index])
+                new_day["items"] = list(new_day["items"])
+                new_day["items"][payload.item_index] = new_item
+        except IndexError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        except (LlmUnavailableError, ProviderBusyError) as llm_err:
+            raise HTTPException(status_code=503, detail=f"LLM unavailable: {llm_err}", headers={"Retry-After": "5"})
+        except Exception as llm_err:
+            # 网络错误、模型输出无法解析等上游问题，与请求本身无关
+            raise HTTPException(status_code=502, detail=f"LLM failed: {llm_err}")
+
+        # 只对修改的这一天做地理编码；已有坐标的地点会被跳过
+        enriched = enrich_plan_with_coordinates({"overview": plan.get("overview") or {}, "days": [new_day]})
+        plan["days"][payload.day_index] = enriched["days"][0]
+        # 原有的整段行程文本已与修改后的内容不一致，改为根据结构化内容重新生成
+        plan["itinerary_text"] = None
+        plan["revision"] = revision + 1
+        plan_text = structured_plan_to_text(plan)
+
+        update_payload = {
+            "plan_text": plan_text,
+            "plan_structured": plan if mode == "json" else json.dumps(plan, ensure_ascii=False),
+        }
+        query = (
+            supabase.table("travel_plans")
+            .update(update_payload)
+            .eq("id", plan_id)
+            .eq("user_id", payload.user_id)
+        )
+        # 乐观并发：只有行程仍是读取时的版本才写入；生成期间被另一次修改抢先时不覆盖
+        if mode == "json":
+            if revision:
+                query = query.eq("plan_structured->>revision", str(revision))
+            else:
+                query = query.is_("plan_structured->>revision", "null")
+        else:
+            query = query.eq("plan_structured", stored)
+        updated = query.execute()
+        if not updated.data:
+            if _travel_plan_exists(plan_id, payload.user_id):
+                raise _plan_conflict_error()
+            raise HTTPException(status_code=404, detail="Travel plan not found")
+        return {
+            "id": plan_id,
+            "day_index": payload.day_index,
+            "item_index": payload.item_index,
+            "revision": plan["revision"],
+            "plan": plan_text,
+            "plan_structured": plan,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        if _is_schema_error(e):
+            _reset_plan_schema_mode()
+        raise HTTPException(status_code=500, detail=f"Regenerate travel plan failed: {str(e)}")
+
+
 def _decimal_to_float(value):
     if value is None:
         return None
@@ -404,6 +1440,10 @@ def _decimal_to_float(value):
 
 
 def _ensure_budget_owner(budget_id: str, user_id: str):
+    """校验预算归属并返回预算行；命中归属缓存时不查询 Supabase。"""
+    cached = budget_owner_cache.get(budget_id, user_id)
+    if cached is not None:
+        return cached
     budget_res = (
         supabase.table("budgets")
         .select("*")
@@ -415,146 +1455,13 @@ def _ensure_budget_owner(budget_id: str, user_id: str):
     rows = budget_res.data or []
     if not rows:
         raise HTTPException(status_code=404, detail="Budget not found")
+    budget_owner_cache.set(budget_id, user_id, rows[0])
     return rows[0]
 
 
-def _parse_amount(text: str) -> Optional[Decimal]:
-    if not text:
-        return None
-    pattern = r"(\d+(?:\.\d+)?)"
-    match = re.search(pattern, text.replace(",", ""))
-    if not match:
-        return None
-    try:
-        return Decimal(match.group(1))
-    except (InvalidOperation, ValueError):
-        return None
-
-
-def _detect_currency(text: str) -> Optional[str]:
-    if not text:
-        return None
-    currency_map = {
-        "美元": "USD",
-        "美金": "USD",
-        "usd": "USD",
-        "日元": "JPY",
-        "日幣": "JPY",
-        "日币": "JPY",
-        "日圓": "JPY",
-        "韩元": "KRW",
-        "韓元": "KRW",
-        "欧元": "EUR",
-        "歐元": "EUR",
-        "英镑": "GBP",
-        "英鎊": "GBP",
-        "港币": "HKD",
-        "港幣": "HKD",
-        "人民币": "CNY",
-        "人民幣": "CNY",
-        "rmb": "CNY",
-        "元": "CNY",
-        "块": "CNY",
-        "块钱": "CNY",
-    }
-    lowered = text.lower()
-    for keyword, code in currency_map.items():
-        if keyword in text or keyword in lowered:
-            return code
-    return None
-
-
-def _detect_category(text: str) -> str:
-    if not text:
-        return "other"
-    category_keywords = [
-        ("food", ["餐", "吃", "饭", "早餐", "午餐", "晚餐", "小吃", "美食", "咖啡", "餐厅", "酒吧"]),
-        ("transport", ["地铁", "飞机", "火车", "打车", "出租", "公交", "高铁", "车票", "交通", "公交卡", "机票"]),
-        ("hotel", ["酒店", "住宿", "民宿", "旅馆", "客栈", "入住"]),
-        ("shopping", ["购物", "买", "购买", "纪念品", "特产", "伴手礼", "礼物"]),
-        ("entertainment", ["门票", "景点", "游玩", "娱乐", "乐园", "演出", "展览", "体验"]),
-        ("other", []),
-    ]
-    for category, keywords in category_keywords:
-        if any(keyword in text for keyword in keywords):
-            return category
-    return "other"
-
-
-def _parse_expense_from_text(text: str) -> Dict[str, Optional[str]]:
-    amount = _parse_amount(text)
-    currency = _detect_currency(text)
-    category = _detect_category(text)
-    return {
-        "amount": amount,
-        "currency": currency,
-        "category": category,
-    }
-
-
-_geocode_cache: Dict[str, Optional[tuple[float, float]]] = {}
-
-
-def geocode_with_amap(address: Optional[str], city: Optional[str] = None) -> Optional[tuple[float, float]]:
-    if not amap_web_key or not address:
-        return None
-    query = address.strip()
-    if not query:
-        return None
-    cache_key = f"{query}|{city or ''}"
-    if cache_key in _geocode_cache:
-        return _geocode_cache[cache_key]
-    params = {
-        "key": amap_web_key,
-        "address": query,
-    }
-    if city:
-        params["city"] = city
-    try:
-        resp = requests.get("https://restapi.amap.com/v3/geocode/geo", params=params, timeout=5)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("status") == "1" and data.get("geocodes"):
-            location = data["geocodes"][0].get("location")
-            if location:
-                try:
-                    lng_str, lat_str = location.split(",")
-                    lng = float(lng_str)
-                    lat = float(lat_str)
-                    _geocode_cache[cache_key] = (lng, lat)
-                    return _geocode_cache[cache_key]
-                except (ValueError, AttributeError):
-                    pass
-    except Exception as exc:
-        print(f"⚠️ Geocode failed for {query} ({city}): {exc}")
-    _geocode_cache[cache_key] = None
-    return None
-
-
-def enrich_plan_with_coordinates(plan: Optional[dict]) -> Optional[dict]:
-    if not isinstance(plan, dict):
-        return plan
-    destination = plan.get("overview", {}).get("destination")
-    days = plan.get("days") or []
-    for day in days:
-        day_city = day.get("city") if isinstance(day, dict) else None
-        items = day.get("items") if isinstance(day, dict) else None
-        if not isinstance(items, list):
-            continue
-        for item in items:
-            if not isinstance(item, dict):
-                continue
-            if item.get("longitude") and item.get("latitude"):
-                continue
-            address = item.get("address") or item.get("name")
-            city = item.get("city") or day_city or destination
-            coords = geocode_with_amap(address, city)
-            if coords:
-                lng, lat = coords
-                item["longitude"] = lng
-                item["latitude"] = lat
-                item["coordinate_source"] = "amap_geocode"
-    return plan
+def _parse_expense_from_text(text: str) -> dict:
+    """解析记账文本，返回 amount / currency / category 及 confidence（见 expense_parser）。"""
+    return parse_expense_text(text)
 
 
 def structured_plan_to_text(plan: Optional[dict]) -> str:
@@ -651,9 +1558,65 @@ def structured_plan_to_text(plan: Optional[dict]) -> str:
     return "\n".join(line for line in lines if line is not None)
 
 
-def generate_travel_plan(user_input: str) -> str:
-    structured = generate_structured_travel_plan(user_input)
-    structured = enrich_plan_with_coordinates(structured)
+def _cacheable_plan(plan) -> bool:
+    # 长行程中有日期重试后仍未生成、或输出被截断只保留了部分内容时不缓存，下次请求重新生成；
+    # 故障转移到其他模型生成的行程也不缓存，缓存键中的模型名始终是主模型
+    return (
+        isinstance(plan, dict)
+        and not plan.get("incomplete_days")
+        and not plan.get("truncated")
+        and plan.get("model", DEEPSEEK_MODEL) == DEEPSEEK_MODEL
+    )
+
+
+def generate_enriched_plan(
+    user_input: str,
+    use_cache: bool = True,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> dict:
+    """生成并补充坐标的结构化行程，优先命中行程缓存（命中时同时跳过地理编码）。
+
+    on_stage 在进入地理编码阶段时被调用，供后台任务上报进度。
+    """
+    cache_key = make_plan_cache_key(user_input, DEEPSEEK_MODEL, PLAN_PROMPT_VERSION)
+    if use_cache:
+        cached = plan_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    def generate() -> dict:
+        structured = generate_structured_travel_plan(user_input)
+        if on_stage:
+            on_stage("geocoding")
+        structured = enrich_plan_with_coordinates(structured)
+        if _cacheable_plan(structured):
+            plan_cache.set(cache_key, structured)
+        return structured
+
+    # 相同需求同时到达时只调用一次 LLM；跟随者不会收到 on_stage 回调
+    return plan_flight.do(cache_key, generate)
+
+
+async def agenerate_enriched_plan(user_input: str, use_cache: bool = True) -> dict:
+    """generate_enriched_plan 的异步版本：await LLM，地理编码交给线程池。"""
+    cache_key = make_plan_cache_key(user_input, DEEPSEEK_MODEL, PLAN_PROMPT_VERSION)
+    if use_cache:
+        cached = await run_blocking(plan_cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+    async def generate() -> dict:
+        structured = await agenerate_structured_travel_plan(user_input)
+        structured = await run_blocking(enrich_plan_with_coordinates, structured)
+        if _cacheable_plan(structured):
+            await run_blocking(plan_cache.set, cache_key, structured)
+        return structured
+
+    return await plan_flight.ado(cache_key, generate)
+
+
+def generate_travel_plan(user_input: str, use_cache: bool = True) -> str:
+    structured = generate_enriched_plan(user_input, use_cache=use_cache)
     if isinstance(structured, dict):
         return structured.get("itinerary_text") or structured_plan_to_text(structured)
     return structured or ""
@@ -662,12 +1625,135 @@ def generate_travel_plan(user_input: str) -> str:
 class TextPlanRequest(BaseModel):
     user_input: str
     user_id: Optional[str] = None
+    no_cache: bool = False  # 跳过行程缓存，强制重新生成
+
+
+def _travel_plan_record(row: dict, mode: str) -> dict:
+    record = {
+        "user_id": row["user_id"],
+        "transcript": row["transcript"],
+        "plan_text": row["plan_text"],
+        "created_at": row["created_at"],
+    }
+    plan_structured = row.get("plan_structured")
+    # 多行插入要求每行的列一致，没有结构化数据时显式写 null
+    if mode == "json":
+        record["plan_structured"] = plan_structured
+    elif mode == "text":
+        record["plan_structured"] = json.dumps(plan_structured, ensure_ascii=False) if plan_structured is not None else None
+    return record
+
+
+def _write_travel_plans(rows: List[dict]) -> None:
+    """persist_queue 的 travel_plans 写入器：按当前 schema 组装各行，一次多行插入。"""
+    # 探测失败（网络等）直接抛出，由队列退避重试，不再猜测 schema
+    mode = _get_plan_schema_mode()
+    if mode == "voice_texts":
+        return
+    try:
+        supabase.table("travel_plans").insert([_travel_plan_record(row, mode) for row in rows]).execute()
+    except Exception as db_err:
+        if _is_schema_error(db_err):
+            # schema 在运行期间发生变化：下次重试前重新探测，按新的 schema 写入
+            _reset_plan_schema_mode()
+        raise
+
+
+def _write_voice_texts(rows: List[dict]) -> None:
+    supabase.table("voice_texts").insert(rows).execute()
+
+
+persist_queue = WriteBehindQueue(
+    create_spool_store(),
+    batch_size=PERSIST_BATCH_SIZE,
+    flush_interval=PERSIST_FLUSH_INTERVAL_SECONDS,
+    max_attempts=PERSIST_MAX_ATTEMPTS,
+    retry_base_seconds=PERSIST_RETRY_BASE_SECONDS,
+    retry_max_seconds=PERSIST_RETRY_MAX_SECONDS,
+)
+persist_queue.register("travel_plans", _write_travel_plans)
+persist_queue.register("voice_texts", _write_voice_texts)
+
+
+def _save_travel_plan(user_id: str, transcript: str, plan_text: str, plan_structured: Optional[dict]) -> None:
+    # 写入本地队列后立即返回；schema 适配与失败重试都在后台写入时处理
+    persist_queue.enqueue("travel_plans", {
+        "user_id": user_id,
+        "transcript": transcript,
+        "plan_text": plan_text,
+        "plan_structured": plan_structured,
+    })
+
+
+def _sse_event(event: str, data) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def _replay_plan_events(plan: dict) -> Iterator[Tuple[str, dict]]:
+    """把缓存中的完整行程按与流式生成相同的事件顺序重放。"""
+    if isinstance(plan.get("overview"), dict):
+        yield "overview", plan["overview"]
+    for day_index, day in enumerate(plan.get("days") or []):
+        if not isinstance(day, dict):
+            continue
+        for item_index, item in enumerate(day.get("items") or []):
+            yield "item", {"day_index": day_index, "item_index": item_index, "item": item}
+        yield "day", {"day_index": day_index, "day": day}
+
+
+def _stream_plan_events(transcript: str, user_id: Optional[str], use_cache: bool = True) -> Iterator[str]:
+    """按 SSE 事件推送行程：overview / day / item 逐个到达，最后 done 携带完整 plan_structured。"""
+    yield _sse_event("transcript", {"transcript": transcript})
+    plan_structured = None
+    plan_text = ""
+    cache_key = make_plan_cache_key(transcript, DEEPSEEK_MODEL, PLAN_PROMPT_VERSION)
+    try:
+        cached = plan_cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            plan_structured = cached
+            for event, data in _replay_plan_events(cached):
+                yield _sse_event(event, data)
+        else:
+            for event, data in stream_structured_travel_plan(transcript):
+                if event == "plan":
+                    plan_structured = enrich_plan_with_coordinates(data)
+                    if _cacheable_plan(plan_structured):
+                        plan_cache.set(cache_key, plan_structured)
+                else:
+                    yield _sse_event(event, data)
+        if isinstance(plan_structured, dict):
+            plan_text = plan_structured.get("itinerary_text") or structured_plan_to_text(plan_structured)
+    except Exception as llm_err:
+        print(f"❌ LLM streaming plan failed: {llm_err}")
+        plan_structured = None
+        plan_text = f"抱歉，行程生成失败：{llm_err}"
+        yield _sse_event("error", {"detail": plan_text})
+
+    if user_id:
+        _save_travel_plan(user_id, transcript, plan_text, plan_structured)
+
+    yield _sse_event("done", {
+        "transcript": transcript,
+        "plan": plan_text,
+        "plan_text": plan_text,
+        "plan_structured": plan_structured,
+    })
+
+
+def _sse_response(events: Iterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.post("/asr_and_plan")
 async def asr_and_plan(
     audio: UploadFile = File(...),
-    user_id: str | None = Form(default=None)
+    user_id: str | None = Form(default=None),
+    no_cache: bool = Form(default=False),
 ):
     try:
         # 1. 读取音频
@@ -676,7 +1762,7 @@ async def asr_and_plan(
             raise HTTPException(status_code=400, detail="Empty audio file")
 
         # 2. 调用 ASR
-        transcript = transcribe_audio_bytes(audio_bytes)
+        transcript = await transcribe_with_pool_async(audio_bytes)
         if not transcript:
             raise HTTPException(status_code=500, detail="ASR returned empty result")
 
@@ -684,8 +1770,7 @@ async def asr_and_plan(
         plan_structured = None
         plan_text = ""
         try:
-            plan_structured = generate_structured_travel_plan(transcript)
-            plan_structured = enrich_plan_with_coordinates(plan_structured)
+            plan_structured = await agenerate_enriched_plan(transcript, use_cache=not no_cache)
             plan_text = plan_structured.get("itinerary_text") or structured_plan_to_text(plan_structured)
         except Exception as llm_err:
             print(f"❌ LLM structured plan failed: {llm_err}")
@@ -694,24 +1779,7 @@ async def asr_and_plan(
         
         # 4. （可选）存入 Supabase
         if user_id:
-            try:
-                insert_payload = {
-                    "user_id": user_id,
-                    "transcript": transcript,
-                    "plan_text": plan_text
-                }
-                if plan_structured is not None:
-                    insert_payload["plan_structured"] = json.dumps(plan_structured, ensure_ascii=False)
-                supabase.table("travel_plans").insert({**insert_payload}).execute()
-            except Exception as db_err:
-                print("⚠️ Warning: Failed to save plan to Supabase:", str(db_err))
-                if "plan_structured" in insert_payload:
-                    try:
-                        fallback_payload = insert_payload.copy()
-                        fallback_payload.pop("plan_structured", None)
-                        supabase.table("travel_plans").insert({**fallback_payload}).execute()
-                    except Exception as retry_err:
-                        print("⚠️ Warning: Fallback insert without structured data also failed:", retry_err)
+            await run_blocking(_save_travel_plan, user_id, transcript, plan_text, plan_structured)
 
         # 5. 返回结果
         return {
@@ -721,6 +1789,8 @@ async def asr_and_plan(
             "plan_structured": plan_structured
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print("❌ ASR + Plan Error:", str(e))
         raise HTTPException(status_code=500, detail=f"ASR or LLM failed: {str(e)}")
@@ -735,8 +1805,7 @@ def text_plan(payload: TextPlanRequest):
         plan_structured = None
         plan_text = ""
         try:
-            plan_structured = generate_structured_travel_plan(user_input)
-            plan_structured = enrich_plan_with_coordinates(plan_structured)
+            plan_structured = generate_enriched_plan(user_input, use_cache=not payload.no_cache)
             if isinstance(plan_structured, dict):
                 plan_text = plan_structured.get("itinerary_text") or structured_plan_to_text(plan_structured)
             else:
@@ -747,24 +1816,7 @@ def text_plan(payload: TextPlanRequest):
             plan_text = f"抱歉，行程生成失败：{llm_err}"
 
         if payload.user_id:
-            try:
-                insert_payload = {
-                    "user_id": payload.user_id,
-                    "transcript": user_input,
-                    "plan_text": plan_text,
-                }
-                if plan_structured is not None:
-                    insert_payload["plan_structured"] = json.dumps(plan_structured, ensure_ascii=False)
-                supabase.table("travel_plans").insert({**insert_payload}).execute()
-            except Exception as db_err:
-                print("⚠️ Warning: Failed to save text plan to Supabase:", str(db_err))
-                if "plan_structured" in insert_payload:
-                    try:
-                        fallback_payload = insert_payload.copy()
-                        fallback_payload.pop("plan_structured", None)
-                        supabase.table("travel_plans").insert({**fallback_payload}).execute()
-                    except Exception as retry_err:
-                        print("⚠️ Warning: Fallback insert without structured data also failed:", retry_err)
+            _save_travel_plan(payload.user_id, user_input, plan_text, plan_structured)
 
         return {
             "transcript": user_input,
@@ -776,4 +1828,143 @@ def text_plan(payload: TextPlanRequest):
         raise
     except Exception as e:
         print("❌ Text plan Error:", str(e))
-        raise HTTPException(status_code=500, detail=f"Text plan failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Text plan failed: {str(e)}")
+
+
+@app.post("/text_plan/stream")
+def text_plan_stream(payload: TextPlanRequest):
+    user_input = (payload.user_input or "").strip()
+    if not user_input:
+        raise HTTPException(status_code=400, detail="请输入旅行需求")
+    return _sse_response(_stream_plan_events(user_input, payload.user_id, use_cache=not payload.no_cache))
+
+
+@app.post("/asr_and_plan/stream")
+async def asr_and_plan_stream(
+    audio: UploadFile = File(...),
+    user_id: str | None = Form(default=None),
+    no_cache: bool = Form(default=False),
+):
+    audio_bytes = await audio.read()
+    if not audio_bytes:
+        raise HTTPException(status_code=400, detail="Empty audio file")
+
+    def events() -> Iterator[str]:
+        # StreamingResponse 在线程池中迭代同步生成器，ASR 阻塞不会占用事件循环
+        try:
+            transcript = transcribe_with_pool(audio_bytes)
+        except Exception as asr_err:
+            print("❌ ASR Error:", str(asr_err))
+            yield _sse_event("error", {"detail": f"ASR error: {asr_err}"})
+            return
+        if not transcript:
+            yield _sse_event("error", {"detail": "ASR returned empty result"})
+            return
+        yield from _stream_plan_events(transcript, user_id, use_cache=not no_cache)
+
+    return _sse_response(events())
+
+
+# ========== 后台行程任务：提交后立即返回任务 ID，客户端轮询 GET /plan_jobs/{job_id} ==========
+
+# 后台任务遇到 ASR 池满时不直接失败，而是等待空位
+PLAN_JOB_ASR_WAIT_SECONDS = float(os.getenv("PLAN_JOB_ASR_WAIT_SECONDS", "60"))
+
+
+def _transcribe_for_job(audio_bytes: bytes) -> str:
+    # 在 ASR 队列上阻塞等待空位，有空位立即入队，超时仍满则抛出 AsrSaturatedError
+    return asr_flight.do(
+        _audio_key(audio_bytes), asr_pool.transcribe, audio_bytes, block=PLAN_JOB_ASR_WAIT_SECONDS
+    )
+
+
+def _run_plan_job(job_input: dict, audio_bytes: Optional[bytes], progress) -> dict:
+    transcript = job_input.get("user_input")
+    if not transcript:
+        if not audio_bytes:
+            raise ValueError("音频数据已丢失，请重新提交")
+        progress("transcribing")
+        transcript = _transcribe_for_job(audio_bytes)
+        if not transcript:
+            raise ValueError("ASR returned empty result")
+        # 记录识别结果，服务重启后可直接从生成阶段恢复
+        progress("generating", user_input=transcript)
+    else:
+        progress("generating")
+
+    plan_structured = generate_enriched_plan(
+        transcript,
+        use_cache=not job_input.get("no_cache"),
+        on_stage=progress,
+    )
+    if isinstance(plan_structured, dict):
+        plan_text = plan_structured.get("itinerary_text") or structured_plan_to_text(plan_structured)
+    else:
+        plan_text = str(plan_structured) if plan_structured else ""
+
+    if job_input.get("user_id"):
+        progress("saving")
+        _save_travel_plan(job_input["user_id"], transcript, plan_text, plan_structured)
+
+    return {
+        "transcript": transcript,
+        "plan": plan_text,
+        "plan_text": plan_text,
+        "plan_structured": plan_structured,
+    }
+
+
+plan_jobs = PlanJobManager(
+    create_job_store(),
+    _run_plan_job,
+    concurrency=PLAN_JOB_WORKERS,
+    max_pending=PLAN_JOB_MAX_PENDING,
+    retention_seconds=PLAN_JOB_RETENTION_SECONDS,
+    lease_seconds=PLAN_JOB_LEASE_SECONDS,
+)
+
+
+def _submit_plan_job(job_input: dict, kind: str, idempotency_key: Optional[str], audio_bytes: Optional[bytes] = None) -> dict:
+    # 幂等键按用户与任务类型隔离，避免不同用户使用相同键时互相命中
+    scoped_key = f"{job_input.get('user_id') or ''}:{kind}:{idempotency_key}" if idempotency_key else None
+    try:
+        job, created = plan_jobs.submit(job_input, idempotency_key=scoped_key, audio_bytes=audio_bytes)
+    except JobQueueFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="行程生成任务繁忙，请稍后重试",
+            headers={"Retry-After": "10"},
+        )
+    return {**job.to_dict(), "deduplicated": not created}
+
+
+@app.post("/plan_jobs", status_code=202)
+def create_plan_job(payload: TextPlanRequest, idempotency_key: str | None = Header(default=None)):
+    user_input = (payload.user_input or "").strip()
+    if not user_input:
+        raise HTTPException(status_code=400, detail="请输入旅行需求")
+    job_input = {"user_input": user_input, "user_id": payload.user_id, "no_cache": payload.no_cache}
+    return _submit_plan_job(job_input, "text", idempotency_key)
+
+
+@app.post("/plan_jobs/voice", status_code=202)
+async def create_voice_plan_job(
+    audio: UploadFile = File(...),
+    user_id: str | None = Form(default=None),
+    no_cache: bool = Form(default=False),
+    idempotency_key: str | None = Header(default=None),
+):
+    audio_bytes = await audio.read()
+    if not audio_bytes:
+        raise HTTPException(status_code=400, detail="Empty audio file")
+    job_input = {"user_input": None, "user_id": user_id, "no_cache": no_cache}
+    return await run_blocking(_submit_plan_job, job_input, "voice", idempotency_key, audio_bytes)
+
+
+@app.get("/plan_jobs/{job_id}")
+def get_plan_job(job_id: str, user_id: str | None = None):
+    job = plan_jobs.get(job_id)
+    # 属于某个用户的任务只对该用户可见
+    if job is None or (job.input.get("user_id") and job.input.get("user_id") != user_id):
+        raise HTTPException(status_code=404, detail="Plan job not found")
+    return job.to_dict()
@@ -0,0 +1,383 @@
+# backend/persistence.py
+"""写后持久化（write-behind）：travel_plans / voice_texts 的插入先写入本地队列，由后台线程批量写入 Supabase。
+
+- 接口只需一次本地写入即可返回，不再等待 Supabase 往返（以及失败后的第二次插入）
+- 后台线程被新写入唤醒，等待 flush_interval 聚合后按表做多行插入，每批最多 batch_size 行
+- 失败按指数退避重试；多行插入失败时逐行重写，个别坏行不会拖住同批的其他行：
+  只有坏行各自退避，所有行都失败才视为上游整体不可用，整批退避
+- 重试 max_attempts 次仍失败的行标记为 dead，保留在队列中供排查，不再重试
+- SqliteSpoolStore 落盘（默认 backend/.cache/persist_spool.sqlite3），重启后继续写入；同机多个 worker
+  共享同一个文件，取出时加租约避免重复写入；MemorySpoolStore 仅用于测试与不需要持久化的部署
+- 入队时记录 created_at，延迟写入不影响历史记录的排序；pending 列出某用户尚未写入的行，
+  /history 据此合并刚生成、还在队列中的行程
+- 至少一次语义：写入成功但在删除队列记录前进程退出时，重启后会再写一次
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "50"))
+# 被唤醒后等待多久再写入，用于把并发请求聚合成一次多行插入
+PERSIST_FLUSH_INTERVAL_SECONDS = float(os.getenv("PERSIST_FLUSH_INTERVAL_SECONDS", "0.2"))
+PERSIST_MAX_ATTEMPTS = int(os.getenv("PERSIST_MAX_ATTEMPTS", "20"))
+PERSIST_RETRY_BASE_SECONDS = float(os.getenv("PERSIST_RETRY_BASE_SECONDS", "1"))
+PERSIST_RETRY_MAX_SECONDS = float(os.getenv("PERSIST_RETRY_MAX_SECONDS", "300"))
+
+# writer(rows)：把同一张表的多行一次写入，失败时抛出异常
+SpoolWriter = Callable[[List[dict]], None]
+
+
+@dataclass
+class SpoolEntry:
+    id: int
+    kind: str
+    row: dict
+    attempts: int = 0
+
+
+class MemorySpoolStore:
+    def __init__(self):
+        self._entries: Dict[int, dict] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def append(self, kind: str, row: dict) -> int:
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "kind": kind, "row": row, "attempts": 0, "next_attempt_at": 0.0,
+                "lease_until": 0.0, "dead": False, "last_error": None,
+            }
+            return entry_id
+
+    def claim(self, limit: int, now: float, lease_seconds: float) -> List[SpoolEntry]:
+        with self._lock:
+            due = [
+                (entry_id, entry) for entry_id, entry in self._entries.items()
+                if not entry["dead"] and entry["next_attempt_at"] <= now and entry["lease_until"] <= now
+            ][:limit]
+            for _, entry in due:
+                entry["lease_until"] = now + lease_seconds
+            return [SpoolEntry(entry_id, entry["kind"], entry["row"], entry["attempts"]) for entry_id, entry in due]
+
+    def delete(self, ids: List[int]) -> None:
+        with self._lock:
+            for entry_id in ids:
+                self._entries.pop(entry_id, None)
+
+    def release(self, ids: List[int], next_attempt_at: float, error: str) -> None:
+        with self._lock:
+            for entry_id in ids:
+                entry = self._entries.get(entry_id)
+                if entry is not None:
+                    entry.update(
+                        attempts=entry["attempts"] + 1, next_attempt_at=next_attempt_at,
+                        lease_until=0.0, last_error=error,
+                    )
+
+    def bury(self, ids: List[int], error: str) -> None:
+        with self._lock:
+            for entry_id in ids:
+                entry = self._entries.get(entry_id)
+                if entry is not None:
+                    entry.update(attempts=entry["attempts"] + 1, dead=True, lease_until=0.0, last_error=error)
+
+    def pending(self, kind: str, user_id: str, limit: int) -> List[SpoolEntry]:
+        with self._lock:
+            rows = [
+                SpoolEntry(entry_id, entry["kind"], entry["row"], entry["attempts"])
+                for entry_id, entry in self._entries.items()
+                if entry["kind"] == kind and not entry["dead"] and entry["row"].get("user_id") == user_id
+            ]
+        return sorted(rows, key=lambda entry: entry.id, reverse=True)[:limit]
+
+    def counts(self) -> dict:
+        with self._lock:
+            dead = sum(1 for entry in self._entries.values() if entry["dead"])
+            return {"pending": len(self._entries) - dead, "dead": dead}
+
+
+class SqliteSpoolStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS persist_spool ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, row TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0, "
+                "lease_until REAL NOT NULL DEFAULT 0, dead INTEGER NOT NULL DEFAULT 0, "
+                "last_error TEXT, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS persist_spool_due ON persist_spool (dead, next_attempt_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def append(self, kind: str, row: dict) -> int:
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT INTO persist_spool (kind, row, created_at) VALUES (?, ?, ?)",
+                (kind, json.dumps(row, ensure_ascii=False), time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self, limit: int, now: float, lease_seconds: float) -> List[SpoolEntry]:
+        with closing(self._connect()) as conn, conn:
+            # 立即加写锁，查询与加租约之间不会被其他 worker 插入同样的领取
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, kind, row, attempts FROM persist_spool "
+                "WHERE dead = 0 AND next_attempt_at <= ? AND lease_until <= ? ORDER BY id LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    f"UPDATE persist_spool SET lease_until = ? WHERE id IN ({', '.join('?' * len(rows))})",
+                    (now + lease_seconds, *(row[0] for row in rows)),
+                )
+        return [SpoolEntry(entry_id, kind, json.loads(raw), attempts) for entry_id, kind, raw, attempts in rows]
+
+    def delete(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"DELETE FROM persist_spool WHERE id IN ({', '.join('?' * len(ids))})", ids)
+
+    def release(self, ids: List[int], next_attempt_at: float, error: str) -> None:
+        if not ids:
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE persist_spool SET attempts = attempts + 1, next_attempt_at = ?, lease_until = 0, last_error = ? "
+                f"WHERE id IN ({', '.join('?' * len(ids))})",
+                (next_attempt_at, error, *ids),
+            )
+
+    def bury(self, ids: List[int], error: str) -> None:
+        if not ids:
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE persist_spool SET attempts = attempts + 1, dead = 1, lease_until = 0, last_error = ? "
+                f"WHERE id IN ({', '.join('?' * len(ids))})",
+                (error, *ids),
+            )
+
+    def pending(self, kind: str, user_id: str, limit: int) -> List[SpoolEntry]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT id, kind, row, attempts FROM persist_spool "
+                "WHERE kind = ? AND dead = 0 AND json_extract(row, '$.user_id') = ? ORDER BY id DESC LIMIT ?",
+                (kind, user_id, limit),
+            ).fetchall()
+        return [SpoolEntry(entry_id, kind, json.loads(raw), attempts) for entry_id, kind, raw, attempts in rows]
+
+    def counts(self) -> dict:
+        with closing(self._connect()) as conn:
+            rows = dict(conn.execute("SELECT dead, COUNT(*) FROM persist_spool GROUP BY dead").fetchall())
+        return {"pending": rows.get(0, 0), "dead": rows.get(1, 0)}
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        store,
+        batch_size: int = 50,
+        flush_interval: float = 0.2,
+        max_attempts: int = 20,
+        retry_base_seconds: float = 1,
+        retry_max_seconds: float = 300,
+        lease_seconds: float = 60,
+    ):
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.lease_seconds = lease_seconds
+        self._writers: Dict[str, SpoolWriter] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_error: Optional[str] = None
+        self._stats = {
+            "enqueued": 0, "written": 0, "batches": 0, "retries": 0,
+            "dead": 0, "direct_writes": 0, "enqueue_errors": 0, "dropped": 0,
+        }
+
+    def register(self, kind: str, writer: SpoolWriter) -> None:
+        self._writers[kind] = writer
+
+    def enqueue(self, kind: str, row: dict) -> None:
+        """写入本地队列后立即返回；本地队列不可用时退回为同步写入，仍失败只记录警告，不影响接口返回。"""
+        row = {**row, "created_at": row.get("created_at") or datetime.now(timezone.utc).isoformat()}
+        try:
+            self.store.append(kind, row)
+        except Exception as exc:
+            print(f"⚠️ Persist spool unavailable, writing {kind} directly: {exc}")
+            with self._lock:
+                self._stats["enqueue_errors"] += 1
+            try:
+                self._writers[kind]([row])
+            except Exception as write_err:
+                print(f"⚠️ Direct {kind} write failed, row dropped: {write_err}")
+                with self._lock:
+                    self._stats["dropped"] += 1
+                return
+            with self._lock:
+                self._stats["direct_writes"] += 1
+            return
+        with self._lock:
+            self._stats["enqueued"] += 1
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="persist-flusher", daemon=True)
+        self._thread.start()
+        # 上次运行留下的队列（或其他 worker 租约过期的行）立即开始写入
+        self._wake.set()
+
+    def _run(self) -> None:
+        # 没有新写入时也定期检查，处理到期的重试
+        poll_seconds = max(self.flush_interval, 1.0)
+        while not self._stopping.is_set():
+            self._wake.wait(poll_seconds)
+            self._wake.clear()
+            if self._stopping.wait(self.flush_interval):
+                break
+            try:
+                while self.flush_once() and not self._stopping.is_set():
+                    pass
+            except Exception as exc:
+                # 本地队列本身出错时不能让线程退出，下一轮再试
+                print(f"⚠️ Persist flush failed: {exc}")
+
+    def flush_once(self) -> int:
+        """取出一批到期的行按表写入，返回本次处理的行数。"""
+        entries = self.store.claim(self.batch_size, time.time(), self.lease_seconds)
+        by_kind: Dict[str, List[SpoolEntry]] = {}
+        for entry in entries:
+            by_kind.setdefault(entry.kind, []).append(entry)
+        for kind, group in by_kind.items():
+            self._write(kind, group)
+        return len(entries)
+
+    def _write(self, kind: str, entries: List[SpoolEntry]) -> None:
+        writer = self._writers.get(kind)
+        if writer is None:
+            self._fail(entries, f"No writer registered for {kind}", retry=False)
+            return
+        try:
+            writer([entry.row for entry in entries])
+        except Exception as exc:
+            if len(entries) == 1:
+                self._fail(entries, str(exc))
+                return
+            # 逐行重写找出坏行：所有行都失败说明上游不可用，整批退避；否则只有坏行各自退避
+            failed = []
+            for entry in entries:
+                try:
+                    writer([entry.row])
+                except Exception as row_exc:
+                    failed.append((entry, str(row_exc)))
+                else:
+                    self._written([entry])
+            if len(failed) == len(entries):
+                self._fail(entries, str(exc))
+                return
+            for entry, error in failed:
+                self._fail([entry], error)
+            return
+        self._written(entries)
+
+    def _written(self, entries: List[SpoolEntry]) -> None:
+        self.store.delete([entry.id for entry in entries])
+        with self._lock:
+            self._stats["written"] += len(entries)
+            self._stats["batches"] += 1
+
+    def _fail(self, entries: List[SpoolEntry], error: str, retry: bool = True) -> None:
+        print(f"⚠️ Persist write of {len(entries)} {entries[0].kind} rows failed: {error}")
+        dead = [entry.id for entry in entries if not retry or entry.attempts + 1 >= self.max_attempts]
+        if dead:
+            self.store.bury(dead, error)
+        # 按已重试次数分组退避：delay = base * 2^attempts，不超过 retry_max_seconds
+        by_attempts: Dict[int, List[int]] = {}
+        for entry in entries:
+            if entry.id not in dead:
+                by_attempts.setdefault(entry.attempts, []).append(entry.id)
+        now = time.time()
+        for attempts, ids in by_attempts.items():
+            delay = min(self.retry_max_seconds, self.retry_base_seconds * (2 ** attempts))
+            self.store.release(ids, now + delay, error)
+        with self._lock:
+            self._last_error = error
+            self._stats["retries"] += len(entries) - len(dead)
+            self._stats["dead"] += len(dead)
+
+    def pending_rows(self, kind: str, user_id: str, limit: int) -> List[SpoolEntry]:
+        """某用户尚未写入上游的行（新的在前，不含 dead）；本地队列出错时返回空列表。"""
+        try:
+            return self.store.pending(kind, user_id, limit)
+        except Exception as exc:
+            print(f"⚠️ Persist spool lookup failed: {exc}")
+            return []
+
+    def shutdown(self, timeout: float = 5) -> None:
+        """停止后台线程，并在 timeout 内尽量写完到期的行；剩余的留在队列中，下次启动继续。"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline and self.flush_once():
+                pass
+        except Exception as exc:
+            print(f"⚠️ Persist flush on shutdown failed: {exc}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["last_error"] = self._last_error
+        try:
+            stats.update(self.store.counts())
+        except Exception as exc:
+            stats["store_error"] = str(exc)
+        stats["running"] = self._thread is not None
+        return stats
+
+
+_default_db = str(Path(__file__).with_name(".cache") / "persist_spool.sqlite3")
+
+
+def create_spool_store():
+    """按 PERSIST_SPOOL_DB 创建队列存储，置空时仅使用内存（重启时未写入的行会丢失）。"""
+    db_path = os.getenv("PERSIST_SPOOL_DB", _default_db)
+    if db_path:
+        try:
+            return SqliteSpoolStore(db_path)
+        except sqlite3.Error as exc:
+            print(f"⚠️ Persist spool DB unavailable, using memory only: {exc}")
+    return MemorySpoolStore()
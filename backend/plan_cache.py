@@ -0,0 +1,133 @@
+# backend/plan_cache.py
+"""行程结果缓存：内存 LRU（带 TTL）+ 可选 SQLite 持久层。
+
+缓存键由规范化后的用户需求、模型名和 prompt 版本共同决定，
+缓存值为已补充坐标的结构化行程，命中时可同时跳过 LLM 与地理编码。
+"""
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from typing import Optional
+
+
+def normalize_user_input(text: str) -> str:
+    """全角转半角、统一小写、压缩空白并去掉首尾标点，让近似请求落到同一个键。"""
+    normalized = unicodedata.normalize("NFKC", text or "").lower()
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return normalized.strip("。，,.!！?？~ ")
+
+
+def make_plan_cache_key(user_input: str, model: str, prompt_version: str) -> str:
+    raw = "\x1f".join([normalize_user_input(user_input), model, prompt_version])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 6 * 3600, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if self.db_path:
+            self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _init_db(self) -> None:
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS plan_cache ("
+                "key TEXT PRIMARY KEY, plan TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, plan = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return copy.deepcopy(plan)
+                del self._entries[key]
+        plan = self._get_from_db(key, now)
+        with self._lock:
+            if plan is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+        self._remember(key, plan, now + self.ttl_seconds)
+        return copy.deepcopy(plan)
+
+    def set(self, key: str, plan: dict) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, copy.deepcopy(plan), expires_at)
+        with self._lock:
+            self._stats["stores"] += 1
+        if self.db_path:
+            try:
+                with closing(self._connect()) as conn, conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO plan_cache (key, plan, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(plan, ensure_ascii=False), expires_at),
+                    )
+            except sqlite3.Error as exc:
+                print(f"⚠️ Plan cache write failed: {exc}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["persistent"] = bool(self.db_path)
+        return stats
+
+    def _remember(self, key: str, plan: dict, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, plan)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _get_from_db(self, key: str, now: float) -> Optional[dict]:
+        if not self.db_path:
+            return None
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute(
+                    "SELECT plan, expires_at FROM plan_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] <= now:
+                    conn.execute("DELETE FROM plan_cache WHERE key = ?", (key,))
+                    return None
+            return json.loads(row[0])
+        except (sqlite3.Error, json.JSONDecodeError) as exc:
+            print(f"⚠️ Plan cache read failed: {exc}")
+            return None
+
+
+plan_cache = PlanCache(
+    max_entries=int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "256")),
+    ttl_seconds=float(os.getenv("PLAN_CACHE_TTL_SECONDS", str(6 * 3600))),
+    db_path=os.getenv("PLAN_CACHE_DB") or None,
+)
@@ -0,0 +1,438 @@
+# backend/plan_jobs.py
+"""行程生成任务队列：提交后立即返回任务 ID，由进程内线程池执行，客户端轮询结果。
+
+- MemoryJobStore 用于测试与单进程部署；SqliteJobStore 落盘，重启后可恢复未完成的任务
+- 相同幂等键（Idempotency-Key）的重复提交返回同一个任务，不会重复调用 LLM
+- 每个未完成的任务带 owner（worker ID）与租约，执行它的 worker 定期续租；多个 worker 共用同一个
+  SqliteJobStore 时，只有租约已过期（原 worker 已退出）的任务才会被其他 worker 接管
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# 明确从 backend/.env 读取
+load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
+
+PLAN_JOB_WORKERS = int(os.getenv("PLAN_JOB_WORKERS", "2"))
+PLAN_JOB_MAX_PENDING = int(os.getenv("PLAN_JOB_MAX_PENDING", "100"))
+# 已结束的任务（及其幂等键）保留时长
+PLAN_JOB_RETENTION_SECONDS = float(os.getenv("PLAN_JOB_RETENTION_SECONDS", str(24 * 3600)))
+# 任务租约时长：worker 每隔三分之一租约续租一次，超过租约未续的任务视为原 worker 已退出
+PLAN_JOB_LEASE_SECONDS = float(os.getenv("PLAN_JOB_LEASE_SECONDS", "60"))
+
+# 任务状态：queued → running → succeeded | failed
+# 进度阶段：queued → transcribing → generating → geocoding → saving → done
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+@dataclass
+class PlanJob:
+    id: str
+    input: dict
+    status: str = "queued"
+    stage: str = "queued"
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    idempotency_key: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    owner: Optional[str] = None
+    lease_until: float = 0.0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        for key in ("input", "idempotency_key", "owner", "lease_until"):
+            data.pop(key, None)
+        data["job_id"] = data.pop("id")
+        return data
+
+
+class MemoryJobStore:
+    def __init__(self):
+        self._jobs: Dict[str, PlanJob] = {}
+        self._by_key: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: PlanJob) -> Tuple[PlanJob, bool]:
+        """写入新任务；幂等键已存在时返回已有任务与 False。"""
+        with self._lock:
+            if job.idempotency_key and job.idempotency_key in self._by_key:
+                return self._jobs[self._by_key[job.idempotency_key]], False
+            self._jobs[job.id] = job
+            if job.idempotency_key:
+                self._by_key[job.idempotency_key] = job.id
+            return job, True
+
+    def get(self, job_id: str) -> Optional[PlanJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return PlanJob(**asdict(job)) if job else None
+
+    def update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated_at = time.time()
+
+    def claim(self, job_id: str, owner: str, lease_until: float, now: float) -> bool:
+        """未完成且无人持有（或租约已过期、或本来就属于 owner）时把任务交给 owner。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in TERMINAL_STATUSES:
+                return False
+            if job.owner not in (None, owner) and job.lease_until > now:
+                return False
+            job.owner = owner
+            job.lease_until = lease_until
+            return True
+
+    def renew(self, owner: str, lease_until: float) -> int:
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.owner == owner and job.status not in TERMINAL_STATUSES]
+            for job in jobs:
+                job.lease_until = lease_until
+            return len(jobs)
+
+    def list_unfinished(self, lease_expired_before: Optional[float] = None) -> List[PlanJob]:
+        """未完成的任务；传入 lease_expired_before 时只返回租约在该时刻之前已过期的任务。"""
+        with self._lock:
+            return [
+                PlanJob(**asdict(job)) for job in self._jobs.values()
+                if job.status not in TERMINAL_STATUSES
+                and (lease_expired_before is None or job.lease_until <= lease_expired_before)
+            ]
+
+    def purge(self, older_than: float) -> int:
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.status in TERMINAL_STATUSES and job.updated_at < older_than
+            ]
+            for job in expired:
+                del self._jobs[job.id]
+                if job.idempotency_key:
+                    self._by_key.pop(job.idempotency_key, None)
+            return len(expired)
+
+
+class SqliteJobStore:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS plan_jobs ("
+                "id TEXT PRIMARY KEY, idempotency_key TEXT UNIQUE, status TEXT NOT NULL, "
+                "stage TEXT NOT NULL, input TEXT NOT NULL, result TEXT, error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                "owner TEXT, lease_until REAL NOT NULL DEFAULT 0)"
+            )
+            # 旧版本创建的表没有租约列；补上后旧任务的租约视为已过期，可被接管
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(plan_jobs)")}
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE plan_jobs ADD COLUMN owner TEXT")
+            if "lease_until" not in columns:
+                conn.execute("ALTER TABLE plan_jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    @staticmethod
+    def _row_to_job(row) -> PlanJob:
+        job_id, key, status, stage, raw_input, raw_result, error, created_at, updated_at, owner, lease_until = row
+        return PlanJob(
+            id=job_id,
+            input=json.loads(raw_input),
+            status=status,
+            stage=stage,
+            result=json.loads(raw_result) if raw_result else None,
+            error=error,
+            idempotency_key=key,
+            created_at=created_at,
+            updated_at=updated_at,
+            owner=owner,
+            lease_until=lease_until,
+        )
+
+    _COLUMNS = "id, idempotency_key, status, stage, input, result, error, created_at, updated_at, owner, lease_until"
+
+    def create(self, job: PlanJob) -> Tuple[PlanJob, bool]:
+        with closing(self._connect()) as conn, conn:
+            try:
+                conn.execute(
+                    f"INSERT INTO plan_jobs ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job.id, job.idempotency_key, job.status, job.stage,
+                        json.dumps(job.input, ensure_ascii=False), None, None,
+                        job.created_at, job.updated_at, job.owner, job.lease_until,
+                    ),
+                )
+                return job, True
+            except sqlite3.IntegrityError:
+                # 幂等键冲突（可能来自同机另一个 worker），返回已有任务
+                row = conn.execute(
+                    f"SELECT {self._COLUMNS} FROM plan_jobs WHERE idempotency_key = ?",
+                    (job.idempotency_key,),
+                ).fetchone()
+                if row is None:
+                    raise
+                return self._row_to_job(row), False
+
+    def get(self, job_id: str) -> Optional[PlanJob]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT {self._COLUMNS} FROM plan_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update(self, job_id: str, **fields) -> None:
+        columns = []
+        values = []
+        for key, value in fields.items():
+            if key in ("input", "result"):
+                value = json.dumps(value, ensure_ascii=False) if value is not None else None
+            columns.append(f"{key} = ?")
+            values.append(value)
+        columns.append("updated_at = ?")
+        values.append(time.time())
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"UPDATE plan_jobs SET {', '.join(columns)} WHERE id = ?", (*values, job_id))
+
+    def claim(self, job_id: str, owner: str, lease_until: float, now: float) -> bool:
+        # 单条 UPDATE 在 SQLite 中是原子的：两个 worker 同时接管同一任务时只有一个成功
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "UPDATE plan_jobs SET owner = ?, lease_until = ? WHERE id = ? AND status NOT IN (?, ?) "
+                "AND (owner IS NULL OR owner = ? OR lease_until <= ?)",
+                (owner, lease_until, job_id, *TERMINAL_STATUSES, owner, now),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, owner: str, lease_until: float) -> int:
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "UPDATE plan_jobs SET lease_until = ? WHERE owner = ? AND status NOT IN (?, ?)",
+                (lease_until, owner, *TERMINAL_STATUSES),
+            )
+            return cursor.rowcount
+
+    def list_unfinished(self, lease_expired_before: Optional[float] = None) -> List[PlanJob]:
+        query = f"SELECT {self._COLUMNS} FROM plan_jobs WHERE status NOT IN (?, ?)"
+        params: tuple = TERMINAL_STATUSES
+        if lease_expired_before is not None:
+            query += " AND lease_until <= ?"
+            params = (*params, lease_expired_before)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query + " ORDER BY created_at", params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def purge(self, older_than: float) -> int:
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "DELETE FROM plan_jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (*TERMINAL_STATUSES, older_than),
+            )
+            return cursor.rowcount
+
+
+# runner(job_input, audio_bytes, progress) -> result；progress(stage, **input_updates) 上报阶段，
+# input_updates 会合并进任务输入（例如识别出的 transcript），使任务在重启后可从该阶段之后恢复
+JobRunner = Callable[[dict, Optional[bytes], Callable[..., None]], dict]
+
+
+class PlanJobManager:
+    def __init__(
+        self,
+        store,
+        runner: JobRunner,
+        concurrency: int = 2,
+        max_pending: int = 100,
+        retention_seconds: float = 24 * 3600,
+        lease_seconds: float = 60,
+        worker_id: Optional[str] = None,
+    ):
+        self.store = store
+        self.runner = runner
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        # 容器内 pid 常常相同，加随机后缀保证重启后是新的 owner
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="plan-job")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_purge = 0.0
+        self._can_resume: Optional[Callable[[dict], bool]] = None
+        self._heartbeat: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._stats = {
+            "submitted": 0, "deduplicated": 0, "succeeded": 0, "failed": 0, "rejected": 0,
+            "resumed": 0, "lease_lost": 0,
+        }
+
+    def submit(self, job_input: dict, idempotency_key: Optional[str] = None, audio_bytes: Optional[bytes] = None) -> Tuple[PlanJob, bool]:
+        """创建并排队任务，返回 (任务, 是否新建)。幂等键重复时不会再次执行。"""
+        self._maybe_purge()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats["rejected"] += 1
+                raise JobQueueFullError("Plan job queue is full")
+        job, created = self.store.create(PlanJob(
+            id=uuid.uuid4().hex,
+            input=job_input,
+            idempotency_key=idempotency_key,
+            owner=self.worker_id,
+            lease_until=time.time() + self.lease_seconds,
+        ))
+        if not created:
+            with self._lock:
+                self._stats["deduplicated"] += 1
+            return job, False
+        with self._lock:
+            self._stats["submitted"] += 1
+        self._enqueue(job.id, audio_bytes)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[PlanJob]:
+        return self.store.get(job_id)
+
+    def resume_unfinished(self, can_resume: Callable[[dict], bool]) -> int:
+        """启动时调用：接管租约已过期的未完成任务，可恢复的重新排队，其余（例如缺少音频的语音任务）标记失败。
+
+        仍由其他存活 worker 持有（租约未过期）的任务不受影响。之后心跳线程会定期重复这一检查，
+        接管运行期间才退出的 worker 留下的任务。
+        """
+        self._can_resume = can_resume
+        resumed = self._take_over_expired()
+        self._ensure_heartbeat()
+        return resumed
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+        stats["max_pending"] = self.max_pending
+        stats["worker_id"] = self.worker_id
+        return stats
+
+    def shutdown(self) -> None:
+        self._stopping.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _take_over_expired(self) -> int:
+        now = time.time()
+        resumed = 0
+        for job in self.store.list_unfinished(lease_expired_before=now):
+            # 另一个 worker 可能同时在接管，claim 失败说明已被它拿走
+            if not self.store.claim(job.id, self.worker_id, now + self.lease_seconds, now):
+                continue
+            if self._can_resume(job.input):
+                self.store.update(job.id, status="queued", stage="queued")
+                self._enqueue(job.id, None)
+                resumed += 1
+            else:
+                self.store.update(job.id, status="failed", stage="done", error="任务在服务重启时中断，请重新提交")
+        with self._lock:
+            self._stats["resumed"] += resumed
+        return resumed
+
+    def _ensure_heartbeat(self) -> None:
+        with self._lock:
+            if self._heartbeat is not None or self._stopping.is_set():
+                return
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="plan-job-lease", daemon=True)
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stopping.wait(self.lease_seconds / 3):
+            try:
+                self.store.renew(self.worker_id, time.time() + self.lease_seconds)
+                if self._can_resume is not None:
+                    resumed = self._take_over_expired()
+                    if resumed:
+                        print(f"Took over {resumed} plan jobs with expired leases")
+            except Exception as exc:
+                print(f"⚠️ Plan job lease renewal failed: {exc}")
+
+    def _enqueue(self, job_id: str, audio_bytes: Optional[bytes]) -> None:
+        self._ensure_heartbeat()
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, job_id, audio_bytes)
+
+    def _run(self, job_id: str, audio_bytes: Optional[bytes]) -> None:
+        try:
+            job = self.store.get(job_id)
+            if job is None:
+                return
+            now = time.time()
+            if not self.store.claim(job_id, self.worker_id, now + self.lease_seconds, now):
+                # 排队期间租约过期并被其他 worker 接管，由它继续执行
+                with self._lock:
+                    self._stats["lease_lost"] += 1
+                return
+            job_input = dict(job.input)
+            self.store.update(job_id, status="running")
+
+            def progress(stage: str, **input_updates):
+                if input_updates:
+                    job_input.update(input_updates)
+                    self.store.update(job_id, stage=stage, input=job_input)
+                else:
+                    self.store.update(job_id, stage=stage)
+
+            try:
+                result = self.runner(job_input, audio_bytes, progress)
+            except Exception as exc:
+                print(f"❌ Plan job {job_id} failed: {exc}")
+                self.store.update(job_id, status="failed", stage="done", error=str(exc))
+                outcome = "failed"
+            else:
+                self.store.update(job_id, status="succeeded", stage="done", result=result)
+                outcome = "succeeded"
+            with self._lock:
+                self._stats[outcome] += 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _maybe_purge(self) -> None:
+        now = time.time()
+        if now - self._last_purge < 600:
+            return
+        self._last_purge = now
+        try:
+            self.store.purge(now - self.retention_seconds)
+        except Exception as exc:
+            print(f"⚠️ Plan job purge failed: {exc}")
+
+
+_default_db = str(Path(__file__).with_name(".cache") / "plan_jobs.sqlite3")
+
+
+def create_job_store():
+    """按 PLAN_JOB_DB 创建任务存储，置空时仅使用内存（重启后任务丢失）。"""
+    db_path = os.getenv("PLAN_JOB_DB", _default_db)
+    if db_path:
+        try:
+            return SqliteJobStore(db_path)
+        except sqlite3.Error as exc:
+            print(f"⚠️ Plan job DB unavailable, using memory only: {exc}")
+    return MemoryJobStore()
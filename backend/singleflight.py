@@ -0,0 +1,168 @@
+# backend/singleflight.py
+"""单飞（single-flight）请求合并：同一个键同时只执行一次上游调用，并发的相同请求共享其结果或异常。
+
+- do / ado 分别用于同步线程与 async 协程，两者共用同一张表：同步调用与协程请求同一个键时也只执行一次
+- begin / finish 供需要自行批量执行的调用方（例如批量地理编码）使用
+- 结果在返回给跟随者前深拷贝，避免多个请求修改同一个对象
+- async 版本在独立任务中执行；发起者被取消不影响其他等待者，所有等待者都离开时才取消任务
+- 只合并“正在进行”的调用，完成后立即移除，不承担缓存职责
+"""
+import asyncio
+import copy
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_registry: Dict[str, "SingleFlight"] = {}
+_registry_lock = threading.Lock()
+
+
+class Flight:
+    """一次进行中的调用，由发起者执行并调用 SingleFlight.finish，跟随者通过 wait / 协程等待获取结果。"""
+
+    __slots__ = ("key", "_event", "_result", "_error", "_waiters", "_waiting", "_callbacks", "task")
+
+    def __init__(self, key):
+        self.key = key
+        self._event = threading.Event()
+        self._result: Any = None
+        self._error: Optional[BaseException] = None
+        # 加入过的跟随者数量（决定是否需要快照）与当前仍在等待的数量（决定能否取消 async 任务）
+        self._waiters = 0
+        self._waiting = 0
+        self._callbacks: List[Callable[[], None]] = []
+        self.task: Optional[asyncio.Future] = None
+
+    def wait(self, timeout: Optional[float] = None):
+        """等待发起者完成并返回结果（深拷贝）；超时返回 None，发起者失败时抛出同一异常。"""
+        if not self._event.wait(timeout):
+            return None
+        return self._shared_result()
+
+    def _shared_result(self):
+        if self._error is not None:
+            raise self._error
+        return copy.deepcopy(self._result)
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights: Dict[Any, Flight] = {}
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0, "errors": 0}
+        with _registry_lock:
+            _registry[name] = self
+
+    def begin(self, key) -> Tuple[Flight, bool]:
+        """返回 (flight, 是否为发起者)；发起者必须在结束时调用 finish。"""
+        with self._lock:
+            self._stats["calls"] += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight._waiters += 1
+                self._stats["coalesced"] += 1
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            self._stats["executions"] += 1
+            return flight, True
+
+    def finish(self, flight: Flight, result=None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if error is not None and not isinstance(error, asyncio.CancelledError):
+                self._stats["errors"] += 1
+            # 有跟随者时保存一份快照，发起者之后修改自己的结果不会影响它们
+            shared = copy.deepcopy(result) if flight._waiters and error is None else result
+            flight._result = shared
+            flight._error = error
+            flight._event.set()
+            callbacks, flight._callbacks = flight._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    # ---------- 同步 ----------
+
+    def do(self, key, fn, *args, **kwargs):
+        flight, leader = self.begin(key)
+        if not leader:
+            with self._lock:
+                flight._waiting += 1
+            try:
+                return flight.wait()
+            finally:
+                with self._lock:
+                    flight._waiting -= 1
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            self.finish(flight, error=exc)
+            raise
+        self.finish(flight, result)
+        return result
+
+    # ---------- 异步 ----------
+
+    async def ado(self, key, fn, *args, **kwargs):
+        """fn 为协程函数；发起者在独立任务中执行，同步调用方也可以作为跟随者等待它。"""
+        flight, leader = self.begin(key)
+        if leader:
+            flight.task = asyncio.ensure_future(fn(*args, **kwargs))
+            flight.task.add_done_callback(lambda task: self._task_done(flight, task))
+        await self._await(flight)
+        if leader and flight._error is None:
+            return flight.task.result()
+        return flight._shared_result()
+
+    async def _await(self, flight: Flight) -> None:
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def settle() -> None:
+            if not done.done():
+                done.set_result(None)
+
+        with self._lock:
+            flight._waiting += 1
+            if flight._event.is_set():
+                settle()
+            else:
+                # 同步发起者在其他线程结束时回调，需要切回本事件循环
+                flight._callbacks.append(lambda: loop.call_soon_threadsafe(settle))
+        try:
+            await done
+        except asyncio.CancelledError:
+            with self._lock:
+                flight._waiting -= 1
+                abandoned = flight.task is not None and flight._waiting == 0 and not flight._event.is_set()
+                if abandoned and self._flights.get(flight.key) is flight:
+                    # 之后到达的相同请求重新发起，不再等待一个即将取消的任务
+                    del self._flights[flight.key]
+            if abandoned:
+                # 所有等待者都已离开（例如客户端断开），不再继续上游调用
+                flight.task.cancel()
+            raise
+        with self._lock:
+            flight._waiting -= 1
+
+    def _task_done(self, flight: Flight, task: asyncio.Future) -> None:
+        if task.cancelled():
+            self.finish(flight, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self.finish(flight, error=task.exception())
+        else:
+            self.finish(flight, task.result())
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+        stats["coalesce_rate"] = round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else 0.0
+        return stats
+
+
+def singleflight_stats() -> dict:
+    with _registry_lock:
+        groups = dict(_registry)
+    return {name: group.stats() for name, group in groups.items()}
@@ -0,0 +1,59 @@
+# backend/tests/conftest.py
+"""测试环境：导入 backend.main 之前设置必需的环境变量，并关闭所有本地 SQLite 文件（改用内存存储）。
+
+外部服务（Supabase、讯飞、LLM 提供方）在各测试中以桩对象替换，不访问网络。
+运行：在仓库根目录或 backend/ 下执行 python -m pytest -q（配置见根目录 pytest.ini）
+"""
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test-anon-key")
+for _name in ("PLAN_JOB_DB", "PLAN_CACHE_DB", "GEOCODE_CACHE_DB", "BUDGET_AGGREGATE_DB", "PERSIST_SPOOL_DB"):
+    os.environ[_name] = ""
+
+
+class FakeQuery:
+    """Supabase 查询构造器桩：记录链式调用，execute 时交给 FakeSupabase 的处理函数决定返回的数据。"""
+
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table = table
+        self.calls = []
+
+    def __getattr__(self, name):
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+
+        return record
+
+    def execute(self):
+        self.client.executed.append((self.table, self.calls))
+        handler = self.client.handlers.get(self.table)
+        data = handler(self.calls) if handler else []
+        return SimpleNamespace(data=data, count=None)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.handlers = {}
+        self.executed = []
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def on(self, table: str, handler) -> None:
+        """handler(calls) 返回 execute().data；抛出异常即模拟 Supabase 报错。"""
+        self.handlers[table] = handler
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    from backend import main
+
+    client = FakeSupabase()
+    monkeypatch.setattr(main, "supabase", client)
+    return client
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from backend import asr_pool as asr_pool_module
+from backend.asr_pool import AsrPool, AsrSaturatedError, AsrTimeoutError
+
+
+def test_queued_job_waits_for_live_session_slot(monkeypatch):
+    started = threading.Event()
+
+    def transcribe(audio_bytes, timeout, cancel_event, on_session):
+        started.set()
+        return "ok"
+
+    monkeypatch.setattr(asr_pool_module, "transcribe_audio_bytes", transcribe)
+    pool = AsrPool(workers=1, queue_size=2, default_timeout=5)
+    try:
+        with pool.live_session():
+            job = pool.submit(b"audio")
+            # 实时会话占着唯一的名额，排队任务不能开始
+            assert not started.wait(0.2)
+        assert pool.wait(job) == "ok"
+    finally:
+        pool.shutdown()
+
+
+def test_queued_job_times_out_while_live_sessions_hold_every_slot():
+    pool = AsrPool(workers=1, queue_size=2, default_timeout=0.2)
+    try:
+        with pool.live_session():
+            job = pool.submit(b"audio")
+            with pytest.raises(AsrTimeoutError):
+                pool.wait(job)
+    finally:
+        pool.shutdown()
+
+
+def test_live_sessions_are_limited_to_worker_count():
+    pool = AsrPool(workers=2, queue_size=1)
+    with pool.live_session(), pool.live_session():
+        with pytest.raises(AsrSaturatedError):
+            with pool.live_session():
+                pass
+        assert pool.stats()["live_sessions"] == 2
+    assert pool.stats()["live_sessions"] == 0
+
+
+def _saturated_pool(monkeypatch, release: threading.Event):
+    """1 个工作线程 + 1 个队列位置，均被占用。"""
+    running = threading.Event()
+
+    def transcribe(audio_bytes, timeout, cancel_event, on_session):
+        running.set()
+        release.wait(5)
+        return audio_bytes.decode()
+
+    monkeypatch.setattr(asr_pool_module, "transcribe_audio_bytes", transcribe)
+    pool = AsrPool(workers=1, queue_size=1, default_timeout=5)
+    first = pool.submit(b"first")
+    assert running.wait(1)
+    queued = pool.submit(b"queued")
+    with pytest.raises(AsrSaturatedError):
+        pool.submit(b"rejected")
+    return pool, [first, queued]
+
+
+def test_blocking_submit_enters_as_soon_as_a_slot_frees(monkeypatch):
+    release = threading.Event()
+    pool, jobs = _saturated_pool(monkeypatch, release)
+    try:
+        threading.Timer(0.2, release.set).start()
+        start = time.monotonic()
+        job = pool.submit(b"waited", block=2)
+        assert 0.15 < time.monotonic() - start < 0.5
+        assert pool.wait(job) == "waited"
+        assert [pool.wait(job) for job in jobs] == ["first", "queued"]
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_blocking_submit_gives_up_after_its_wait(monkeypatch):
+    release = threading.Event()
+    pool, _ = _saturated_pool(monkeypatch, release)
+    try:
+        start = time.monotonic()
+        with pytest.raises(AsrSaturatedError):
+            pool.submit(b"waited", block=0.2)
+        assert time.monotonic() - start >= 0.2
+    finally:
+        release.set()
+        pool.shutdown()
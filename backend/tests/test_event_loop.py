@@ -0,0 +1,67 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+
+from backend import llm, main
+from backend.plan_cache import PlanCache
+
+ASR_SECONDS = 0.5
+LLM_SECONDS = 1.5
+SLOW_REQUESTS = 6
+# /budgets 只查一次（桩）Supabase，即使慢请求全部在途也应远快于一次 ASR 调用
+BUDGETS_BOUND_SECONDS = 0.3
+
+
+async def _slow_transcribe(audio_bytes: bytes, timeout=None) -> str:
+    await asyncio.sleep(ASR_SECONDS)
+    return f"周末去杭州玩 {audio_bytes.decode()}"
+
+
+async def _slow_complete(**kwargs):
+    await asyncio.sleep(LLM_SECONDS)
+    plan = {"overview": {"destination": "杭州"}, "days": [{"day": 1, "items": []}]}
+    message = SimpleNamespace(content=json.dumps(plan, ensure_ascii=False))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None, served_model=llm.DEEPSEEK_MODEL)
+
+
+def test_budgets_stays_responsive_while_slow_voice_plans_are_in_flight(fake_supabase, monkeypatch):
+    fake_supabase.on("budgets", lambda calls: [{"id": "b1", "user_id": "u1"}])
+    monkeypatch.setattr(main, "asr_pool", SimpleNamespace(transcribe_async=_slow_transcribe))
+    monkeypatch.setattr(llm.llm_router, "acomplete", _slow_complete)
+    monkeypatch.setattr(main, "enrich_plan_with_coordinates", lambda plan: plan)
+    monkeypatch.setattr(main, "plan_cache", PlanCache())
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = time.perf_counter()
+            plans = [
+                asyncio.create_task(
+                    client.post("/asr_and_plan", files={"audio": ("a.pcm", str(index).encode())}, data={"no_cache": "true"})
+                )
+                for index in range(SLOW_REQUESTS)
+            ]
+            latencies = []
+            # 分别在 ASR 阶段与 LLM 阶段各测一次
+            for delay in (ASR_SECONDS / 2, ASR_SECONDS + LLM_SECONDS / 2):
+                scheduled = started + delay
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                response = await client.get("/budgets", params={"user_id": "u1"})
+                # 从计划时刻算起：事件循环被阻塞时，连 sleep 的唤醒都会推迟
+                latencies.append(time.perf_counter() - scheduled)
+                assert response.status_code == 200
+                assert response.json() == {"items": [{"id": "b1", "user_id": "u1"}]}
+                assert not any(plan.done() for plan in plans)
+            responses = await asyncio.gather(*plans)
+            return latencies, responses, time.perf_counter() - started
+
+    latencies, responses, elapsed = asyncio.run(scenario())
+
+    assert max(latencies) < BUDGETS_BOUND_SECONDS, latencies
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()["plan_structured"]["days"] for response in responses)
+    # 慢请求之间也是并发执行的，而不是一个接一个
+    assert elapsed < 2 * (ASR_SECONDS + LLM_SECONDS)
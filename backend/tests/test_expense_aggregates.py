@@ -0,0 +1,67 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.budget_owner_cache import budget_owner_cache
+
+
+@pytest.fixture
+def broken_aggregates(fake_supabase, monkeypatch):
+    """Supabase 写入成功，但本机汇总维护抛错（例如 SQLite 被锁）。"""
+    inserted = []
+
+    def insert_expenses(calls):
+        rows = next(args[0] for name, args, _ in calls if name == "insert")
+        rows = rows if isinstance(rows, list) else [rows]
+        created = [{**row, "id": f"e{len(inserted) + index}"} for index, row in enumerate(rows)]
+        inserted.extend(created)
+        return created
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    invalidated = []
+    fake_supabase.on("budgets", lambda calls: [{"id": "b1", "user_id": "u1"}])
+    fake_supabase.on("expenses", insert_expenses)
+    monkeypatch.setattr(main.budget_aggregates, "apply_inserts", fail)
+    monkeypatch.setattr(main.budget_aggregates, "invalidate", invalidated.append)
+    budget_owner_cache.invalidate("b1")
+    return SimpleNamespace(inserted=inserted, invalidated=invalidated)
+
+
+def test_batch_returns_created_rows_when_aggregate_update_fails(broken_aggregates):
+    rows = [{"budget_id": "b1", "category": "餐饮", "amount": 30 + index} for index in range(3)]
+    response = TestClient(main.app).post("/expenses/batch", params={"user_id": "u1"}, json=rows)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["created"] == 3
+    assert [result["status"] for result in body["results"]] == ["created"] * 3
+    assert len(broken_aggregates.inserted) == 3
+    assert broken_aggregates.invalidated == ["b1"]
+
+
+def test_single_expense_returns_created_row_when_aggregate_update_fails(broken_aggregates):
+    response = TestClient(main.app).post(
+        "/expenses", json={"user_id": "u1", "budget_id": "b1", "category": "交通", "amount": 12}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["id"] == "e0"
+    assert broken_aggregates.invalidated == ["b1"]
+
+
+def test_budget_delete_succeeds_when_aggregate_invalidation_fails(fake_supabase, monkeypatch):
+    def fail(budget_id):
+        raise sqlite3.OperationalError("database is locked")
+
+    fake_supabase.on("budgets", lambda calls: [{"id": "b1", "user_id": "u1"}])
+    monkeypatch.setattr(main.budget_aggregates, "invalidate", fail)
+
+    response = TestClient(main.app).delete("/budgets/b1", params={"user_id": "u1"})
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Budget deleted"}
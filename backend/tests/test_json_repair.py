@@ -0,0 +1,26 @@
+import pytest
+
+from backend.benchmarks.json_repair import _check_corpus, load_corpus
+from backend.json_repair import repair_json
+
+
+def test_corpus_repairs_as_expected():
+    assert _check_corpus(load_corpus()) == []
+
+
+@pytest.mark.parametrize(
+    "text, value",
+    [
+        ('{"a":"s" "b":2}', {"a": "s", "b": 2}),
+        ('{"a":"s""b":2}', {"a": "s", "b": 2}),
+        ('{"a":"s"\n  "b" : 2}', {"a": "s", "b": 2}),
+    ],
+)
+def test_missing_comma_after_string_value(text, value):
+    result = repair_json(text)
+    assert result.value == value
+    assert result.kinds == ["missing_comma"]
+
+
+def test_inner_quote_not_followed_by_a_key_stays_in_the_string():
+    assert repair_json('{"a": "他说"好的"然后走了"}').value == {"a": '他说"好的"然后走了'}
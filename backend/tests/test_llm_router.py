@@ -0,0 +1,320 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.llm_router import LlmRouter, LlmUnavailableError, ProviderBusyError, ProviderConfig
+
+
+class StubLlmServer:
+    """本地 OpenAI 兼容桩服务：POST /v1/chat/completions，按 status / delay / 流式分片配置行为。"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.status = 200
+        self.delay = 0.0
+        self.stream_chunks = 5
+        self.stream_interval = 0.0
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.chunks_sent = 0
+        self.disconnected = threading.Event()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def config(self, **overrides) -> ProviderConfig:
+        return ProviderConfig(name=self.model, base_url=self.base_url, api_key="test", model=self.model, **overrides)
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                try:
+                    time.sleep(stub.delay)
+                    if stub.status != 200:
+                        self._send_json(stub.status, {"error": {"message": "stub failure", "type": "server_error"}})
+                    elif body.get("stream"):
+                        self._send_stream()
+                    else:
+                        self._send_json(200, {
+                            "id": "cmpl", "object": "chat.completion", "created": 0, "model": stub.model,
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": stub.model},
+                                         "finish_reason": "stop"}],
+                            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                        })
+                finally:
+                    with stub._lock:
+                        stub.active -= 1
+
+            def _send_json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                try:
+                    for index in range(stub.stream_chunks):
+                        chunk = {
+                            "id": "cmpl", "object": "chat.completion.chunk", "created": 0, "model": stub.model,
+                            "choices": [{"index": 0, "delta": {"content": str(index)}, "finish_reason": None}],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                        stub.chunks_sent += 1
+                        time.sleep(stub.stream_interval)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    stub.disconnected.set()
+                self.close_connection = True
+
+        return Handler
+
+
+@pytest.fixture
+def servers():
+    created = []
+
+    def make(model: str) -> StubLlmServer:
+        server = StubLlmServer(model)
+        created.append(server)
+        return server
+
+    yield make
+    for server in created:
+        server.close()
+
+
+def _content(response) -> str:
+    return response.choices[0].message.content
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def test_failover_to_next_provider(servers):
+    primary, backup = servers("primary"), servers("backup")
+    primary.status = 500
+    router = LlmRouter([primary.config(), backup.config()])
+
+    response = router.complete(messages=MESSAGES)
+    assert _content(response) == "backup"
+    assert response.served_model == "backup"
+    assert router.stats()["providers"]["primary"]["failures"] == 1
+
+    backup.status = 500
+    with pytest.raises(LlmUnavailableError):
+        router.complete(messages=MESSAGES)
+
+
+def test_async_failover_to_next_provider(servers):
+    primary, backup = servers("primary"), servers("backup")
+    primary.status = 503
+    router = LlmRouter([primary.config(), backup.config()])
+
+    async def run():
+        try:
+            return await router.acomplete(messages=MESSAGES)
+        finally:
+            await router.aclose()
+
+    assert _content(asyncio.run(run())) == "backup"
+
+
+def test_circuit_breaker_skips_failing_provider_until_cooldown(servers):
+    primary, backup = servers("primary"), servers("backup")
+    primary.status = 500
+    router = LlmRouter([primary.config(), backup.config()], failure_threshold=2, cooldown_seconds=0.5)
+    # 首选的延迟得分远好于次选：只有熔断才会让请求绕过它
+    router.providers[0].estimator.record_success(0.01)
+    router.providers[1].estimator.record_success(10.0)
+
+    for _ in range(2):
+        assert _content(router.complete(messages=MESSAGES)) == "backup"
+    assert router.stats()["providers"]["primary"]["healthy"] is False
+
+    # 熔断期间首选不再收到请求
+    primary.status = 200
+    assert _content(router.complete(messages=MESSAGES)) == "backup"
+    assert primary.requests == 2
+
+    # 冷却结束后半开：再次尝试，成功即恢复
+    time.sleep(0.6)
+    assert _content(router.complete(messages=MESSAGES)) == "primary"
+    assert router.stats()["providers"]["primary"]["healthy"] is True
+
+
+def test_hedge_returns_backup_when_primary_is_slower_than_its_p95(servers):
+    primary, backup = servers("primary"), servers("backup")
+    router = LlmRouter(
+        [primary.config(), backup.config()], hedge=True, hedge_min_delay=0.1, hedge_min_samples=1
+    )
+    # 先积累首选的延迟样本，并让次选的得分更差，保证首选排在前面
+    assert _content(router.complete(messages=MESSAGES)) == "primary"
+    router.providers[1].estimator.record_success(10.0)
+
+    primary.delay = 1.0
+    start = time.monotonic()
+    response = router.complete(messages=MESSAGES)
+    elapsed = time.monotonic() - start
+
+    assert _content(response) == "backup"
+    assert elapsed < 0.8
+    stats = router.stats()["providers"]["backup"]
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_async_hedge_cancels_the_losing_request(servers):
+    primary, backup = servers("primary"), servers("backup")
+    router = LlmRouter(
+        [primary.config(), backup.config()], hedge=True, hedge_min_delay=0.1, hedge_min_samples=1
+    )
+
+    async def run():
+        try:
+            await router.acomplete(messages=MESSAGES)
+            router.providers[1].estimator.record_success(10.0)
+            primary.delay = 1.0
+            start = time.monotonic()
+            response = await router.acomplete(messages=MESSAGES)
+            return response, time.monotonic() - start
+        finally:
+            await router.aclose()
+
+    response, elapsed = asyncio.run(run())
+    assert _content(response) == "backup"
+    assert elapsed < 0.8
+    assert router.providers[0].in_flight == 0
+
+
+def test_stream_closed_early_closes_upstream_connection(servers):
+    server = servers("primary")
+    server.stream_chunks = 200
+    server.stream_interval = 0.01
+    router = LlmRouter([server.config()])
+
+    stream = router.stream(messages=MESSAGES)
+    chunks = [next(stream) for _ in range(2)]
+    stream.close()
+
+    assert [chunk.choices[0].delta.content for chunk in chunks] == ["0", "1"]
+    assert chunks[0].served_model == "primary"
+    assert router.primary.in_flight == 0
+    assert server.disconnected.wait(2)
+    assert server.chunks_sent < server.stream_chunks
+
+
+def test_acquire_async_wakes_when_a_slot_is_released(servers):
+    server = servers("primary")
+    router = LlmRouter([server.config(max_concurrency=1)])
+    provider = router.primary
+
+    async def run():
+        provider.acquire(1)
+        threading.Timer(0.2, provider.release).start()
+        start = time.monotonic()
+        await provider.acquire_async(2)
+        waited = time.monotonic() - start
+        provider.release()
+        return waited
+
+    waited = asyncio.run(run())
+    assert 0.15 < waited < 0.5
+    assert provider.in_flight == 0
+
+
+def test_acquire_async_times_out_when_saturated(servers):
+    server = servers("primary")
+    router = LlmRouter([server.config(max_concurrency=1)])
+    provider = router.primary
+
+    async def run():
+        provider.acquire(1)
+        try:
+            with pytest.raises(ProviderBusyError):
+                await provider.acquire_async(0.1)
+        finally:
+            provider.release()
+
+    asyncio.run(run())
+    assert provider.stats["busy"] == 1
+    assert provider.in_flight == 0
+    assert not provider._async_waiters
+
+
+def test_concurrency_limit_holds_for_many_async_callers(servers):
+    server = servers("primary")
+    server.delay = 0.05
+    router = LlmRouter([server.config(max_concurrency=2)])
+
+    async def run():
+        try:
+            return await asyncio.gather(*(router.acomplete(messages=MESSAGES) for _ in range(8)))
+        finally:
+            await router.aclose()
+
+    responses = asyncio.run(run())
+    assert [_content(response) for response in responses] == ["primary"] * 8
+    assert server.max_active <= 2
+    assert router.primary.in_flight == 0
+
+
+def test_half_open_admits_a_single_probe(servers):
+    primary, backup = servers("primary"), servers("backup")
+    router = LlmRouter([primary.config(), backup.config()], failure_threshold=1, cooldown_seconds=0.2)
+    router.providers[0].estimator.record_failure()
+
+    assert [p.name for p in router.candidates()] == ["backup", "primary"]
+    time.sleep(0.3)
+    # 冷却结束后只有一个请求把首选当作正常候选，其余请求仍按熔断处理
+    assert router.candidates()[0].name == "primary"
+    assert [router.candidates()[0].name for _ in range(3)] == ["backup"] * 3
+
+    # 探测失败重新熔断；成功则恢复正常
+    router.providers[0].estimator.record_failure()
+    time.sleep(0.3)
+    assert _content(router.complete(messages=MESSAGES)) == "primary"
+    assert [router.candidates()[0].name for _ in range(3)] == ["primary"] * 3
+
+
+def test_stream_does_not_feed_the_latency_window(servers):
+    server = servers("primary")
+    server.stream_chunks = 3
+    server.stream_interval = 0.05
+    router = LlmRouter([server.config()])
+
+    assert len(list(router.stream(messages=MESSAGES))) == 3
+    stats = router.stats()["providers"]["primary"]
+    assert stats["calls"] == 1 and stats["p95_latency_ms"] is None
+    assert router.primary.estimator.samples() == 0
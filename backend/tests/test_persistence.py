@@ -0,0 +1,125 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.persistence import MemorySpoolStore, SqliteSpoolStore, WriteBehindQueue
+
+
+class FlakyWriter:
+    """writer 桩：整批中含坏行或上游不可用时抛错，记录每次调用写入的行。"""
+
+    def __init__(self, poison=(), down=False):
+        self.poison = set(poison)
+        self.down = down
+        self.calls = []
+        self.written = []
+
+    def __call__(self, rows):
+        self.calls.append([row["n"] for row in rows])
+        if self.down:
+            raise ConnectionError("supabase unreachable")
+        if any(row["n"] in self.poison for row in rows):
+            raise ValueError("violates check constraint")
+        self.written.extend(row["n"] for row in rows)
+
+
+def _queue(writer, store=None):
+    queue = WriteBehindQueue(store or MemorySpoolStore(), batch_size=10, retry_base_seconds=30)
+    queue.register("travel_plans", writer)
+    for n in range(5):
+        queue.enqueue("travel_plans", {"user_id": "u1", "n": n})
+    return queue
+
+
+def _entries(queue):
+    return queue.store._entries.values()
+
+
+@pytest.mark.parametrize("poison", [0, 2])
+def test_poison_row_only_delays_itself(poison):
+    writer = FlakyWriter(poison=[poison])
+    queue = _queue(writer)
+
+    assert queue.flush_once() == 5
+    assert sorted(writer.written) == [n for n in range(5) if n != poison]
+    [left] = _entries(queue)
+    assert left["row"]["n"] == poison
+    assert left["attempts"] == 1 and not left["dead"]
+    assert "check constraint" in left["last_error"]
+    assert queue.stats()["written"] == 4
+
+
+def test_outage_backs_off_the_whole_batch():
+    writer = FlakyWriter(down=True)
+    queue = _queue(writer)
+
+    assert queue.flush_once() == 5
+    entries = list(_entries(queue))
+    assert len(entries) == 5
+    assert all(entry["attempts"] == 1 and not entry["dead"] for entry in entries)
+    assert len({entry["next_attempt_at"] for entry in entries}) == 1
+    # 退避期间不会再取出
+    assert queue.flush_once() == 0
+
+    writer.down = False
+    for entry in entries:
+        entry["next_attempt_at"] = 0.0
+    assert queue.flush_once() == 5
+    assert writer.calls[-1] == [0, 1, 2, 3, 4]
+    assert queue.stats()["pending"] == 0
+
+
+def test_sqlite_store_leases_and_lists_pending_rows(tmp_path):
+    store = SqliteSpoolStore(str(tmp_path / "spool.sqlite3"))
+    first = store.append("travel_plans", {"user_id": "u1", "transcript": "杭州"})
+    second = store.append("travel_plans", {"user_id": "u1", "transcript": "苏州"})
+    store.append("travel_plans", {"user_id": "u2", "transcript": "南京"})
+    store.append("voice_texts", {"user_id": "u1", "text": "你好"})
+
+    claimed = store.claim(2, now=100.0, lease_seconds=60)
+    assert [entry.id for entry in claimed] == [first, second]
+    # 租约未过期的行不会被其他 worker 重复取出
+    assert [entry.row["user_id"] for entry in store.claim(10, now=110.0, lease_seconds=60)] == ["u2", "u1"]
+
+    store.bury([first], "bad row")
+    assert [entry.row["transcript"] for entry in store.pending("travel_plans", "u1", 10)] == ["苏州"]
+    assert store.counts() == {"pending": 3, "dead": 1}
+
+
+@pytest.fixture
+def history_with_pending(fake_supabase, monkeypatch):
+    queue = WriteBehindQueue(MemorySpoolStore())
+    monkeypatch.setattr(main, "persist_queue", queue)
+    monkeypatch.setattr(main, "_get_plan_schema_mode", lambda: "json")
+    written = {
+        "id": 7, "transcript": "上周去的苏州", "created_at": "2026-10-10T08:00:00+00:00",
+        "overview": {"destination": "苏州", "days": 2},
+    }
+    fake_supabase.on("travel_plans", lambda calls: [written])
+    return queue
+
+
+def test_history_shows_plans_still_in_the_write_queue(history_with_pending):
+    main._save_travel_plan("u1", "周末去杭州", "行程", {"overview": {"destination": "杭州", "days": 2}})
+    main._save_travel_plan("u2", "别人的行程", "行程", None)
+
+    items = TestClient(main.app).get("/history", params={"user_id": "u1"}).json()["items"]
+
+    assert [item["destination"] for item in items] == ["杭州", "苏州"]
+    assert items[0]["pending"] is True and items[0]["has_plan"] is False
+    assert items[1]["id"] == 7
+
+    # 后续页只来自上游，不重复合并队列中的行
+    cursor = main._encode_history_cursor({"created_at": "2026-10-11T00:00:00+00:00", "id": 9})
+    page = TestClient(main.app).get("/history", params={"user_id": "u1", "cursor": cursor}).json()
+    assert [item["id"] for item in page["items"]] == [7]
+
+
+def test_history_drops_pending_rows_already_written(history_with_pending):
+    history_with_pending.enqueue("travel_plans", {
+        "user_id": "u1", "transcript": "上周去的苏州", "created_at": "2026-10-10T08:00:00.000000Z",
+    })
+
+    items = TestClient(main.app).get("/history", params={"user_id": "u1"}).json()["items"]
+
+    assert [item["id"] for item in items] == [7]
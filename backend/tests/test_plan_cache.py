@@ -0,0 +1,42 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from backend import llm, main
+from backend.plan_cache import PlanCache, make_plan_cache_key
+
+PLAN = {"overview": {"destination": "杭州"}, "days": [{"day": 1, "items": []}]}
+
+
+def _response(model: str):
+    message = SimpleNamespace(content=json.dumps(PLAN, ensure_ascii=False))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None, served_model=model)
+
+
+@pytest.fixture
+def served_by(monkeypatch):
+    def configure(model: str):
+        monkeypatch.setattr(llm.llm_router, "complete", lambda **kwargs: _response(model))
+
+    monkeypatch.setattr(main, "enrich_plan_with_coordinates", lambda plan: plan)
+    monkeypatch.setattr(main, "plan_cache", PlanCache())
+    return configure
+
+
+def test_primary_model_plan_is_cached(served_by):
+    served_by(llm.DEEPSEEK_MODEL)
+    plan = main.generate_enriched_plan("周末去杭州玩")
+
+    assert plan["model"] == llm.DEEPSEEK_MODEL
+    key = make_plan_cache_key("周末去杭州玩", main.DEEPSEEK_MODEL, main.PLAN_PROMPT_VERSION)
+    assert main.plan_cache.get(key) is not None
+
+
+def test_failover_plan_is_not_cached_under_primary_key(served_by):
+    served_by("backup-model")
+    plan = main.generate_enriched_plan("周末去杭州玩")
+
+    assert plan["model"] == "backup-model"
+    key = make_plan_cache_key("周末去杭州玩", main.DEEPSEEK_MODEL, main.PLAN_PROMPT_VERSION)
+    assert main.plan_cache.get(key) is None
@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+import time
+
+from backend.plan_jobs import PlanJob, PlanJobManager, SqliteJobStore
+
+
+def _wait_for(predicate, timeout: float = 3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _can_resume(job_input: dict) -> bool:
+    return bool(job_input.get("user_input"))
+
+
+def test_resume_skips_jobs_held_by_a_live_worker(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    release = threading.Event()
+    runs = []
+
+    def slow_runner(job_input, audio_bytes, progress):
+        runs.append("a")
+        release.wait(5)
+        return {"ok": True}
+
+    def other_runner(job_input, audio_bytes, progress):
+        runs.append("b")
+        return {"ok": True}
+
+    worker_a = PlanJobManager(SqliteJobStore(db_path), slow_runner, lease_seconds=0.3, worker_id="a")
+    worker_b = PlanJobManager(SqliteJobStore(db_path), other_runner, lease_seconds=0.3, worker_id="b")
+    try:
+        job, _ = worker_a.submit({"user_input": "去杭州"})
+        assert _wait_for(lambda: worker_a.get(job.id).status == "running")
+        # 超过一个租约周期：a 一直在续租，b 不会接管
+        time.sleep(0.5)
+        assert worker_b.resume_unfinished(_can_resume) == 0
+        time.sleep(0.3)
+        assert worker_b.get(job.id).owner == "a"
+        release.set()
+        assert _wait_for(lambda: worker_a.get(job.id).status == "succeeded")
+        assert runs == ["a"]
+    finally:
+        release.set()
+        worker_a.shutdown()
+        worker_b.shutdown()
+
+
+def test_resume_takes_over_expired_leases(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    store = SqliteJobStore(db_path)
+    store.create(PlanJob(id="crashed", input={"user_input": "去杭州"}, status="running", owner="gone", lease_until=time.time() - 1))
+    store.create(PlanJob(id="voice", input={"audio": True}, status="running", owner="gone", lease_until=time.time() - 1))
+
+    worker = PlanJobManager(store, lambda job_input, audio, progress: {"ok": True}, lease_seconds=5, worker_id="b")
+    try:
+        assert worker.resume_unfinished(_can_resume) == 1
+        assert _wait_for(lambda: worker.get("crashed").status == "succeeded")
+        assert worker.get("crashed").owner == "b"
+        assert worker.get("voice").status == "failed"
+    finally:
+        worker.shutdown()
+
+
+def test_live_worker_takes_over_lease_that_expires_later(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    store = SqliteJobStore(db_path)
+    store.create(PlanJob(id="orphan", input={"user_input": "去杭州"}, status="running", owner="gone", lease_until=time.time() + 0.3))
+
+    worker = PlanJobManager(store, lambda job_input, audio, progress: {"ok": True}, lease_seconds=0.3, worker_id="b")
+    try:
+        assert worker.resume_unfinished(_can_resume) == 0
+        # 心跳线程在租约过期后接管
+        assert _wait_for(lambda: worker.get("orphan").status == "succeeded")
+    finally:
+        worker.shutdown()
+
+
+def test_concurrent_claims_have_one_winner(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    store = SqliteJobStore(db_path)
+    store.create(PlanJob(id="j", input={}, status="running", owner="gone", lease_until=0))
+    now = time.time()
+
+    assert SqliteJobStore(db_path).claim("j", "a", now + 60, now)
+    assert not SqliteJobStore(db_path).claim("j", "b", now + 60, now)
+    assert store.get("j").owner == "a"
+
+
+def test_old_schema_is_migrated_and_its_jobs_are_resumable(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE plan_jobs ("
+            "id TEXT PRIMARY KEY, idempotency_key TEXT UNIQUE, status TEXT NOT NULL, "
+            "stage TEXT NOT NULL, input TEXT NOT NULL, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "INSERT INTO plan_jobs VALUES ('old', NULL, 'running', 'generating', '{\"user_input\": \"x\"}', NULL, NULL, 0, 0)"
+        )
+
+    store = SqliteJobStore(db_path)
+    assert [job.id for job in store.list_unfinished(lease_expired_before=time.time())] == ["old"]
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.llm_router import LlmUnavailableError
+
+PLAN = {
+    "overview": {"destination": "杭州", "days": 2},
+    "days": [
+        {"day": 1, "title": "西湖", "items": [{"name": "断桥"}]},
+        {"day": 2, "title": "灵隐", "items": [{"name": "灵隐寺"}]},
+    ],
+}
+NEW_DAY = {"day": 1, "title": "室内", "items": [{"name": "浙江省博物馆"}]}
+
+
+def _call(calls, name):
+    return [args for method, args, _ in calls if method == name]
+
+
+@pytest.fixture
+def saved_plan(fake_supabase, monkeypatch):
+    """travel_plans 桩：select 返回当前行；update 只有在版本条件成立时才返回行。"""
+    state = {"plan": json.loads(json.dumps(PLAN)), "mode": "json", "updates": []}
+
+    def stored():
+        # 与真实的 Supabase 一样每次返回新对象，接口修改读到的行程不会影响“数据库”
+        text = json.dumps(state["plan"], ensure_ascii=False)
+        return json.loads(text) if state["mode"] == "json" else text
+
+    def travel_plans(calls):
+        if not _call(calls, "update"):
+            return [{"id": 1, "plan_structured": stored()}]
+        state["updates"].append(calls)
+        current = state["plan"].get("revision")
+        for column, value in _call(calls, "eq"):
+            if column == "plan_structured->>revision" and str(current) != value:
+                return []
+            if column == "plan_structured" and value != stored():
+                return []
+        if _call(calls, "is_") and current is not None:
+            return []
+        new = _call(calls, "update")[0][0]["plan_structured"]
+        state["plan"] = new if isinstance(new, dict) else json.loads(new)
+        return [{"id": 1}]
+
+    fake_supabase.on("travel_plans", travel_plans)
+    monkeypatch.setattr(main, "_get_plan_schema_mode", lambda: state["mode"])
+    monkeypatch.setattr(main, "enrich_plan_with_coordinates", lambda plan: plan)
+    monkeypatch.setattr(main, "regenerate_plan_day", lambda plan, day_index, instruction: dict(NEW_DAY))
+    return state
+
+
+def _regenerate(**overrides):
+    body = {"user_id": "u1", "instruction": "换成室内活动", "day_index": 0, **overrides}
+    return TestClient(main.app).post("/travel_plans/1/regenerate", json=body)
+
+
+def test_regenerate_bumps_revision_and_guards_the_update(saved_plan):
+    response = _regenerate()
+    assert response.status_code == 200
+    assert response.json()["revision"] == 1
+    assert saved_plan["plan"]["days"][0]["title"] == "室内"
+    assert _call(saved_plan["updates"][0], "is_") == [("plan_structured->>revision", "null")]
+
+    assert _regenerate(revision=1).status_code == 200
+    assert saved_plan["plan"]["revision"] == 2
+    assert ("plan_structured->>revision", "1") in _call(saved_plan["updates"][1], "eq")
+
+
+def test_concurrent_edit_returns_409_instead_of_overwriting(saved_plan, monkeypatch):
+    def racing_edit(plan, day_index, instruction):
+        # 生成期间另一个请求已经保存了新版本
+        saved_plan["plan"] = {**saved_plan["plan"], "revision": 1}
+        return dict(NEW_DAY)
+
+    monkeypatch.setattr(main, "regenerate_plan_day", racing_edit)
+    response = _regenerate()
+
+    assert response.status_code == 409
+    assert saved_plan["plan"]["days"][0]["title"] == "西湖"
+
+
+def test_stale_client_revision_is_rejected_before_calling_the_llm(saved_plan, monkeypatch):
+    saved_plan["plan"]["revision"] = 3
+
+    def unexpected(*args):
+        raise AssertionError("LLM should not be called")
+
+    monkeypatch.setattr(main, "regenerate_plan_day", unexpected)
+    assert _regenerate(revision=2).status_code == 409
+
+
+def test_text_schema_compares_the_stored_text(saved_plan):
+    saved_plan["mode"] = "text"
+    assert _regenerate().status_code == 200
+    assert saved_plan["plan"]["revision"] == 1
+    assert any(column == "plan_structured" for column, _ in _call(saved_plan["updates"][0], "eq"))
+
+
+@pytest.mark.parametrize(
+    "error, status",
+    [
+        (LlmUnavailableError("All LLM providers failed"), 503),
+        (ValueError("LLM returned non-JSON content"), 502),
+        (ConnectionError("connection reset"), 502),
+    ],
+)
+def test_llm_failures_map_to_upstream_status_codes(saved_plan, monkeypatch, error, status):
+    def failing(*args):
+        raise error
+
+    monkeypatch.setattr(main, "regenerate_plan_day", failing)
+    response = _regenerate()
+    assert response.status_code == status
+    assert saved_plan["updates"] == []
+
+
+def test_unknown_day_is_a_client_error(saved_plan):
+    assert _regenerate(day_index=5).status_code == 400
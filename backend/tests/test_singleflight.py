@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.singleflight import SingleFlight
+
+
+def test_sync_callers_share_one_execution():
+    group = SingleFlight("test_sync")
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return {"value": 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(group.do("k", slow))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert len(calls) == 1
+    assert results == [{"value": 1}] * 4
+    # 跟随者拿到的是副本，互不影响
+    assert len({id(result) for result in results}) == 4
+    assert group.stats()["in_flight"] == 0
+
+
+def test_async_caller_joins_sync_flight():
+    group = SingleFlight("test_sync_then_async")
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        calls.append("sync")
+        started.set()
+        release.wait(2)
+        return {"from": "sync"}
+
+    async def fallback():
+        calls.append("async")
+        return {"from": "async"}
+
+    leader_result = []
+    leader = threading.Thread(target=lambda: leader_result.append(group.do("k", slow)))
+    leader.start()
+    assert started.wait(2)
+
+    async def follow():
+        task = asyncio.ensure_future(group.ado("k", fallback))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.wait_for(task, 2)
+
+    assert asyncio.run(follow()) == {"from": "sync"}
+    leader.join(2)
+    assert leader_result == [{"from": "sync"}]
+    assert calls == ["sync"]
+    assert group.stats()["coalesced"] == 1
+
+
+def test_sync_caller_joins_async_flight():
+    group = SingleFlight("test_async_then_sync")
+    calls = []
+
+    async def slow():
+        calls.append("async")
+        await asyncio.sleep(0.2)
+        return {"from": "async"}
+
+    def fallback():
+        calls.append("sync")
+        return {"from": "sync"}
+
+    follower_result = []
+
+    async def lead():
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(group.ado("k", slow))
+        await asyncio.sleep(0.05)
+        follower = loop.run_in_executor(None, lambda: follower_result.append(group.do("k", fallback)))
+        result = await task
+        await follower
+        return result
+
+    assert asyncio.run(lead()) == {"from": "async"}
+    assert follower_result == [{"from": "async"}]
+    assert calls == ["async"]
+
+
+def test_errors_reach_every_waiter():
+    group = SingleFlight("test_errors")
+
+    async def failing():
+        await asyncio.sleep(0.05)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(
+            group.ado("k", failing), group.ado("k", failing), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert group.stats()["executions"] == 1
+
+
+def test_cancelled_leader_does_not_cancel_other_waiters():
+    group = SingleFlight("test_cancel")
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return "done"
+
+    async def run():
+        leader = asyncio.ensure_future(group.ado("k", slow))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(group.ado("k", slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "done"
+    assert group.stats()["executions"] == 1
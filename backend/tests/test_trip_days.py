@@ -0,0 +1,33 @@
+import pytest
+
+from backend.llm import estimate_trip_days
+
+
+@pytest.mark.parametrize(
+    "text, days",
+    [
+        ("我想3月12日去东京玩5天", 5),
+        ("五一去上海玩4天，25日返回", 4),
+        ("2025年10月1日出发，去云南玩十二天", 12),
+        ("12日至18日在北京，玩7天", 7),
+        ("第3天想去迪士尼，一共玩6天", 6),
+        ("成都五日游", 5),
+        ("去新疆玩十天九晚", 10),
+        ("欧洲两周", 14),
+        ("去日本住5晚", 6),
+        ("在杭州玩三日", 3),
+        ("黄山为期5日", 5),
+        ("三日两晚去厦门", 3),
+        ("20日出发去西藏", None),
+        ("3月12日去东京", None),
+        ("3月12日到18日去东京", None),
+        ("12日-18日去东京", None),
+        ("12日至18日去东京", None),
+        ("去东京玩到18日", None),
+        ("18日", None),
+        ("周末去杭州", None),
+        ("想去日本玩", None),
+    ],
+)
+def test_estimate_trip_days(text, days):
+    assert estimate_trip_days(text) == days
@@ -0,0 +1,129 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import main
+from backend.asr_pool import AsrPool, AsrSaturatedError
+
+
+class FakeSession:
+    """讯飞会话桩：收到 end_after 帧音频后像服务端那样结束会话，之后 send_audio 抛出 RuntimeError。"""
+
+    def __init__(self, on_partial=None, end_after=1, error=None):
+        self.on_partial = on_partial
+        self.end_after = end_after
+        self.error = error
+        self.frames = 0
+        self.finished = False
+
+    def start(self):
+        pass
+
+    def send_audio(self, pcm: bytes):
+        if self.finished:
+            raise RuntimeError(f"ASR session already finished: {self.error}")
+        self.frames += 1
+        self.on_partial(f"frame {self.frames}")
+        if self.frames >= self.end_after:
+            self.finished = True
+
+    def finish(self):
+        self.finished = True
+        if self.error:
+            raise Exception(f"ASR WS error: {self.error}")
+        return f"frame {self.frames}"
+
+    def close(self):
+        self.finished = True
+
+
+@pytest.fixture
+def live_session(monkeypatch):
+    sessions = []
+
+    def install(**options):
+        def factory(on_partial=None):
+            session = FakeSession(on_partial, **options)
+            sessions.append(session)
+            return session
+
+        monkeypatch.setattr(main, "XfStreamingSession", factory)
+        return sessions
+
+    return install
+
+
+def _receive_until_closed(ws) -> list:
+    messages = []
+    while True:
+        message = ws.receive()
+        if message["type"] == "websocket.close":
+            return messages
+        messages.append(main.json.loads(message["text"]))
+
+
+def test_session_ended_by_server_still_sends_final(live_session):
+    sessions = live_session(end_after=1)
+    with TestClient(main.app).websocket_connect("/ws/asr") as ws:
+        ws.send_bytes(b"\x00" * 1280)
+        ws.send_bytes(b"\x00" * 1280)
+        messages = _receive_until_closed(ws)
+
+    assert messages[-1] == {"type": "final", "text": "frame 1"}
+    assert sessions[0].frames == 1
+
+
+def test_send_after_server_error_reports_error(live_session, monkeypatch):
+    live_session(end_after=1, error={"code": 10165})
+
+    def send_audio(self, pcm):
+        raise RuntimeError("ASR session already finished")
+
+    monkeypatch.setattr(FakeSession, "send_audio", send_audio)
+    with TestClient(main.app).websocket_connect("/ws/asr") as ws:
+        ws.send_bytes(b"\x00" * 1280)
+        messages = _receive_until_closed(ws)
+
+    assert messages[-1]["type"] == "error"
+    assert "10165" in messages[-1]["detail"]
+
+
+def test_end_message_returns_final(live_session):
+    live_session(end_after=100)
+    with TestClient(main.app).websocket_connect("/ws/asr") as ws:
+        ws.send_bytes(b"\x00" * 1280)
+        ws.send_json({"type": "end"})
+        messages = _receive_until_closed(ws)
+
+    assert messages == [{"type": "partial", "text": "frame 1"}, {"type": "final", "text": "frame 1"}]
+
+
+def test_live_session_rejected_when_asr_connections_are_busy(live_session, monkeypatch):
+    sessions = live_session(end_after=100)
+    pool = AsrPool(workers=1, queue_size=1)
+    monkeypatch.setattr(main, "asr_pool", pool)
+
+    with pool.live_session():
+        with TestClient(main.app).websocket_connect("/ws/asr") as ws:
+            messages = _receive_until_closed(ws)
+
+    assert messages == [{"type": "error", "detail": "语音识别繁忙，请稍后重试", "status": 503, "retry_after": 5}]
+    assert sessions == []
+    assert pool.stats()["rejected"] == 1
+
+
+def test_live_session_holds_a_connection_slot(live_session, monkeypatch):
+    live_session(end_after=100)
+    pool = AsrPool(workers=1, queue_size=1)
+    monkeypatch.setattr(main, "asr_pool", pool)
+
+    with TestClient(main.app).websocket_connect("/ws/asr") as ws:
+        ws.send_bytes(b"\x00" * 1280)
+        assert ws.receive_json() == {"type": "partial", "text": "frame 1"}
+        assert pool.stats()["live_sessions"] == 1
+        with pytest.raises(AsrSaturatedError):
+            with pool.live_session():
+                pass
+        ws.send_json({"type": "end"})
+        _receive_until_closed(ws)
+
+    assert pool.stats()["live_sessions"] == 0
@@ -11,9 +11,12 @@ from datetime import datetime
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-import io
-import wave
-from array import array
+import math
+import struct
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Optional
+import numpy as np
 
 # 明确从 backend/.env 读取
 load_dotenv(dotenv_path=str(Path(__file__).with_name('.env')))
@@ -42,205 +45,458 @@ def create_url():
     params = {"host": host, "date": date, "authorization": authorization}
     return url + "?" + urlencode(params)
 
-def _wav_to_mono16k_pcm(audio_bytes: bytes) -> bytes:
-    """将任意 WAV 字节流转换为 单声道/16kHz/16-bit PCM 原始帧（小端）"""
-    with wave.open(io.BytesIO(audio_bytes), 'rb') as wav:
-        nch = wav.getnchannels()
-        sampwidth = wav.getsampwidth()
-        sr = wav.getframerate()
-        nframes = wav.getnframes()
-        frames = wav.readframes(nframes)
-
-    # 仅支持 16-bit 输入，其他位深可扩展
-    if sampwidth != 2:
-        raise ValueError(f"Unsupported sample width: {sampwidth * 8} bits; expected 16-bit PCM")
-
-    # 转为 int16 数组
-    samples = array('h')
-    samples.frombytes(frames)
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+TARGET_SAMPLE_RATE = 16000
+# 重采样低通滤波器每侧的过零点数，越大过渡带越陡、计算量越大
+RESAMPLE_ZERO_CROSSINGS = 10
+RESAMPLE_KAISER_BETA = 5.0
 
-    # 下混为单声道
-    if nch == 2:
-        left = samples[0::2]
-        right = samples[1::2]
-        mono = array('h', ((l + r) // 2 for l, r in zip(left, right)))
-    elif nch == 1:
-        mono = samples
-    else:
-        raise ValueError(f"Unsupported channels: {nch}")
 
-    # 采样率转换到 16000（简单线性插值）
-    target_sr = 16000
-    if sr == target_sr:
-        out = mono
-    else:
-        ratio = target_sr / sr
-        new_len = int(len(mono) * ratio)
-        if new_len <= 0:
-            return b""
-        out = array('h')
-        for i in range(new_len):
-            # 源位置
-            src_pos = i / ratio
-            j = int(src_pos)
-            if j + 1 < len(mono):
-                frac = src_pos - j
-                val = int(mono[j] * (1 - frac) + mono[j + 1] * frac)
-            else:
-                val = int(mono[-1])
-            # 裁剪到 int16
-            if val > 32767:
-                val = 32767
-            if val < -32768:
-                val = -32768
-            out.append(val)
-
-    return out.tobytes()
-
-
-def transcribe_audio_bytes(audio_bytes: bytes) -> str:
-    # 使用基于 sn 的聚合，严格按讯飞 wpgs 规则替换，避免首字重复
-    result_by_sn: dict[int, str] = {}
-    error_holder = {"error": None}
-    finished = threading.Event()
-    # 将前端上传的 WAV 转原始 PCM（16k 单声道 16-bit）
-    pcm_bytes = _wav_to_mono16k_pcm(audio_bytes)
+def _read_wav(audio_bytes: bytes) -> tuple[int, int, int, int, bytes]:
+    """解析 RIFF/WAVE 头，返回 (格式码, 声道数, 采样率, 位深, data 块字节)。
+
+    标准库 wave 只支持整数 PCM，这里手动解析以支持 IEEE float 与 WAVE_FORMAT_EXTENSIBLE。
+    """
+    if len(audio_bytes) < 12 or audio_bytes[:4] != b"RIFF" or audio_bytes[8:12] != b"WAVE":
+        raise ValueError("Unsupported audio: expected a RIFF/WAVE file")
+    fmt = None
+    data = None
+    pos = 12
+    total = len(audio_bytes)
+    while pos + 8 <= total:
+        chunk_id = audio_bytes[pos:pos + 4]
+        (chunk_size,) = struct.unpack("<I", audio_bytes[pos + 4:pos + 8])
+        body_start = pos + 8
+        # 浏览器流式录音可能写入占位长度（0 或 0xFFFFFFFF），以实际剩余字节为准
+        body_end = min(body_start + chunk_size, total)
+        if chunk_id == b"data" and chunk_size in (0, 0xFFFFFFFF):
+            body_end = total
+        body = audio_bytes[body_start:body_end]
+        if chunk_id == b"fmt ":
+            if len(body) < 16:
+                raise ValueError("Invalid WAV fmt chunk")
+            format_tag, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                # 子格式 GUID 的前两个字节即实际格式码
+                (format_tag,) = struct.unpack("<H", body[24:26])
+            fmt = (format_tag, channels, sample_rate, bits)
+        elif chunk_id == b"data":
+            data = body
+            if fmt is not None:
+                break
+        pos = body_start + chunk_size + (chunk_size & 1)
+    if fmt is None or data is None:
+        raise ValueError("Invalid WAV: missing fmt or data chunk")
+    return (*fmt, data)
+
 
-    def on_message(ws, message):
-        data = json.loads(message)
-        code = data.get("code")
-        if code == 0:
-            data_field = data.get("data", {})
-            status_field = data_field.get("status")  # 0/1 增量，2 结束
-            res = data_field.get("result")
-            if res and "ws" in res:
-                # 本次片段文本
-                piece = "".join(ws_item["cw"][0]["w"] for ws_item in res["ws"])
-                sn = res.get("sn")  # 序号（从 0 递增）
-                pgs = res.get("pgs")  # 'apd' 或 'rpl' 或 None
-                rg = res.get("rg")   # [start, end] 当 pgs == 'rpl'
-
-                # 替换模式：清理区间并写入当前 sn 的文本
-                if pgs == "rpl" and isinstance(rg, list) and len(rg) == 2:
-                    start, end = int(rg[0]), int(rg[1])
-                    if end < start:
-                        end = start
-                    for k in range(start, end + 1):
-                        if k in result_by_sn:
-                            del result_by_sn[k]
-                    if isinstance(sn, int):
-                        result_by_sn[sn] = piece
-                else:
-                    # 追加模式：直接覆盖/写入当前 sn
-                    if isinstance(sn, int):
-                        result_by_sn[sn] = piece
-
-            # 最终包：结束等待
-            if status_field == 2:
-                finished.set()
+def _decode_samples(data: bytes, format_tag: int, channels: int, bits: int) -> np.ndarray:
+    """按位深解码为 (帧数, 声道数) 的 float64 数组，幅值归一化到 [-1, 1]。"""
+    if channels <= 0:
+        raise ValueError(f"Unsupported channels: {channels}")
+    frame_bytes = channels * (bits // 8)
+    if frame_bytes <= 0:
+        raise ValueError(f"Unsupported sample width: {bits} bits")
+    data = data[:len(data) - len(data) % frame_bytes]
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if bits == 32:
+            samples = np.frombuffer(data, dtype="<f4").astype(np.float64)
+        elif bits == 64:
+            samples = np.frombuffer(data, dtype="<f8").copy()
         else:
-            error_holder["error"] = data
-
-    def on_error(ws, error):
-        error_holder["error"] = {"ws_error": str(error)}
-        finished.set()
-
-    def on_close(ws, close_status_code, close_msg):
-        finished.set()
-
-    def on_open(ws):
-        def sender():
-            # 分片：640 字节 ≈ 20ms（16kHz * 16bit * 1ch）
-            chunk_size = 640
-            total = len(pcm_bytes)
-            sent = 0
-            # 首帧（包含业务参数，建议增加 vad_eos）
-            first_chunk = pcm_bytes[:chunk_size]
-            frame0 = {
-                "common": {"app_id": APPID},
-                "business": {
-                    "language": "zh_cn",
-                    "domain": "iat",
-                    "accent": "mandarin",
-                    "vad_eos": 2000,
-                    "ptt": 1,
-                    "dwa": "wpgs"
-                },
-                "data": {
-                    "status": 0,
-                    "format": "audio/L16;rate=16000",
-                    "encoding": "raw",
-                    "audio": base64.b64encode(first_chunk).decode("utf-8"),
-                },
-            }
-            ws.send(json.dumps(frame0))
-            sent += len(first_chunk)
-            time.sleep(0.02)
-
-            # 中间帧
-            while sent + chunk_size < total:
-                chunk = pcm_bytes[sent:sent + chunk_size]
-                frame = {
-                    "data": {
-                        "status": 1,
-                        "format": "audio/L16;rate=16000",
-                        "encoding": "raw",
-                        "audio": base64.b64encode(chunk).decode("utf-8"),
-                    }
-                }
-                ws.send(json.dumps(frame))
-                sent += len(chunk)
-                time.sleep(0.02)
-
-            # 尾帧（可能还有余量一起发完）
-            if sent < total:
-                last_chunk = pcm_bytes[sent:]
-                frame_last = {
-                    "data": {
-                        "status": 2,
-                        "format": "audio/L16;rate=16000",
-                        "encoding": "raw",
-                        "audio": base64.b64encode(last_chunk).decode("utf-8"),
-                    }
-                }
-                ws.send(json.dumps(frame_last))
-            else:
-                ws.send(json.dumps({"data": {"status": 2}}))
-
-        threading.Thread(target=sender, daemon=True).start()
-
-    url = create_url()
-    ws = websocket.WebSocketApp(
-        url,
-        on_open=on_open,
-        on_message=on_message,
-        on_error=on_error,
-        on_close=on_close,
-    )
-    # 运行并等待完成或超时（例如 15 秒）
-    t = threading.Thread(target=lambda: ws.run_forever(ping_interval=8, ping_timeout=4))
-    t.daemon = True
-    t.start()
-    finished.wait(timeout=60)
-    try:
-        ws.close()
-    except Exception:
-        pass
-
-    # 按 sn 排序合并，避免重复与错位
-    if result_by_sn:
-        ordered = [result_by_sn[k] for k in sorted(result_by_sn.keys())]
-        final_text = "".join(ordered)
+            raise ValueError(f"Unsupported float sample width: {bits} bits")
+    elif format_tag == WAVE_FORMAT_PCM:
+        if bits == 8:
+            # 8-bit WAV 为无符号整数，128 为零点
+            samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float64) - 128.0) / 128.0
+        elif bits == 16:
+            samples = np.frombuffer(data, dtype="<i2") / 32768.0
+        elif bits == 24:
+            raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+            values = np.where(values & 0x800000, values - 0x1000000, values)
+            samples = values / 8388608.0
+        elif bits == 32:
+            samples = np.frombuffer(data, dtype="<i4") / 2147483648.0
+        else:
+            raise ValueError(f"Unsupported sample width: {bits} bits")
     else:
-        final_text = ""
-    if error_holder["error"] or not final_text:
-        # 简单重试一次
-        if not getattr(transcribe_audio_bytes, "_retried", False):
-            setattr(transcribe_audio_bytes, "_retried", True)
+        raise ValueError(f"Unsupported WAV format tag: {format_tag:#06x}")
+    return samples.reshape(-1, channels)
+
+
+@lru_cache(maxsize=16)
+def _polyphase_filter(up: int, down: int) -> tuple[np.ndarray, int]:
+    """设计 Kaiser 窗 sinc 低通滤波器并拆成多相矩阵 H[phase, tap]，返回 (H, 群延迟)。"""
+    max_rate = max(up, down)
+    half_len = RESAMPLE_ZERO_CROSSINGS * max_rate
+    n = np.arange(-half_len, half_len + 1)
+    # 截止频率取输入/输出奈奎斯特频率中较低者，避免下采样混叠与上采样镜像
+    h = np.sinc(n / max_rate) / max_rate
+    h *= np.kaiser(len(h), RESAMPLE_KAISER_BETA) * up
+    taps = -(-len(h) // up)
+    h = np.concatenate([h, np.zeros(taps * up - len(h))])
+    return h.reshape(taps, up).T.copy(), half_len
+
+
+def _resample_poly(x: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """多相重采样：等价于插零上采样 up 倍、低通滤波后每 down 个取一个，但只计算保留的输出点。
+
+    输出序号 n = q * up + r 时，所用相位只取决于 r，对应的输入窗口起点每次前进 down，
+    因此每个 r 都是一次跨步滑窗与固定滤波器的矩阵-向量乘法，交给 BLAS 完成。
+    """
+    divisor = math.gcd(src_rate, dst_rate)
+    up, down = dst_rate // divisor, src_rate // divisor
+    if up == down or len(x) == 0:
+        return x
+    H, delay = _polyphase_filter(up, down)
+    taps = H.shape[1]
+    n_out = -(-len(x) * up // down)
+    padded = np.concatenate([np.zeros(taps), x, np.zeros(taps + delay // up + 1)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, taps)
+    out = np.empty(n_out)
+    for r in range(min(up, n_out)):
+        count = len(range(r, n_out, up))
+        position = r * down + delay
+        # 窗口 [base - taps + 1, base] 与翻转后的相位滤波器做点积
+        start = position // up + 1
+        out[r::up] = windows[start:start + down * count:down] @ H[position % up, ::-1]
+    return out
+
+
+def _wav_to_mono16k_pcm(audio_bytes: bytes) -> bytes:
+    """将任意 WAV 字节流转换为 单声道/16kHz/16-bit PCM 原始帧（小端）
+
+    支持 8/16/24/32-bit 整数与 32/64-bit 浮点输入，任意声道数，任意采样率。
+    """
+    format_tag, channels, sample_rate, bits, data = _read_wav(audio_bytes)
+    if sample_rate <= 0:
+        raise ValueError(f"Unsupported sample rate: {sample_rate}")
+    samples = _decode_samples(data, format_tag, channels, bits)
+    # 下混为单声道
+    mono = samples.mean(axis=1) if channels > 1 else samples[:, 0]
+    out = _resample_poly(mono, sample_rate, TARGET_SAMPLE_RATE)
+    # 裁剪到 int16
+    pcm = np.clip(np.rint(out * 32768.0), -32768, 32767).astype("<i2")
+    return pcm.tobytes()
+
+
+# 16kHz * 16bit * 1ch
+PCM_BYTES_PER_SECOND = TARGET_SAMPLE_RATE * 2
+# 讯飞建议单帧 1280 字节（40ms）；放大帧长可减少帧数，但单帧不超过 8192 字节
+MAX_FRAME_SIZE = 8192
+SEND_MODES = ("realtime", "adaptive", "burst")
+
+_BUSINESS_PARAMS = {
+    "language": "zh_cn",
+    "domain": "iat",
+    "accent": "mandarin",
+    "vad_eos": 2000,
+    "ptt": 1,
+    "dwa": "wpgs"
+}
+
+
+@dataclass(frozen=True)
+class SendStrategy:
+    """音频上传策略。
+
+    - realtime：按音频时长节奏发送（原行为），耗时 ≈ 音频时长
+    - adaptive：尽快发送，ws.send 的背压自然限速，同时不超过 max_speedup 倍实时速度
+    - burst：不做任何节流，仅适合调试或内网代理
+    """
+    frame_size: int = 1280
+    mode: str = "adaptive"
+    max_speedup: float = 8.0
+
+    def __post_init__(self):
+        if self.mode not in SEND_MODES:
+            raise ValueError(f"Unsupported ASR send mode: {self.mode}")
+        # 对齐到 16-bit 采样边界
+        frame_size = max(2, min(self.frame_size, MAX_FRAME_SIZE)) // 2 * 2
+        object.__setattr__(self, "frame_size", frame_size)
+
+    @classmethod
+    def from_env(cls) -> "SendStrategy":
+        return cls(
+            frame_size=int(os.getenv("XF_ASR_FRAME_SIZE", "1280")),
+            mode=os.getenv("XF_ASR_SEND_MODE", "adaptive"),
+            max_speedup=float(os.getenv("XF_ASR_MAX_SPEEDUP", "8")),
+        )
+
+    def pace_seconds_per_byte(self) -> float:
+        if self.mode == "realtime":
+            return 1.0 / PCM_BYTES_PER_SECOND
+        if self.mode == "adaptive" and self.max_speedup > 0:
+            return 1.0 / (PCM_BYTES_PER_SECOND * self.max_speedup)
+        return 0.0
+
+
+def _frame_template(status: int, first: bool = False, business: Optional[dict] = None) -> tuple[str, str]:
+    """预先序列化帧 JSON，发送时只需拼接 base64 音频，避免每帧构造 dict 与 json.dumps。"""
+    frame = {
+        "data": {
+            "status": status,
+            "format": "audio/L16;rate=16000",
+            "encoding": "raw",
+            "audio": "\x00",
+        }
+    }
+    if first:
+        frame = {"common": {"app_id": APPID}, "business": business or _BUSINESS_PARAMS, **frame}
+    prefix, suffix = json.dumps(frame).split('"\\u0000"')
+    return prefix + '"', '"' + suffix
+
+
+_FIRST_FRAME = _frame_template(0, first=True)
+_MIDDLE_FRAME = _frame_template(1)
+_LAST_FRAME = _frame_template(2)
+_END_FRAME = json.dumps({"data": {"status": 2}})
+# 边说边传时允许更长的停顿（讯飞 vad_eos 上限 10000ms），避免用户思考时会话被提前结束
+_LIVE_FIRST_FRAME = _frame_template(
+    0,
+    first=True,
+    business={**_BUSINESS_PARAMS, "vad_eos": int(os.getenv("XF_ASR_LIVE_VAD_EOS", "5000"))},
+)
+
+
+class AsrCancelledError(Exception):
+    pass
+
+
+def send_pcm_frames(
+    ws,
+    pcm_bytes: bytes,
+    strategy: SendStrategy,
+    first_frame: tuple[str, str] = _FIRST_FRAME,
+    cancel_event: Optional[threading.Event] = None,
+) -> None:
+    """按策略把 PCM 分帧发送给讯飞：首帧携带业务参数，尾帧 status=2。"""
+    view = memoryview(pcm_bytes)
+    total = len(view)
+    chunk_size = strategy.frame_size
+    pace = strategy.pace_seconds_per_byte()
+    started = time.monotonic()
+    sent = 0
+    template = first_frame
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise AsrCancelledError("ASR job cancelled")
+        end = min(sent + chunk_size, total)
+        is_last = end >= total
+        if is_last and template is not first_frame:
+            template = _LAST_FRAME
+        prefix, suffix = template
+        ws.send(prefix + base64.b64encode(view[sent:end]).decode("ascii") + suffix)
+        sent = end
+        if is_last:
+            break
+        template = _MIDDLE_FRAME
+        if pace:
+            # 按已发送的音频时长计算目标时间点，只在超前时休眠
+            delay = started + sent * pace - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    if _LAST_FRAME is not template:
+        # 音频只够一帧（首帧）时，单独补发结束帧
+        ws.send(_END_FRAME)
+
+
+class WpgsMerger:
+    """按讯飞 wpgs（动态修正）规则聚合识别片段：以 sn 为序号，rpl 时替换 rg 区间。"""
+
+    def __init__(self):
+        self.result_by_sn: dict[int, str] = {}
+
+    def apply(self, res: Optional[dict]) -> bool:
+        """合并一条 result，返回文本是否有变化。"""
+        if not res or "ws" not in res:
+            return False
+        # 本次片段文本
+        piece = "".join(ws_item["cw"][0]["w"] for ws_item in res["ws"])
+        sn = res.get("sn")  # 序号（从 0 递增）
+        pgs = res.get("pgs")  # 'apd' 或 'rpl' 或 None
+        rg = res.get("rg")   # [start, end] 当 pgs == 'rpl'
+
+        # 替换模式：清理区间并写入当前 sn 的文本
+        if pgs == "rpl" and isinstance(rg, list) and len(rg) == 2:
+            start, end = int(rg[0]), int(rg[1])
+            if end < start:
+                end = start
+            for k in range(start, end + 1):
+                if k in self.result_by_sn:
+                    del self.result_by_sn[k]
+        # 追加模式：直接覆盖/写入当前 sn
+        if isinstance(sn, int):
+            self.result_by_sn[sn] = piece
+            return True
+        return False
+
+    def text(self) -> str:
+        return "".join(self.result_by_sn[k] for k in sorted(self.result_by_sn))
+
+
+class XfStreamingSession:
+    """边录边传的讯飞会话。
+
+    调用方持续写入 16kHz 单声道 16-bit PCM（send_audio），收到的 wpgs 片段合并后
+    通过 on_partial 回调实时推送；finish() 发送尾帧并返回最终文本。
+    on_partial 在接收线程中调用，不能阻塞。
+    """
+
+    def __init__(
+        self,
+        on_partial: Optional[Callable[[str], None]] = None,
+        frame_size: int = 1280,
+        live: bool = True,
+    ):
+        self.on_partial = on_partial
+        self.frame_size = SendStrategy(frame_size=frame_size).frame_size
+        self.merger = WpgsMerger()
+        self.error = None
+        self._first_frame = _LIVE_FIRST_FRAME if live else _FIRST_FRAME
+        self._ws = None
+        self._pending = bytearray()
+        self._first_sent = False
+        self._end_sent = False
+        self._finished = threading.Event()
+        self._receiver = None
+
+    def start(self, connect_timeout: float = 10) -> None:
+        self._ws = websocket.create_connection(create_url(), timeout=connect_timeout)
+        # 说话停顿期间可能长时间没有下行消息，接收阻塞由 close() 打断
+        self._ws.settimeout(None)
+        self._receiver = threading.Thread(target=self._receive_loop, daemon=True)
+        self._receiver.start()
+
+    @property
+    def finished(self) -> bool:
+        """讯飞已返回最终结果、出错或连接关闭。"""
+        return self._finished.is_set()
+
+    def send_audio(self, pcm: bytes) -> None:
+        if self._finished.is_set():
+            raise RuntimeError(f"ASR session already finished: {self.error}")
+        self._pending.extend(pcm)
+        while len(self._pending) >= self.frame_size:
+            self._send_frame(bytes(self._pending[:self.frame_size]))
+            del self._pending[:self.frame_size]
+
+    def send_recorded(
+        self,
+        pcm: bytes,
+        strategy: SendStrategy,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> None:
+        """一次性发送整段已录制的音频（含尾帧），节奏由 strategy 控制。"""
+        send_pcm_frames(self._ws, pcm, strategy, first_frame=self._first_frame, cancel_event=cancel_event)
+        self._first_sent = True
+        self._end_sent = True
+
+    def finish(self, timeout: float = 15) -> str:
+        if not self._finished.is_set():
+            if not self._end_sent:
+                if self._pending or not self._first_sent:
+                    self._send_frame(bytes(self._pending))
+                    self._pending.clear()
+                self._ws.send(_END_FRAME)
+                self._end_sent = True
+            self._finished.wait(timeout=timeout)
+        self.close()
+        if self.error:
+            raise Exception(f"ASR WS error: {self.error}")
+        return self.merger.text()
+
+    def close(self) -> None:
+        self._finished.set()
+        if self._ws is not None:
             try:
-                return transcribe_audio_bytes(audio_bytes)
-            finally:
-                setattr(transcribe_audio_bytes, "_retried", False)
-        if error_holder["error"]:
-            raise Exception(f"ASR WS error: {error_holder['error']}")
-    return final_text
\ No newline at end of file
+                self._ws.close()
+            except Exception:
+                pass
+
+    def _send_frame(self, chunk: bytes) -> None:
+        prefix, suffix = _MIDDLE_FRAME if self._first_sent else self._first_frame
+        self._ws.send(prefix + base64.b64encode(chunk).decode("ascii") + suffix)
+        self._first_sent = True
+
+    def _receive_loop(self) -> None:
+        try:
+            while not self._finished.is_set():
+                message = self._ws.recv()
+                if not message:
+                    break
+                data = json.loads(message)
+                if data.get("code") != 0:
+                    self.error = data
+                    break
+                data_field = data.get("data", {})
+                if self.merger.apply(data_field.get("result")) and self.on_partial:
+                    self.on_partial(self.merger.text())
+                if data_field.get("status") == 2:
+                    break
+        except Exception as exc:
+            if not self._finished.is_set():
+                self.error = {"ws_error": str(exc)}
+        finally:
+            self._finished.set()
+
+
+def _transcribe_pcm_once(
+    pcm_bytes: bytes,
+    strategy: SendStrategy,
+    deadline: float,
+    cancel_event: Optional[threading.Event] = None,
+    on_session: Optional[Callable[[XfStreamingSession], None]] = None,
+) -> str:
+    session = XfStreamingSession(frame_size=strategy.frame_size, live=False)
+    if on_session:
+        # 供调用方在取消时直接关闭连接，打断等待
+        on_session(session)
+    try:
+        session.start()
+        session.send_recorded(pcm_bytes, strategy, cancel_event=cancel_event)
+        return session.finish(timeout=max(0.0, deadline - time.monotonic()))
+    finally:
+        session.close()
+        if cancel_event is not None and cancel_event.is_set():
+            raise AsrCancelledError("ASR job cancelled")
+
+
+def transcribe_audio_bytes(
+    audio_bytes: bytes,
+    strategy: Optional[SendStrategy] = None,
+    timeout: float = 60,
+    retries: int = 1,
+    cancel_event: Optional[threading.Event] = None,
+    on_session: Optional[Callable[[XfStreamingSession], None]] = None,
+) -> str:
+    """识别整段 WAV 音频。每次调用的状态（重试次数、结果）都是局部的，可安全并发。
+
+    出错或结果为空时重试 retries 次；整体不超过 timeout 秒，超时返回已识别的部分文本。
+    cancel_event 置位后尽快中止并抛出 AsrCancelledError。
+    """
+    # 将前端上传的 WAV 转原始 PCM（16k 单声道 16-bit）
+    pcm_bytes = _wav_to_mono16k_pcm(audio_bytes)
+    strategy = strategy or SendStrategy.from_env()
+    deadline = time.monotonic() + timeout
+    final_text = ""
+    last_error = None
+    for _ in range(retries + 1):
+        if time.monotonic() >= deadline:
+            break
+        try:
+            final_text = _transcribe_pcm_once(pcm_bytes, strategy, deadline, cancel_event, on_session)
+            last_error = None
+        except AsrCancelledError:
+            raise
+        except Exception as exc:
+            last_error = exc
+            continue
+        if final_text:
+            return final_text
+    if last_error:
+        raise last_error
+    return final_text
@@ -130,6 +130,8 @@ function App() {
   const [transcript, setTranscript] = useState('');
   const [user, setUser] = useState(null);
   const [history, setHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null); // 下一页历史的游标
+  const [loadingPlanId, setLoadingPlanId] = useState(null);
   const [selectedPlan, setSelectedPlan] = useState(null); // 当前选中的历史行程
   const [isGeneratingPlan, setIsGeneratingPlan] = useState(false); // 是否正在生成行程
   const [currentPlanData, setCurrentPlanData] = useState(null); // 当前生成的结构化行程
@@ -143,6 +145,7 @@ function App() {
 
   const mediaRecorderRef = useRef(null);
   const audioChunksRef = useRef([]);
+  const historyRefreshRef = useRef(null); // 历史中仍有待写入条目时的延迟刷新
 
   // ========== 录音逻辑 ==========
   const startRecording = async () => {
@@ -271,31 +274,49 @@ function App() {
     }
   };
 
-  const fetchHistory = async (userId) => {
+  const fetchHistory = async (userId, cursor = null, pendingRetries = 0) => {
     try {
-      const res = await fetch(`http://localhost:8000/history?user_id=${encodeURIComponent(userId)}`);
+      const params = new URLSearchParams({ user_id: userId });
+      if (cursor) params.set('cursor', cursor);
+      const res = await fetch(`http://localhost:8000/history?${params.toString()}`);
       const data = await res.json();
       if (Array.isArray(data.items)) {
-        const normalized = data.items.map((item) => {
-          let structured = item.plan_structured;
-          if (structured && typeof structured === 'string') {
-            try {
-              structured = JSON.parse(structured);
-            } catch {
-              structured = null;
-            }
+        // 列表只含摘要，完整行程在点击时通过 /travel_plans/{id} 获取
+        setHistory((prev) => (cursor ? [...prev, ...data.items] : data.items));
+        setHistoryCursor(data.next_cursor || null);
+        // 刚生成的行程还在后台写入队列中（pending），稍后重新拉取第一页以拿到可查看的记录
+        if (!cursor) {
+          clearTimeout(historyRefreshRef.current);
+          if (data.items.some((item) => item.pending) && pendingRetries < 5) {
+            historyRefreshRef.current = setTimeout(() => fetchHistory(userId, null, pendingRetries + 1), 2000);
           }
-          return { ...item, plan_structured: structured };
-        });
-        setHistory(normalized);
-      } else {
+        }
+      } else if (!cursor) {
         setHistory([]);
+        setHistoryCursor(null);
       }
     } catch (e) {
       // 忽略历史加载错误
     }
   };
 
+  const fetchPlanDetail = async (planId) => {
+    const res = await fetch(`http://localhost:8000/travel_plans/${encodeURIComponent(planId)}?user_id=${encodeURIComponent(user.id)}`);
+    if (!res.ok) {
+      throw new Error(`HTTP error! status: ${res.status}`);
+    }
+    const data = await res.json();
+    let structured = data.plan_structured;
+    if (structured && typeof structured === 'string') {
+      try {
+        structured = JSON.parse(structured);
+      } catch {
+        structured = null;
+      }
+    }
+    return { ...data, plan_structured: structured };
+  };
+
   const deletePlan = async (planId) => {
     if (!user?.id) return;
     const confirmDelete = window.confirm('确认删除该行程吗？删除后不可恢复。');
@@ -405,8 +426,8 @@ function App() {
     }
   };
 
-  const handleSelectHistoryItem = (item) => {
-    if (!item.plan && !item.plan_structured) return;
+  const handleSelectHistoryItem = async (item) => {
+    if (!item.has_plan || !user?.id) return;
     if (selectedPlan?.id === item.id) {
       setSelectedPlan(null);
       setFocusedPoiId(null);
@@ -414,14 +435,22 @@ function App() {
       setCollapsedDays({});
       return;
     }
-    setCurrentPlanData(null);
-    setCurrentPlanText('');
-    setSelectedPlan(item);
-    setActivePanel('plan');
-    const first = findFirstCoordinate(item.plan_structured);
-    setFocusedDayIndex(first?.dayIndex ?? null);
-    setFocusedPoiId(first?.id ?? null);
-    setCollapsedDays({});
+    setLoadingPlanId(item.id);
+    try {
+      const detail = await fetchPlanDetail(item.id);
+      setCurrentPlanData(null);
+      setCurrentPlanText('');
+      setSelectedPlan(detail);
+      setActivePanel('plan');
+      const first = findFirstCoordinate(detail.plan_structured);
+      setFocusedDayIndex(first?.dayIndex ?? null);
+      setFocusedPoiId(first?.id ?? null);
+      setCollapsedDays({});
+    } catch (e) {
+      window.alert(e.message || '加载行程失败');
+    } finally {
+      setLoadingPlanId(null);
+    }
   };
 
   const handleFocusPoi = (poi) => {
@@ -509,7 +538,7 @@ function App() {
                         border: selectedPlan?.id === item.id ? '2px solid #3b82f6' : '2px solid #e2e8f0', 
                         borderRadius: 12, 
                         transition: 'all 0.2s',
-                        cursor: (item.plan || item.plan_structured) ? 'pointer' : 'default',
+                        cursor: item.has_plan ? 'pointer' : 'default',
                         background: selectedPlan?.id === item.id 
                           ? 'linear-gradient(135deg, #eff6ff 0%, #dbeafe 100%)' 
                           : 'linear-gradient(135deg, #ffffff 0%, #f8fafc 100%)',
@@ -519,7 +548,7 @@ function App() {
                       }}
                       onClick={() => handleSelectHistoryItem(item)}
                       onMouseOver={(e) => { 
-                        if ((item.plan || item.plan_structured) && selectedPlan?.id !== item.id) {
+                        if (item.has_plan && selectedPlan?.id !== item.id) {
                           e.currentTarget.style.border = '2px solid #93c5fd';
                           e.currentTarget.style.boxShadow = '0 4px 12px rgba(147, 197, 253, 0.2)';
                           e.currentTarget.style.transform = 'translateY(-2px)';
@@ -547,6 +576,11 @@ function App() {
                           }}>
                             {item.text || '无文本'}
                           </div>
+                          {(item.destination || item.days) && (
+                            <div style={{ color: '#475569', fontSize: 12 }}>
+                              📍 {[item.destination, item.days ? `${item.days} 天` : null].filter(Boolean).join(' · ')}
+                            </div>
+                          )}
                           {item.created_at && (
                             <div style={{ 
                               marginTop: 8, 
@@ -566,7 +600,7 @@ function App() {
                               })}</span>
                             </div>
                           )}
-                          {(item.plan || item.plan_structured) && (
+                          {item.has_plan && (
                             <div style={{ 
                               marginTop: 10, 
                               padding: '6px 12px',
@@ -581,11 +615,11 @@ function App() {
                               alignItems: 'center',
                               gap: 4
                             }}>
-                              {selectedPlan?.id === item.id ? '✓ 已展开' : '👆 点击查看行程'}
+                              {selectedPlan?.id === item.id ? '✓ 已展开' : loadingPlanId === item.id ? '加载中…' : '👆 点击查看行程'}
                             </div>
                           )}
                         </div>
-                        {(item.plan || item.plan_structured) && (
+                        {item.has_plan && (
                           <button
                             onClick={(e) => { e.stopPropagation(); deletePlan(item.id); }}
                             disabled={isDeletingPlanId === item.id}
@@ -619,6 +653,24 @@ function App() {
                   ))}
                 </ul>
               )}
+              {historyCursor && user?.id && (
+                <button
+                  onClick={() => fetchHistory(user.id, historyCursor)}
+                  style={{
+                    marginTop: 12,
+                    width: '100%',
+                    padding: '8px 12px',
+                    borderRadius: 8,
+                    border: '1px solid #cbd5e1',
+                    background: '#f8fafc',
+                    color: '#475569',
+                    fontSize: 13,
+                    cursor: 'pointer'
+                  }}
+                >
+                  加载更多
+                </button>
+              )}
             </div>
 
             {/* 识别区域 / 预算管理区域 */}
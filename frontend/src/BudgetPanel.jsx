@@ -17,6 +17,7 @@ function BudgetPanel({ user, history = [] }) {
   const [budgetSummary, setBudgetSummary] = useState(null);
   const [isLoadingBudgets, setIsLoadingBudgets] = useState(false);
   const [isLoadingExpenses, setIsLoadingExpenses] = useState(false);
+  const [isLoadingMoreExpenses, setIsLoadingMoreExpenses] = useState(false);
   const [error, setError] = useState('');
   const [budgetForm, setBudgetForm] = useState({
     totalBudget: '',
@@ -42,6 +43,8 @@ function BudgetPanel({ user, history = [] }) {
   const expenseSampleRateRef = useRef(null);
 
   const normalizedHistory = Array.isArray(history) ? history : [];
+  // 只有已写入的行程才能关联：排除仍在写入队列中的条目（id 为 "pending-N"）和只有语音文本的记录
+  const linkablePlans = normalizedHistory.filter((item) => item.has_plan && Number.isInteger(item.id));
 
   useEffect(() => {
     if (!user?.id) {
@@ -82,23 +85,36 @@ function BudgetPanel({ user, history = [] }) {
     }
   };
 
-  const fetchBudgetDetails = async (budgetId, userId) => {
-    setIsLoadingExpenses(true);
-    setExpenseStatus('');
-    setExpenseError('');
+  const fetchBudgetDetails = async (budgetId, userId, cursor = null) => {
+    if (cursor) {
+      setIsLoadingMoreExpenses(true);
+    } else {
+      setIsLoadingExpenses(true);
+      setExpenseStatus('');
+      setExpenseError('');
+    }
     try {
-      const res = await fetch(
-        `http://localhost:8000/expenses?user_id=${encodeURIComponent(userId)}&budget_id=${encodeURIComponent(budgetId)}`
-      );
+      const params = new URLSearchParams({ user_id: userId, budget_id: budgetId });
+      if (cursor) params.set('cursor', cursor);
+      const res = await fetch(`http://localhost:8000/expenses?${params.toString()}`);
       if (!res.ok) {
         throw new Error(`获取开销失败，状态码 ${res.status}`);
       }
       const data = await res.json();
-      setBudgetSummary(data);
+      // 开销按页返回（默认 50 条），后续页追加到已加载的列表后面；汇总数据始终覆盖整个预算
+      setBudgetSummary((prev) => (
+        cursor && prev?.budget?.id === data.budget?.id
+          ? { ...data, items: [...(prev.items || []), ...(data.items || [])] }
+          : data
+      ));
     } catch (e) {
       setExpenseError(e.message || '获取开销失败');
     } finally {
-      setIsLoadingExpenses(false);
+      if (cursor) {
+        setIsLoadingMoreExpenses(false);
+      } else {
+        setIsLoadingExpenses(false);
+      }
     }
   };
 
@@ -398,7 +414,7 @@ function BudgetPanel({ user, history = [] }) {
               style={{ ...inputStyle, flex: 1 }}
             >
               <option value="">不关联行程</option>
-              {normalizedHistory.map((item) => (
+              {linkablePlans.map((item) => (
                 <option key={item.id} value={item.id}>
                   {renderPlanOptionLabel(item)}
                 </option>
@@ -560,7 +576,16 @@ function BudgetPanel({ user, history = [] }) {
                   {Object.entries(budgetSummary.by_category).map(([category, amount]) => (
                     <div key={category} style={{ display: 'flex', justifyContent: 'space-between', fontSize: 14, color: '#475569' }}>
                       <span>{categoryLabel(category)}</span>
-                      <span>{budgetSummary.currency || 'CNY'} {amount.toLocaleString(undefined, { minimumFractionDigits: 0, maximumFractionDigits: 2 })}</span>
+                      <span>
+                        {budgetSummary.currency || 'CNY'} {amount.toLocaleString(undefined, { minimumFractionDigits: 0, maximumFractionDigits: 2 })}
+                        {Object.entries(budgetSummary.by_category_currency?.[category] || {})
+                          .filter(([currency]) => currency !== (budgetSummary.currency || 'CNY'))
+                          .map(([currency, original]) => (
+                            <span key={currency} style={{ marginLeft: 8, fontSize: 12, color: '#94a3b8' }}>
+                              (含 {currency} {original.toLocaleString(undefined, { minimumFractionDigits: 0, maximumFractionDigits: 2 })})
+                            </span>
+                          ))}
+                      </span>
                     </div>
                   ))}
                 </div>
@@ -696,6 +721,24 @@ function BudgetPanel({ user, history = [] }) {
                       )}
                     </div>
                   ))}
+                  {budgetSummary.next_cursor && (
+                    <button
+                      onClick={() => fetchBudgetDetails(selectedBudgetId, user.id, budgetSummary.next_cursor)}
+                      disabled={isLoadingMoreExpenses}
+                      style={{
+                        width: '100%',
+                        padding: '8px 12px',
+                        borderRadius: 8,
+                        border: '1px solid #cbd5e1',
+                        background: '#f8fafc',
+                        color: '#475569',
+                        fontSize: 13,
+                        cursor: isLoadingMoreExpenses ? 'not-allowed' : 'pointer'
+                      }}
+                    >
+                      {isLoadingMoreExpenses ? '加载中...' : '加载更多'}
+                    </button>
+                  )}
                 </div>
               ) : (
                 <div style={{ padding: 20, borderRadius: 10, border: '1px dashed #cbd5e1', textAlign: 'center', color: '#94a3b8', fontSize: 13 }}>